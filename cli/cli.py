@@ -19,7 +19,7 @@ class CLI(click.MultiCommand):
 
         for filename in os.listdir(cmd_folder):
             if filename.endswith('.py') and filename.startswith(cmd_prefix):
-                commands.append(filename[4:-3])
+                commands.append(filename[4:-3].replace('_', '-'))
 
         commands.sort()
 
@@ -35,7 +35,8 @@ class CLI(click.MultiCommand):
         """
         ns = {}
 
-        filename = os.path.join(cmd_folder, cmd_prefix + name + '.py')
+        filename = os.path.join(cmd_folder,
+                                cmd_prefix + name.replace('-', '_') + '.py')
 
         with open(filename) as f:
             code = compile(f.read(), filename, 'exec')
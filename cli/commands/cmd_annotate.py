@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import click
+
+from ensimpl_snps.utils import configure_logging, get_logger, open_resource
+from ensimpl_snps.fetch import annotate
+import ensimpl_snps.db_config as db_config
+
+
+@click.command('annotate', options_metavar='<options>',
+               short_help='add snp ids to a vcf or tsv file')
+@click.argument('input_file', metavar='<input>')
+@click.option('-o', '--output', default='-',
+              help='file to write, compressed if it ends with .gz')
+@click.option('-d', '--directory', default=None,
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('-s', '--species', default='Mm')
+@click.option('--ver', required=True, type=int)
+@click.option('-f', '--format', 'fmt', default='vcf',
+              type=click.Choice(annotate.FORMATS))
+@click.option('--chrom-col', default=1, type=int)
+@click.option('--pos-col', default=2, type=int)
+@click.option('--ref-col', default=None, type=int)
+@click.option('--alt-col', default=None, type=int)
+@click.option('--header', is_flag=True, default=False,
+              help='the first tsv line holds the column names')
+@click.option('--source', default='tabix', type=click.Choice(['tabix', 'db']))
+@click.option('--sorted/--unsorted', 'presorted', default=None,
+              help='skip checking if the input is coordinate sorted')
+@click.option('--buffer-size', default=annotate.SORT_BUFFER_SIZE, type=int,
+              help='rows sorted in memory when the input is not sorted')
+@click.option('--tmp-dir', default=None,
+              type=click.Path(file_okay=False, exists=True, dir_okay=True))
+@click.option('-v', '--verbose', count=True)
+def cli(input_file, output, directory, species, ver, fmt, chrom_col, pos_col,
+        ref_col, alt_col, header, source, presorted, buffer_size, tmp_dir,
+        verbose):
+    """
+    Annotate the rows of <input>, a VCF or TSV file, "-" for stdin, with the
+    ids of the snps at their positions.  Coordinate sorted input is merge
+    joined in one pass, any other input is sorted first.
+    """
+    configure_logging(verbose)
+    LOG = get_logger()
+
+    db_config.init(directory)
+
+    parser = annotate.RowParser(fmt, chrom_col, pos_col, ref_col, alt_col,
+                                header)
+
+    if output == '-':
+        out = click.get_text_stream('stdout')
+    else:
+        out = open_resource(output, 'wt')
+
+    try:
+        stats = annotate.annotate_file(input_file, out, ver, species, parser,
+                                       source, presorted, buffer_size,
+                                       tmp_dir)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        if output != '-':
+            out.close()
+
+    LOG.info("Throughput: {:,.0f} rows/s".format(stats['rows_per_second']))
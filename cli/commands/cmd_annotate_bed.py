@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+
+import click
+
+from ensimpl_snps.utils import configure_logging, format_time, get_logger
+from ensimpl_snps.fetch import annotate
+import ensimpl_snps.db_config as db_config
+
+
+@click.command('annotate-bed', options_metavar='<options>',
+               short_help='list the snps in the intervals of a bed file')
+@click.argument('bed', metavar='<bed>', type=click.File('r'))
+@click.option('-d', '--directory', default=None,
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('-s', '--species', default='Mm')
+@click.option('--ver', required=True, type=int)
+@click.option('--counts', is_flag=True, default=False,
+              help='only count the snps in each interval')
+@click.option('--gap', default=annotate.MERGE_GAP, type=int,
+              help='read intervals closer than this with one fetch')
+@click.option('-v', '--verbose', count=True)
+def cli(bed, directory, species, ver, counts, gap, verbose):
+    """
+    Annotate the intervals in <bed>, "-" for stdin, with the snps in them.
+    Each interval is written with one snp per line, or with the number of
+    snps in it with --counts, ordered by chromosome and position.
+    """
+    configure_logging(verbose)
+    LOG = get_logger()
+
+    db_config.init(directory)
+
+    tstart = time.time()
+
+    try:
+        intervals = annotate.read_bed(bed)
+        LOG.info('{:,} intervals read'.format(len(intervals)))
+
+        out = sys.stdout
+        rows = 0
+        for interval, found in annotate.annotate_bed(intervals, ver, species,
+                                                     counts, gap):
+            if counts:
+                out.write('{}\t{}\n'.format('\t'.join(interval.fields), found))
+            else:
+                out.write('{}\t{}\n'.format('\t'.join(interval.fields),
+                                            '\t'.join(map(str, found[1:]))))
+            rows += 1
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    tend = time.time()
+
+    LOG.info("{:,} lines written in: {}".format(rows, format_time(tstart,
+                                                                   tend)))
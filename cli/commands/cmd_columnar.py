@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import click
+from tabulate import tabulate
+
+from ensimpl_snps.utils import configure_logging, format_time, get_logger
+import ensimpl_snps.create.columnar_db as columnar_db
+
+
+@click.command('columnar', options_metavar='<options>',
+               short_help='create the columnar snp stores')
+@click.option('-d', '--directory', default='.',
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('-s', '--species', multiple=True)
+@click.option('--ver', multiple=True)
+@click.option('--benchmark', is_flag=True, default=False,
+              help='compare size and cold cache latency with the database')
+@click.option('-n', '--num-queries', default=100, type=int)
+@click.option('-v', '--verbose', count=True)
+def cli(directory, species, ver, benchmark, num_queries, verbose):
+    """
+    Creates the columnar snp store of every ensimpl snps database in
+    <directory>.
+    """
+    configure_logging(verbose)
+    LOG = get_logger()
+
+    LOG.info("Creating columnar stores...")
+
+    tstart = time.time()
+    stores = columnar_db.create(directory, list(ver) if ver else None,
+                                list(species) if species else None)
+    tend = time.time()
+
+    LOG.info("Creation time: {}".format(format_time(tstart, tend)))
+
+    if not benchmark:
+        return
+
+    for store in stores:
+        db = store[:-len('.snpc')] + '.db3'
+        vcfs = [os.path.join(os.path.dirname(store), f)
+                for f in sorted(os.listdir(os.path.dirname(store)))
+                if f.endswith('.gz') and
+                os.path.isfile(os.path.join(os.path.dirname(store),
+                                            f + '.tbi'))]
+
+        print(store)
+        print(tabulate(columnar_db.benchmark(db, store,
+                                             vcfs[0] if vcfs else None,
+                                             num_queries),
+                       headers='keys'))
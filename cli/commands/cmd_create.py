@@ -12,11 +12,25 @@ import ensimpl_snps.create.create_ensimpl_snps as create_ensimpl_snps
 @click.option('-d', '--directory', default='.',
               type=click.Path(file_okay=False, exists=True,
                               resolve_path=True, dir_okay=True))
+@click.option('-b', '--base-directory', default=None,
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True),
+              help='build from the previous release found here')
 @click.option('-r', '--resource', default=create_ensimpl_snps.DEFAULT_CONFIG)
 @click.option('-s', '--species', multiple=True)
 @click.option('--ver', multiple=True)
+@click.option('--shards', is_flag=True, default=False,
+              help='also split each database into per chromosome shards')
+@click.option('-f', '--field', 'fields', multiple=True,
+              help='optional VCF field to store, QUAL, FILTER or an INFO key')
+@click.option('-g', '--genotypes', default=None,
+              help='also store the strain genotypes of this sorted '
+                   'multi-sample VCF file')
+@click.option('--strain', 'strains', multiple=True,
+              help='sample of the genotypes to store, default is all of them')
 @click.option('-v', '--verbose', count=True)
-def cli(directory, resource, species, ver, verbose):
+def cli(directory, base_directory, resource, species, ver, shards, fields,
+        genotypes, strains, verbose):
     """
     Creates a new ensimpl snps database <filename> using Ensembl <version> and species <species>.
     """
@@ -36,7 +50,10 @@ def cli(directory, resource, species, ver, verbose):
     LOG.info("Creating database...")
 
     tstart = time.time()
-    create_ensimpl_snps.create(ensembl_versions, ensembl_species, directory, resource)
+    create_ensimpl_snps.create(ensembl_versions, ensembl_species, directory,
+                               resource, base_directory, shards,
+                               list(fields), genotypes,
+                               list(strains) if strains else None)
     tend = time.time()
 
     LOG.info("Creation time: {}".format(format_time(tstart, tend)))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+
+from ensimpl_snps.utils import configure_logging, format_time, get_logger
+import ensimpl_snps.create.diff_db as diff_db
+
+
+@click.command('diff', options_metavar='<options>',
+               short_help='create the snp differences between releases')
+@click.option('-d', '--directory', default='.',
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('--from', 'from_version', required=True, type=int)
+@click.option('--to', 'to_version', required=True, type=int)
+@click.option('-s', '--species', multiple=True)
+@click.option('-v', '--verbose', count=True)
+def cli(directory, from_version, to_version, species, verbose):
+    """
+    Creates the snp differences between Ensembl <from> and <to> from the
+    ensimpl snps databases in <directory>.
+    """
+    configure_logging(verbose)
+    LOG = get_logger()
+
+    LOG.info("Creating differences...")
+
+    tstart = time.time()
+    diff_db.create(directory, from_version, to_version,
+                   list(species) if species else None)
+    tend = time.time()
+
+    LOG.info("Creation time: {}".format(format_time(tstart, tend)))
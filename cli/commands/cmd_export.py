@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+
+from ensimpl_snps.utils import configure_logging, format_time, get_logger
+import ensimpl_snps.create.export_snps as export_snps
+
+
+@click.command('export', options_metavar='<options>',
+               short_help='export snps to parquet or arrow')
+@click.option('-d', '--directory', default='.',
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('-o', '--output', required=True,
+              type=click.Path(file_okay=False, resolve_path=True,
+                              dir_okay=True))
+@click.option('-f', '--format', 'fmt', default='parquet',
+              type=click.Choice(sorted(export_snps.FORMATS)))
+@click.option('--source', default='db',
+              type=click.Choice(export_snps.SOURCES))
+@click.option('-c', '--compression', default='zstd')
+@click.option('--row-group-size', default=export_snps.ROW_GROUP_SIZE,
+              type=int)
+@click.option('-s', '--species', multiple=True)
+@click.option('--ver', multiple=True)
+@click.option('-v', '--verbose', count=True)
+def cli(directory, output, fmt, source, compression, row_group_size, species,
+        ver, verbose):
+    """
+    Exports the snps of the releases in <directory> to <output>, partitioned
+    by chromosome.
+    """
+    configure_logging(verbose)
+    LOG = get_logger()
+
+    LOG.info("Exporting snps...")
+
+    tstart = time.time()
+    try:
+        export_snps.export(directory, output, list(ver) if ver else None,
+                           list(species) if species else None, fmt, source,
+                           compression, row_group_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    tend = time.time()
+
+    LOG.info("Export time: {}".format(format_time(tstart, tend)))
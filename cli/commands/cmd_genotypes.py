@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+
+from ensimpl_snps.utils import configure_logging, format_time, get_logger
+import ensimpl_snps.create.genotype_db as genotype_db
+
+
+@click.command('genotypes', options_metavar='<options>',
+               short_help='store the strain genotypes of a multi-sample vcf')
+@click.option('-d', '--directory', default='.',
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('-g', '--genotypes', 'vcf_file', required=True,
+              help='sorted multi-sample VCF file of the strain genotypes')
+@click.option('-s', '--species', multiple=True, default=['Mm'],
+              show_default=True)
+@click.option('--ver', multiple=True)
+@click.option('--strain', 'strains', multiple=True,
+              help='sample to store, default is all of them')
+@click.option('-v', '--verbose', count=True)
+def cli(directory, vcf_file, species, ver, strains, verbose):
+    """
+    Creates the 2 bit packed strain genotype matrices of every ensimpl snps
+    database in <directory> from a multi-sample VCF file.
+    """
+    configure_logging(verbose)
+    LOG = get_logger()
+
+    LOG.info("Creating genotypes...")
+
+    tstart = time.time()
+    genotype_db.create(directory, vcf_file, list(ver) if ver else None,
+                       list(species) if species else None,
+                       list(strains) if strains else None)
+    tend = time.time()
+
+    LOG.info("Creation time: {}".format(format_time(tstart, tend)))
@@ -4,12 +4,16 @@ from tabulate import tabulate
 
 from ensimpl_snps.utils import configure_logging, get_logger
 from ensimpl_snps.fetch import get
+import ensimpl_snps.db_config as db_config
 
 
 @click.command('info', short_help='stats on database')
+@click.option('-d', '--directory', default=None,
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
 @click.option('--ver', default=None)
 @click.option('-v', '--verbose', count=True)
-def cli(ver, verbose):
+def cli(directory, ver, verbose):
     """
     Stats annotation database <filename> for <term>
     """
@@ -17,11 +21,15 @@ def cli(ver, verbose):
     LOG = get_logger()
     LOG.debug("Stats database...")
 
+    db_config.init(directory)
+
     statistics = get.info(ver)
 
     print('Version: {}'.format(statistics['version']))
     for (k, v) in sorted(statistics['species'].items()):
         print('Species: {} {}'.format(k, v['assembly']))
-        print(tabulate(v['stats']))
-
+        print('SNPs: {:,}'.format(v['num_snps']))
+        print('Database size: {:,} bytes'.format(v['db_size']))
+        print('VCF size: {:,} bytes'.format(v['vcf_size']))
+        print(tabulate(v['stats'], headers='keys'))
 
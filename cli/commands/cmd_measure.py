@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+import time
+
+import click
+from tabulate import tabulate
+
+# run in a fresh interpreter so nothing is imported before the timing starts
+COLD_START = '''
+import json, sys, time
+start = time.perf_counter()
+from ensimpl_snps.app import create_app
+imported = time.perf_counter()
+create_app()
+created = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_ms': (created - imported) * 1000,
+    'pysam': 'pysam' in sys.modules,
+    'debug_toolbar': 'flask_debugtoolbar' in sys.modules
+}))
+'''
+
+
+def percentile(values, pct):
+    """Get the `pct` percentile of sorted `values`."""
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+@click.command('measure', options_metavar='<options>',
+               short_help='time start up and requests of the web app')
+@click.argument('urls', metavar='<url>', nargs=-1)
+@click.option('-d', '--directory', default=None,
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('--settings', default=None,
+              type=click.Path(dir_okay=False, exists=True,
+                              resolve_path=True),
+              help='settings file, like config/production.py')
+@click.option('-n', '--requests', 'num_requests', default=200, type=int,
+              help='requests to time for each url')
+@click.option('--starts', default=3, type=int, help='cold starts to time')
+def cli(urls, directory, settings, num_requests, starts):
+    """
+    Time the cold start of the web application and the requests to each
+    <url>, "/api/versions" if none is given, with the settings file given
+    by --settings or ENSIMPL_SNPS_SETTINGS.  Run it with the development and
+    production settings to compare them.
+    """
+    if directory:
+        os.environ['ENSIMPL_SNPS_DIR'] = directory
+
+    if settings:
+        os.environ['ENSIMPL_SNPS_SETTINGS'] = settings
+
+    rows = []
+    for _ in range(starts):
+        output = subprocess.check_output([sys.executable, '-c', COLD_START],
+                                         stderr=subprocess.DEVNULL)
+        rows.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+    print(tabulate(rows, headers='keys', floatfmt='.1f'))
+    print()
+
+    from ensimpl_snps.app import create_app
+
+    client = create_app().test_client()
+    rows = []
+
+    for url in urls or ['/api/versions']:
+        # the first request opens files and fills caches
+        response = client.get(url)
+        if response.status_code != 200:
+            raise click.ClickException('{} returned {}'.format(
+                url, response.status_code))
+
+        times = []
+        for _ in range(num_requests):
+            start = time.perf_counter()
+            client.get(url)
+            times.append((time.perf_counter() - start) * 1000)
+
+        times.sort()
+        rows.append([url, sum(times) / len(times), percentile(times, 50),
+                     percentile(times, 95), percentile(times, 99)])
+
+    print(tabulate(rows, headers=['url', 'mean ms', 'p50 ms', 'p95 ms',
+                                  'p99 ms'], floatfmt='.3f'))
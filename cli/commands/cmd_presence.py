@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+
+from ensimpl_snps.utils import configure_logging, format_time, get_logger
+import ensimpl_snps.create.presence_db as presence_db
+
+
+@click.command('presence', options_metavar='<options>',
+               short_help='create the cross release presence index')
+@click.option('-d', '--directory', default='.',
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('-s', '--species', multiple=True)
+@click.option('-v', '--verbose', count=True)
+def cli(directory, species, verbose):
+    """
+    Creates or updates the index of the Ensembl releases every SNP is in from
+    all ensimpl snps databases in <directory>.
+    """
+    configure_logging(verbose)
+    LOG = get_logger()
+
+    LOG.info("Creating presence index...")
+
+    tstart = time.time()
+    presence_db.create(directory, list(species) if species else None)
+    tend = time.time()
+
+    LOG.info("Creation time: {}".format(format_time(tstart, tend)))
@@ -1,93 +1,130 @@
 # -*- coding: utf-8 -*-
+import csv
+import json
 import sys
 import time
 
 import click
-import json
-from tabulate import tabulate
 
 from ensimpl_snps.utils import configure_logging, format_time, get_logger
 from ensimpl_snps.fetch import search as search_ensimpl
+import ensimpl_snps.db_config as db_config
+
+HEADERS = ['chrom', 'pos', 'id', 'ref', 'alt']
+
 
+def read_ids(stream, chunk_size):
+    """Read SNP identifiers, the first word of every line, in chunks.  Blank
+    lines and lines starting with "#" are skipped.
 
-@click.command('search', short_help='search for data')
-@click.argument('term', metavar='<term>')
-@click.option('-e', '--exact', is_flag=True)
-@click.option('-f', '--format', 'display', default='pretty',
-              type=click.Choice(['tab', 'csv', 'json', 'pretty']))
-@click.option('-m', '--max', default=-1)
-@click.option('-s', '--species', type=click.Choice(['mm', 'hs']))
-@click.option('--ver', default=None)
+    Args:
+        stream (file): The open input.
+        chunk_size (int): The number of ids in a chunk.
+
+    Yields:
+        list: The ids of each chunk.
+    """
+    chunk = []
+    for line in stream:
+        words = line.split()
+        if not words or words[0].startswith('#'):
+            continue
+
+        chunk.append(words[0])
+
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def latest_version(species):
+    """Get the most recent version available for `species`."""
+    for db in db_config.ENSIMPL_SNPS_DBS:
+        if db['species'] == species:
+            return int(db['version'])
+
+    raise click.ClickException('No database found for species '
+                               '{}'.format(species))
+
+
+@click.command('search', short_help='search for snps by id')
+@click.argument('ids', metavar='<id>', nargs=-1)
+@click.option('-d', '--directory', default=None,
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('-i', '--input', 'input_file', default=None,
+              type=click.File('r'),
+              help='file of ids, one per line, "-" for stdin')
+@click.option('-f', '--format', 'display', default='tsv',
+              type=click.Choice(['tsv', 'csv', 'jsonl']))
+@click.option('-s', '--species', default='Mm')
+@click.option('--ver', default=None, type=int)
+@click.option('-c', '--chunk-size', default=10000, type=int)
+@click.option('-w', '--workers', default=1, type=int)
+@click.option('--not-found', default=None, type=click.File('w'),
+              help='file to write the ids that were not found to')
 @click.option('-v', '--verbose', count=True)
-def cli(term, ver, exact, display, max, species, verbose):
+def cli(ids, directory, input_file, display, species, ver, chunk_size,
+        workers, not_found, verbose):
     """
-    Search ensimpl database <filename> for <term>
+    Search the ensimpl snps databases for the snps with the ids <id> or the
+    ids read from a file, streaming the snps found to stdout.
     """
     configure_logging(verbose)
     LOG = get_logger()
     LOG.info("Search database...")
 
-    maximum = max if max >= 0 else None
+    if not ids and not input_file:
+        input_file = click.get_text_stream('stdin')
+
+    db_config.init(directory)
+
+    if ver is None:
+        ver = latest_version(species)
+
+    if input_file:
+        id_chunks = read_ids(input_file, chunk_size)
+    else:
+        id_chunks = [list(ids)]
+
+    out = sys.stdout
+
+    if display == 'csv':
+        writer = csv.writer(out)
+        write = writer.writerow
+    elif display == 'tsv':
+        write = lambda row: out.write('\t'.join(map(str, row)) + '\n')
+    else:
+        write = lambda row: out.write(json.dumps(dict(zip(HEADERS, row)))
+                                      + '\n')
+
+    if display != 'jsonl':
+        write(HEADERS)
+
+    tstart = time.time()
+    num_snps = 0
+    num_not_found = 0
 
     try:
-        tstart = time.time()
-        result = search_ensimpl.search(term, ver, species, exact, maximum)
-        tend = time.time()
-
-        LOG.debug("Num Results: {}".format(result.num_results))
-        count = 0
-
-        if len(result.matches) == 0:
-            print("No results found")
-            sys.exit()
-
-        headers = ["ID", "SYMBOL", "IDS", "POSITION", "MATCH_REASON",
-                   "MATCH_VALUE"]
-        tbl = []
-
-        if display in ('tab', 'csv'):
-            delim = '\t' if display == 'tab' else ','
-            print(delim.join(headers))
-
-        for match in result.matches:
-            line = list()
-            line.append(match.ensembl_gene_id)
-            line.append(match.symbol)
-
-            if match.external_ids:
-                ext_ids = []
-                for ids in match.external_ids:
-                    ext_ids.append('{}/{}'.format(ids['db'], ids['db_id']))
-                line.append('||'.join(ext_ids))
-            else:
-                line.append('')
-
-            line.append("{}:{}-{}".format(match.chromosome,
-                                          match.position_start,
-                                          match.position_end))
-            line.append(match.match_reason)
-            line.append(match.match_value)
-
-            if display in ('tab', 'csv'):
-                print(delim.join(map(str, line)))
-            elif display == 'json':
-                tbl.append(dict(zip(headers, line)))
-            else:
-                tbl.append(line)
-
-            count += 1
-            if count >= max > 0:
-                break
-
-        if display in ('tab', 'csv'):
-            pass
-        elif display == 'json':
-            print(json.dumps({'data': tbl}, indent=4))
-        else:
-            print(tabulate(tbl, headers))
-
-        LOG.info("Search time: {}".format(format_time(tstart, tend)))
+        for result in search_ensimpl.lookup_ids(id_chunks, ver, species,
+                                                workers):
+            for snp in result['snps']:
+                write(snp)
+
+            if not_found:
+                for snp_id in result['snps_not_found']:
+                    not_found.write(snp_id + '\n')
 
+            num_snps += len(result['snps'])
+            num_not_found += len(result['snps_not_found'])
     except Exception as e:
-        LOG.error('Error: {}'.format(e))
+        raise click.ClickException(str(e))
+
+    tend = time.time()
 
+    LOG.info("{:,} snps found, {:,} ids not found".format(num_snps,
+                                                          num_not_found))
+    LOG.info("Search time: {}".format(format_time(tstart, tend)))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import time
+
+import click
+
+from ensimpl_snps.utils import configure_logging, format_time, get_logger
+import ensimpl_snps.create.shard_db as shard_db
+
+
+@click.command('shard', options_metavar='<options>',
+               short_help='create the per chromosome snp shards')
+@click.option('-d', '--directory', default='.',
+              type=click.Path(file_okay=False, exists=True,
+                              resolve_path=True, dir_okay=True))
+@click.option('-s', '--species', multiple=True)
+@click.option('--ver', multiple=True)
+@click.option('-w', '--workers', default=None, type=int,
+              help='shards written at the same time, default is all CPUs')
+@click.option('-v', '--verbose', count=True)
+def cli(directory, species, ver, workers, verbose):
+    """
+    Creates the per chromosome shards and the id router of every ensimpl snps
+    database in <directory>.
+    """
+    configure_logging(verbose)
+    LOG = get_logger()
+
+    LOG.info("Creating shards...")
+
+    tstart = time.time()
+    shard_db.create(directory, list(ver) if ver else None,
+                    list(species) if species else None, workers)
+    tend = time.time()
+
+    LOG.info("Creation time: {}".format(format_time(tstart, tend)))
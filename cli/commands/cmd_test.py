@@ -1,12 +1,11 @@
 # -*- coding: utf-8 -*-
-import os
 import subprocess
 
 import click
 
 
 @click.command()
-@click.argument('path', default=os.path.join('qtlweb', 'tests'))
+@click.argument('path', default='tests')
 def cli(path):
     """
     Run tests with Pytest.
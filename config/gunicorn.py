@@ -4,4 +4,9 @@ bind = '0.0.0.0:8000'
 accesslog = '-'
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" in %(D)sµs'
 # loglevel = 'debug'
-workers = 1
\ No newline at end of file
+workers = 1
+
+# identical requests are only coalesced when they run in the same process,
+# threads let a worker serve them at the same time, the same as
+# ADMISSION_THREADS in settings.py
+threads = 16
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""Production settings, loaded over config/settings.py with:
+
+    ENSIMPL_SNPS_SETTINGS=/path/to/config/production.py
+"""
+
+DEBUG = False
+
+# the debug toolbar is not imported at all
+DEBUG_TB_ENABLED = False
+
+LOG_LEVEL = 'WARNING' # CRITICAL / ERROR / WARNING / INFO / DEBUG
+
+# log 1 in 100 of the events logged on every request, when their level is on
+LOG_SAMPLE_RATE = 0.01
+
+# hold traffic, with /ready, until the databases are in the page cache
+WARMUP = True
+WARMUP_HISTORY_RATE = 0.1
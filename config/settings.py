@@ -19,4 +19,64 @@ LOG_LEVEL = 'DEBUG' # CRITICAL / ERROR / WARNING / INFO / DEBUG
 #SERVER_NAME = '127.0.0.1:8000'
 #JSONIFY_PRETTYPRINT_REGULAR = False
 
-JSONIFY_PRETTYPRINT_REGULAR=False
\ No newline at end of file
+JSONIFY_PRETTYPRINT_REGULAR=False
+
+# compress responses with gzip, or zstd and brotli when zstandard and
+# brotli are installed, turn off when a proxy in front already compresses
+COMPRESS = True
+
+# responses smaller than this, in bytes, are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+
+# compression level of each encoding
+COMPRESS_LEVELS = {'gzip': 6, 'br': 4, 'zstd': 3}
+
+# levels for the paths starting with a prefix, region responses are large
+# so they are compressed faster
+COMPRESS_ENDPOINT_LEVELS = {
+    '/api/region': {'gzip': 4, 'br': 3, 'zstd': 1},
+}
+
+# run /api/region and /api/snps requests in a cheap and an expensive lane,
+# from their cost estimated from the tabix index or the number of ids
+ADMISSION = True
+
+# the most a cheap request can cost, in compressed blocks or ids, this is a
+# cost of 1
+ADMISSION_CHEAP_BLOCKS = 32
+ADMISSION_CHEAP_IDS = 10000
+
+# reject requests costing more than this with a 429, None for no limit
+ADMISSION_MAX_COST = None
+
+# requests running at a time, requests waiting, seconds waited before a 503
+# and the Retry-After seconds of each lane, the queues are cut down so the
+# requests running and waiting fit in ADMISSION_THREADS
+ADMISSION_LANES = {
+    'cheap': {'concurrency': 6, 'queue_size': 6, 'timeout': 5,
+              'retry_after': 1},
+    'expensive': {'concurrency': 2, 'queue_size': 2, 'timeout': 30,
+                  'retry_after': 30},
+}
+
+# the threads of a worker, the same as the gunicorn threads
+ADMISSION_THREADS = 16
+
+# share of the per request log events that are logged, 1.0 logs them all
+LOG_SAMPLE_RATE = 1.0
+
+# warm the page cache with the id indexes, tabix indexes and hot regions
+# when a worker starts, /ready returns a 503 until it is done
+WARMUP = False
+
+# regions to warm, one "version species region" per line
+WARMUP_REGIONS_FILE = None
+
+# the requested regions are appended to this file, a share of them given by
+# WARMUP_HISTORY_RATE, and the WARMUP_HOT_REGIONS most requested are warmed
+WARMUP_HISTORY_FILE = None
+WARMUP_HISTORY_RATE = 1.0
+WARMUP_HOT_REGIONS = 100
+
+# ids looked up in each database to read the id index pages
+WARMUP_ID_PROBES = 10000
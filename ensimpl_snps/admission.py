@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""Cost based admission control for the API.
+
+The cost of a request is estimated before it runs, from the number of
+compressed blocks of the tabix index a region spans or from the number of
+ids.  A cost of up to ``1`` runs in the cheap lane, anything more in the
+expensive lane, so a few large requests can not take every worker from the
+small ones.  Each lane runs a limited number of requests at a time and lets
+a limited number wait.  A request that finds the queue of its lane full is
+rejected with a 429, one that waits too long with a 503, both with a
+``Retry-After`` header.
+
+A waiting request holds a worker thread, so the queues are cut down until
+the requests running and waiting in both lanes fit in the worker threads.
+The expensive lane is cut first, expensive requests can then never hold the
+threads the cheap lane runs in.
+
+Example:
+    Register the extension with the application::
+
+        admission = AdmissionControl()
+        admission.init_app(app)
+"""
+import threading
+
+from flask import current_app
+from flask import g
+from flask import jsonify
+from flask import request
+
+from ensimpl_snps.fetch import search as search_ensimpl
+
+# SNPs found from this many compressed blocks, or this many ids, is the
+# most a cheap request can cost
+CHEAP_BLOCKS = 32
+CHEAP_IDS = 10000
+
+LANES = {
+    'cheap': {'concurrency': 6, 'queue_size': 6, 'timeout': 5,
+              'retry_after': 1},
+    'expensive': {'concurrency': 2, 'queue_size': 2, 'timeout': 30,
+                  'retry_after': 30}
+}
+
+# the worker threads of a process, the gunicorn threads
+THREADS = 16
+
+
+class Lane:
+    """Requests running, and waiting to run, with the same limits.
+
+    Attributes:
+        name (str): The lane name.
+        concurrency (int): The most requests running at a time.
+        queue_size (int): The most requests waiting at a time.
+        timeout (float): The most seconds a request waits.
+        retry_after (int): The seconds a rejected client is asked to wait.
+        waiting (int): The number of requests waiting.
+    """
+    def __init__(self, name, concurrency, queue_size, timeout, retry_after):
+        """Initialization.
+
+        Args:
+            name (str): The lane name.
+            concurrency (int): The most requests running at a time.
+            queue_size (int): The most requests waiting at a time.
+            timeout (float): The most seconds a request waits.
+            retry_after (int): The seconds a rejected client is asked to
+                wait.
+        """
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.waiting = 0
+
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a slot to run a request.
+
+        Returns:
+            int: ``None`` when the request can run, otherwise the status code
+            to reject it with, 429 if the queue is full or 503 if the wait
+            timed out.
+        """
+        if self._slots.acquire(blocking=False):
+            return None
+
+        with self._lock:
+            if self.waiting >= self.queue_size:
+                return 429
+            self.waiting += 1
+
+        try:
+            if self._slots.acquire(timeout=self.timeout):
+                return None
+            return 503
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def release(self):
+        """Free the slot of a request that has run."""
+        self._slots.release()
+
+
+def create_lanes(lanes, threads):
+    """Create the lanes, cutting down their queues so the requests running
+    and waiting in both lanes are no more than `threads`.  The queue of the
+    expensive lane is cut first.
+
+    Args:
+        lanes (dict): Lane name to the arguments of :class:`Lane`, a lane
+            that is missing gets those in :data:`LANES`.
+        threads (int): The worker threads.
+
+    Returns:
+        dict: Lane name to :class:`Lane`.
+
+    Raises:
+        ValueError: When the concurrency of the lanes is more than
+            `threads`.
+    """
+    lanes = {name: dict(lanes.get(name, LANES[name])) for name in LANES}
+
+    free = threads - sum(lane['concurrency'] for lane in lanes.values())
+
+    if free < 0:
+        raise ValueError('The lanes run {} requests at a time with {} '
+                         'threads'.format(threads - free, threads))
+
+    # the cheap queue takes the free threads first, the expensive queue is
+    # left with what remains
+    for name in ['cheap', 'expensive']:
+        lanes[name]['queue_size'] = min(lanes[name]['queue_size'], free)
+        free -= lanes[name]['queue_size']
+
+    return {name: Lane(name, **lane) for name, lane in lanes.items()}
+
+
+def region_cost(values, config):
+    """Estimate the cost of a ``/api/region`` or ``/api/genotypes``
+    request.
+
+    Args:
+        values (werkzeug.datastructures.MultiDict): The request parameters.
+        config (dict): The application configuration.
+
+    Returns:
+        float: The cost, relative to the most a cheap request can cost.
+    """
+    if values.get('mode') == 'estimate':
+        return 0
+
+    blocks = sum(search_ensimpl.estimate_region_blocks(region,
+                                                       values.get('version'),
+                                                       values.get('species'))
+                 for region in values.getlist('region'))
+
+    return blocks / config.get('ADMISSION_CHEAP_BLOCKS', CHEAP_BLOCKS)
+
+
+def ids_cost(values, config):
+    """Estimate the cost of a ``/api/snps`` request.
+
+    Args:
+        values (werkzeug.datastructures.MultiDict): The request parameters.
+        config (dict): The application configuration.
+
+    Returns:
+        float: The cost, relative to the most a cheap request can cost.
+    """
+    num_ids = len(values.getlist('ids'))
+
+    if values.get('mode') == 'estimate':
+        num_ids = min(num_ids, search_ensimpl.ESTIMATE_SAMPLE_SIZE)
+
+    return num_ids / config.get('ADMISSION_CHEAP_IDS', CHEAP_IDS)
+
+
+class AdmissionControl:
+    """Flask extension running the costly API endpoints in lanes.
+
+    Attributes:
+        estimators (dict): Endpoint name to a function estimating the cost of
+            a request, see :func:`region_cost`.  Other endpoints are not
+            limited.
+    """
+    def __init__(self, app=None):
+        """Initialization.
+
+        Args:
+            app (flask.Flask, optional): The Flask application object.
+        """
+        self.estimators = {
+            'api.genotypes': region_cost,
+            'api.region': region_cost,
+            'api.snps': ids_cost
+        }
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the request hooks unless ``ADMISSION`` is ``False``.
+
+        Args:
+            app (flask.Flask): The Flask application object.
+        """
+        if not app.config.get('ADMISSION', True):
+            return
+
+        app.extensions['admission'] = create_lanes(
+            app.config.get('ADMISSION_LANES', LANES),
+            app.config.get('ADMISSION_THREADS', THREADS))
+
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _before_request(self):
+        """Estimate the cost of the request and wait for its lane."""
+        estimator = self.estimators.get(request.endpoint)
+
+        if not estimator:
+            return None
+
+        try:
+            cost = estimator(request.values, current_app.config)
+        except Exception as e:
+            # the endpoint reports invalid parameters
+            current_app.logger.debug('Unable to estimate cost: {}'.format(e))
+            cost = 0
+
+        max_cost = current_app.config.get('ADMISSION_MAX_COST')
+        lanes = current_app.extensions['admission']
+        lane = lanes['cheap' if cost <= 1 else 'expensive']
+
+        current_app.logger.debug('{} cost {:.2f}, {} lane'.format(
+            request.endpoint, cost, lane.name))
+
+        if max_cost and cost > max_cost:
+            return self._reject(429, lane, 'Request is too expensive, '
+                                           'split it into smaller requests')
+
+        status = lane.acquire()
+
+        if status == 429:
+            return self._reject(status, lane, 'Too many requests waiting')
+        elif status == 503:
+            return self._reject(status, lane, 'Timed out waiting to run')
+
+        g.admission_lane = lane
+        return None
+
+    def _teardown_request(self, exception=None):
+        """Free the slot of the request."""
+        lane = g.pop('admission_lane', None)
+
+        if lane:
+            lane.release()
+
+    def _reject(self, status, lane, message):
+        """Make the response rejecting a request."""
+        current_app.logger.info('Rejected {} in {} lane: {}'.format(
+            request.endpoint, lane.name, message))
+
+        response = jsonify(message=message)
+        response.status_code = status
+        response.headers['Retry-After'] = str(lane.retry_after)
+        return response
@@ -6,10 +6,13 @@ from flask import render_template
 from flask import url_for
 
 import ensimpl_snps.db_config as db_config
+import ensimpl_snps.fetch.warmup as warmup
+import ensimpl_snps.utils as utils
 
-from ensimpl_snps.extensions import debug_toolbar
+from ensimpl_snps.extensions import admission
 from ensimpl_snps.modules.api.views import api
 from ensimpl_snps.modules.page.views import page
+from ensimpl_snps.utils import Compress
 from ensimpl_snps.utils import ReverseProxied
 from ensimpl_snps.utils import configure_logging
 
@@ -40,6 +43,7 @@ def create_app(settings_override=None):
     configure_logging()
 
     app.logger.setLevel(app.config['LOG_LEVEL'])
+    utils.LOG_SAMPLE_RATE = app.config.get('LOG_SAMPLE_RATE', 1.0)
 
     middleware(app)
 
@@ -49,6 +53,9 @@ def create_app(settings_override=None):
     extensions(app)
     error_templates(app)
 
+    # /ready reports not ready until this is done
+    warmup.start(app.config)
+
     return app
 
 
@@ -58,7 +65,13 @@ def extensions(app):
     Args:
         app (flask.Flask): The Flask application object.
     """
-    debug_toolbar.init_app(app)
+    admission.init_app(app)
+
+    # the toolbar is only imported when it is used, it is not needed to
+    # serve requests
+    if app.config.get('DEBUG_TB_ENABLED', app.debug):
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
 
     return None
 
@@ -69,6 +82,16 @@ def middleware(app):
     Args:
         app (flask.Flask): The Flask application object.
     """
+    if app.config.get('COMPRESS', True):
+        app.wsgi_app = Compress(
+            app.wsgi_app,
+            min_size=app.config.get('COMPRESS_MIN_SIZE',
+                                    utils.COMPRESS_MIN_SIZE),
+            levels=app.config.get('COMPRESS_LEVELS'),
+            endpoint_levels=app.config.get('COMPRESS_ENDPOINT_LEVELS'),
+            logger=app.logger)
+
+    # outermost, the paths are those seen by the application
     app.wsgi_app = ReverseProxied(app.wsgi_app)
 
     return None
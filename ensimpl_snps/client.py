@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""A client for the Ensimpl SNPs web API that only needs the standard
+library.
+
+Connections are kept alive and pooled, large lists of ids are split into
+POST requests of :data:`BATCH_SIZE` ids, and batches and regions are sent in
+parallel over at most ``max_connections`` connections.  Responses are
+requested gzip compressed.  Requests that fail because the server is busy or
+unreachable are retried with exponential backoff, honouring ``Retry-After``.
+Results always come back in the order they were asked for.
+
+Example:
+    >>> client = Client('http://localhost:8000', version=92, species='Mm')
+    >>> result = client.snps(['rs3683945', 'rs13476251'])
+    >>> region_snps = client.regions(['1:10M-11M', '2:5M-5.1M'])
+    >>> client.close()
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode, urlsplit
+
+import datetime
+import gzip
+import http.client
+import json
+import queue
+import random
+import socket
+import time
+
+DEFAULT_URL = 'http://localhost:8000'
+
+# number of ids in each POST request
+BATCH_SIZE = 5000
+
+MAX_CONNECTIONS = 8
+
+TIMEOUT = 60
+
+# retries and backoff, in seconds, for the status codes that mean the server
+# is busy or unavailable
+RETRIES = 5
+BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+RETRY_STATUS = (429, 502, 503, 504)
+
+
+class ClientError(Exception):
+    """Raised when a request fails.
+
+    Attributes:
+        status (int): The HTTP status code, ``None`` if there was no
+            response.
+    """
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class Client:
+    """A client for the Ensimpl SNPs web API.  A client can be shared between
+    threads.
+
+    Attributes:
+        url (str): The base url of the server.
+        version (int): The default Ensembl version.
+        species (str): The default Ensembl species identifier.
+    """
+    def __init__(self, url=DEFAULT_URL, version=None, species=None,
+                 max_connections=MAX_CONNECTIONS, batch_size=BATCH_SIZE,
+                 timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF):
+        """Initialization.
+
+        Args:
+            url (str, optional): The base url of the server.
+            version (int, optional): The default Ensembl version.
+            species (str, optional): The default Ensembl species identifier.
+            max_connections (int, optional): The most connections, and
+                requests, at the same time.
+            batch_size (int, optional): The number of ids in each request.
+            timeout (float, optional): The socket timeout in seconds.
+            retries (int, optional): The number of times to retry a request.
+            backoff (float, optional): The first retry delay in seconds,
+                doubled on every retry.
+        """
+        parts = urlsplit(url)
+
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('Invalid url: {}'.format(url))
+
+        self.url = url
+        self.version = version
+        self.species = species
+
+        self._connection_class = http.client.HTTPSConnection \
+            if parts.scheme == 'https' else http.client.HTTPConnection
+        self._netloc = parts.netloc
+        self._path = parts.path.rstrip('/')
+        self._max_connections = max(1, max_connections)
+        self._batch_size = max(1, batch_size)
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._pool = queue.LifoQueue()
+        self._executor = ThreadPoolExecutor(max_workers=self._max_connections)
+
+    def close(self):
+        """Close all connections."""
+        self._executor.shutdown()
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connection(self):
+        """Get an idle connection or make a new one."""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connection_class(self._netloc,
+                                          timeout=self._timeout)
+
+    def _delay(self, attempt, retry_after=None):
+        """Get the number of seconds to wait before retrying."""
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_BACKOFF)
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(retry_after)
+                    now = datetime.datetime.now(when.tzinfo)
+                    return min(max((when - now).total_seconds(), 0),
+                               MAX_BACKOFF)
+                except (TypeError, ValueError):
+                    pass
+
+        delay = min(self._backoff * (2 ** attempt), MAX_BACKOFF)
+        return delay * random.uniform(0.5, 1.0)
+
+    def request(self, endpoint, params):
+        """POST a request and get the JSON response.
+
+        Args:
+            endpoint (str): The endpoint, like "snps".
+            params (dict): The parameters, lists are sent as repeated
+                parameters.
+
+        Returns:
+            dict: The decoded response.
+
+        Raises:
+            ClientError: If the request fails or still fails after retrying.
+        """
+        body = urlencode(params, doseq=True).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive'
+        }
+        path = '{}/api/{}'.format(self._path, endpoint)
+
+        for attempt in range(self._retries + 1):
+            conn = self._connection()
+            retry_after = None
+
+            try:
+                conn.request('POST', path, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, socket.error) as e:
+                # the server may have closed an idle connection
+                conn.close()
+                error = ClientError('Request to {} failed: {}'.format(path, e))
+            else:
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._pool.put(conn)
+
+                if response.getheader('Content-Encoding') == 'gzip':
+                    data = gzip.decompress(data)
+
+                if response.status == 200:
+                    return json.loads(data.decode('utf-8'))
+
+                try:
+                    message = json.loads(data.decode('utf-8'))['message']
+                except (ValueError, KeyError, TypeError):
+                    message = response.reason
+
+                error = ClientError('{} {}: {}'.format(response.status, path,
+                                                       message),
+                                    response.status)
+
+                if response.status not in RETRY_STATUS:
+                    raise error
+
+                retry_after = response.getheader('Retry-After')
+
+            if attempt < self._retries:
+                time.sleep(self._delay(attempt, retry_after))
+
+        raise error
+
+    def _release(self, version, species):
+        """Get the version and species parameters."""
+        version = version or self.version
+        species = species or self.species
+
+        if not version or not species:
+            raise ValueError('A version and species are needed')
+
+        return {'version': version, 'species': species}
+
+    def snps(self, ids, version=None, species=None):
+        """Get the SNPs with the identifiers in `ids`.  An identifier given
+        more than once is only looked up once.
+
+        Args:
+            ids (list): The SNP identifiers.
+            version (int, optional): The Ensembl version, the client's if
+                ``None``.
+            species (str, optional): The Ensembl species identifier, the
+                client's if ``None``.
+
+        Returns:
+            dict: A ``dict`` with the keys ``snps``, the SNPs found batch by
+            batch, and ``unknown``, the ids not found in the order of `ids`.
+        """
+        params = self._release(version, species)
+
+        # a repeated id in two batches would return its SNP twice
+        ids = list(OrderedDict.fromkeys(ids))
+        batches = [ids[i:i + self._batch_size]
+                   for i in range(0, len(ids), self._batch_size)]
+
+        futures = [self._executor.submit(self.request, 'snps',
+                                         dict(params, ids=batch))
+                   for batch in batches]
+
+        result = {'snps': [], 'unknown': []}
+        for future in futures:
+            response = future.result()
+            result['snps'].extend(response['snps'] or [])
+            result['unknown'].extend(response['unknown'] or [])
+
+        return result
+
+    def regions(self, regions, version=None, species=None, limit=None):
+        """Get the SNPs in each region.
+
+        Args:
+            regions (list): The regions, like "1:10000000-10500000".
+            version (int, optional): The Ensembl version, the client's if
+                ``None``.
+            species (str, optional): The Ensembl species identifier, the
+                client's if ``None``.
+            limit (int, optional): The most SNPs to get for each region,
+                the server's default if ``None``.
+
+        Returns:
+            list: The SNPs of each region in the order of `regions`.
+        """
+        params = self._release(version, species)
+        if limit:
+            params['limit'] = limit
+
+        futures = [self._executor.submit(self.request, 'region',
+                                         dict(params, region=region))
+                   for region in regions]
+
+        return [future.result()['snps'] or [] for future in futures]
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""This module creates the columnar SNP store, see
+:mod:`ensimpl_snps.fetch.columnar`, from an ensimpl snps database.
+"""
+import os
+import random
+import sqlite3
+import time
+
+import pysam
+
+import ensimpl_snps.create.create_ensimpl_snps as create_ensimpl_snps
+import ensimpl_snps.create.ensimpl_db as ensimpl_db
+import ensimpl_snps.fetch.columnar as columnar
+import ensimpl_snps.utils as utils
+
+LOG = utils.get_logger()
+
+COLUMNAR_DB_NAME = 'ensimpl_snps.{}.{}.snpc'
+
+# number of chunks to hold in memory before writing them
+BATCH_SIZE = 256
+
+
+def initialize(db):
+    """Initialize the columnar store.
+
+    Args:
+        db (str): Full path to the store file.
+    """
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    for sql in SQL_CREATE_TABLES:
+        LOG.debug(sql)
+        cursor.execute(sql)
+
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+
+def get_chunks(db):
+    """Split the snps of a database into chunks of at most
+    :data:`ensimpl_snps.fetch.columnar.CHUNK_SIZE` snps on one chromosome.
+
+    Args:
+        db (str): The ensimpl snps database.
+
+    Yields:
+        list: The snps of a chunk ordered by position, each element being a
+        ``list`` of chromosome, position, SNP identifier, reference allele
+        and alternate allele.
+    """
+    chunk = []
+    for row in ensimpl_db.get_snps(db):
+        snp = list(row[1:])
+        if chunk and (len(chunk) == columnar.CHUNK_SIZE or
+                      chunk[0][0] != snp[0]):
+            yield chunk
+            chunk = []
+        chunk.append(snp)
+
+    if chunk:
+        yield chunk
+
+
+def create_store(db, store):
+    """Create the columnar store of the snps in `db`.
+
+    Args:
+        db (str): The ensimpl snps database.
+        store (str): Full path to the store file.
+    """
+    LOG.info('Creating columnar store: {}'.format(store))
+
+    start = time.time()
+
+    utils.delete_file(store)
+    initialize(store)
+
+    conn = sqlite3.connect(store)
+    cursor = conn.cursor()
+
+    sql_chunk_insert = 'INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)'
+    sql_rs_insert = 'INSERT OR IGNORE INTO rs_ids VALUES (?, ?)'
+    sql_other_insert = 'INSERT OR IGNORE INTO other_ids VALUES (?, ?)'
+
+    chunks = []
+    rs_ids = []
+    other_ids = []
+
+    def flush():
+        cursor.executemany(sql_chunk_insert, chunks)
+        cursor.executemany(sql_rs_insert, rs_ids)
+        cursor.executemany(sql_other_insert, other_ids)
+        del chunks[:], rs_ids[:], other_ids[:]
+
+    num_snps = 0
+    for chunk_id, chunk in enumerate(get_chunks(db)):
+        max_ref_len = max(len(snp[3] or '') for snp in chunk) or 1
+        chunks.append((chunk_id, chunk[0][0], chunk[0][1], chunk[-1][1],
+                       len(chunk), max_ref_len, columnar.encode_chunk(chunk)))
+
+        for snp in chunk:
+            match = columnar.REGEX_RS_ID.match(snp[2])
+            if match:
+                rs_ids.append((int(match.group(1)), chunk_id))
+            else:
+                other_ids.append((snp[2], chunk_id))
+
+        num_snps += len(chunk)
+
+        if len(chunks) >= BATCH_SIZE:
+            flush()
+
+    flush()
+
+    LOG.info('Creating indices...')
+    for sql in SQL_INDICES:
+        LOG.debug(sql)
+        cursor.execute(sql)
+
+    cursor.close()
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+
+    LOG.info('{:,} snps stored, {:,} bytes compared to {:,} bytes'.format(
+        num_snps, os.path.getsize(store), os.path.getsize(db)))
+    LOG.info('Columnar store created in: {}'.format(
+        utils.format_time(start, time.time())))
+
+
+def create(directory, versions=None, species=None):
+    """Create the columnar store of every ensimpl snps database in
+    `directory` or any directory below it.  Each store is written next to its
+    database.
+
+    Args:
+        directory (str): The directory holding the databases.
+        versions (list, optional): A ``list`` of Ensembl versions, ``None``
+            for all.
+        species (list, optional): A ``list`` of species, ``None`` for all.
+
+    Returns:
+        list: The stores that were created.
+    """
+    stores = []
+    for version, species_id, db in create_ensimpl_snps.find_dbs(directory):
+        if versions and version not in [int(v) for v in versions]:
+            continue
+        if species and species_id not in species:
+            continue
+
+        store = os.path.join(os.path.dirname(db),
+                             COLUMNAR_DB_NAME.format(version, species_id))
+        create_store(db, store)
+        stores.append(store)
+
+    return stores
+
+
+def _drop_cache(file_name):
+    """Ask the operating system to drop `file_name` from the page cache."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+
+    fd = os.open(file_name, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _time_queries(files, queries, query):
+    """Time `query` for each element of `queries`, dropping `files` from the
+    page cache before each one.
+
+    Returns:
+        tuple: The median latency in milliseconds and the number of SNPs
+        found.
+    """
+    latencies = []
+    num_snps = 0
+    for args in queries:
+        for file_name in files:
+            _drop_cache(file_name)
+        start = time.time()
+        num_snps += len(query(*args))
+        latencies.append((time.time() - start) * 1000.0)
+
+    latencies.sort()
+    return latencies[len(latencies) // 2], num_snps
+
+
+def benchmark(db, store, vcf=None, num_queries=100, width=100000, seed=0):
+    """Compare the disk footprint and cold cache latency of the columnar
+    store against the SQLite database and the tabix indexed VCF.
+
+    Random regions of `width` bases and random SNP identifiers are looked up
+    in each layout, with the files dropped from the page cache before each
+    lookup.  Dropping the cache is only possible where
+    ``os.posix_fadvise`` is available.
+
+    Args:
+        db (str): The ensimpl snps database.
+        store (str): The columnar store of `db`.
+        vcf (str, optional): The tabix indexed VCF file.
+        num_queries (int, optional): Number of lookups of each kind.
+        width (int, optional): Width of each region.
+        seed (int, optional): Seed of the random lookups.
+
+    Returns:
+        list: A ``list`` of ``dicts`` with keys ``layout``, ``query``,
+        ``size``, ``median_ms`` and ``snps``.
+    """
+    rnd = random.Random(seed)
+
+    conn = sqlite3.connect(db)
+    contigs = conn.execute('SELECT chrom, min_pos, max_pos '
+                           '  FROM contig_stats').fetchall()
+    num_snps = conn.execute('SELECT max(rowid) FROM snps').fetchone()[0]
+
+    regions = []
+    for _ in range(num_queries):
+        chrom, min_pos, max_pos = rnd.choice(contigs)
+        start = rnd.randint(min_pos, max(min_pos, max_pos - width))
+        regions.append((chrom, start, start + width - 1))
+
+    ids = []
+    for _ in range(num_queries):
+        row = conn.execute('SELECT snp_id FROM snps WHERE rowid = ?',
+                           (rnd.randint(1, num_snps),)).fetchone()
+        if row:
+            ids.append(([row[0]],))
+    conn.close()
+
+    sql_region = ('SELECT chrom, pos, snp_id, ref, alt '
+                  '  FROM snps '
+                  ' WHERE chrom = ? AND pos >= ? AND pos <= ?')
+    sql_ids = ('SELECT chrom, pos, snp_id, ref, alt '
+               '  FROM snps '
+               ' WHERE snp_id = ?')
+
+    def db_query(sql, params):
+        conn = sqlite3.connect(db)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def db_region(chrom, start, end):
+        return db_query(sql_region, (chrom, start, end))
+
+    def db_ids(snp_ids):
+        return db_query(sql_ids, snp_ids)
+
+    def store_region(chrom, start, end):
+        column_store = columnar.ColumnarStore(store)
+        try:
+            return column_store.by_region(chrom, start, end)
+        finally:
+            column_store.close()
+
+    def store_ids(snp_ids):
+        column_store = columnar.ColumnarStore(store)
+        try:
+            return column_store.by_ids(snp_ids)
+        finally:
+            column_store.close()
+
+    layouts = [('sqlite', [db], db_region, db_ids),
+               ('columnar', [store], store_region, store_ids)]
+
+    if vcf:
+        def vcf_region(chrom, start, end):
+            with pysam.TabixFile(vcf) as tbx:
+                return list(tbx.fetch(chrom, start - 1, end))
+
+        layouts.append(('tabix', [vcf, vcf + '.tbi'], vcf_region, None))
+
+    results = []
+    for layout, files, region_query, ids_query in layouts:
+        size = sum(os.path.getsize(file_name) for file_name in files)
+        for query_type, query, queries in [('region', region_query, regions),
+                                           ('ids', ids_query, ids)]:
+            if query is None:
+                continue
+            median_ms, found = _time_queries(files, queries, query)
+            results.append({'layout': layout,
+                            'query': query_type,
+                            'size': size,
+                            'median_ms': round(median_ms, 3),
+                            'snps': found})
+
+    return results
+
+
+SQL_CREATE_TABLES = ['''
+    CREATE TABLE IF NOT EXISTS chunks (
+       chunk_id INTEGER,
+       chrom TEXT NOT NULL,
+       start_pos INTEGER NOT NULL,
+       end_pos INTEGER NOT NULL,
+       num_snps INTEGER NOT NULL,
+       max_ref_len INTEGER NOT NULL,
+       data BLOB NOT NULL,
+       PRIMARY KEY (chunk_id)
+    );
+''', '''
+    CREATE TABLE IF NOT EXISTS rs_ids (
+       rs INTEGER NOT NULL,
+       chunk_id INTEGER NOT NULL,
+       PRIMARY KEY (rs, chunk_id)
+    ) WITHOUT ROWID;
+''', '''
+    CREATE TABLE IF NOT EXISTS other_ids (
+       snp_id TEXT NOT NULL,
+       chunk_id INTEGER NOT NULL,
+       PRIMARY KEY (snp_id, chunk_id)
+    ) WITHOUT ROWID;
+''']
+
+SQL_INDICES = [
+    'CREATE INDEX IF NOT EXISTS idx_chunks_region ON chunks (chrom ASC, start_pos ASC);',
+]
@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
 from collections import namedtuple
+from operator import itemgetter
 
+import glob
 import io
 import os
+import re
+import shutil
 import time
 
 from pysam import VariantFile
 
 import ensimpl_snps.create.ensimpl_db as ensimpl_db
+import ensimpl_snps.create.genotype_db as genotype_db
+import ensimpl_snps.create.shard_db as shard_db
 import ensimpl_snps.utils as utils
 
 DEFAULT_CONFIG = 'ftp://ftp.jax.org/churchill-lab/ensimpl/ensimpl_snps.ensembl.conf'
@@ -16,6 +22,11 @@ ENSEMBL_FIELDS = ['version', 'release_date', 'assembly', 'assembly_patch',
                   'species_id', 'species_name', 'vcf_file']
 EnsemblReference = namedtuple('EnsemblReference', ENSEMBL_FIELDS)
 
+REGEX_DB_NAME = re.compile(r'ensimpl_snps\.(\d+)\.(\w+)\.db3$')
+
+# number of changes to hold in memory before writing them
+DELTA_BATCH_SIZE = 1000000
+
 
 LOG = utils.get_logger()
 
@@ -99,7 +110,167 @@ def parseSNPs(db, reference):
         LOG.error('Unable to parse file: {}'.format(reference.vcf_file[7:]))
 
 
-def create(ensembl, species, directory, resource):
+def get_vcf_contigs(reference):
+    """Get the contigs declared in the header of the VCF file.
+
+    Args:
+        reference (EnsemblReference): Reference information for the Ensembl
+            information.
+
+    Returns:
+        list: A ``list`` of (chromosome, length), the length being ``None``
+        when the header does not have it.
+    """
+    # TODO: hardcoded for files right now
+    vcf_in = VariantFile(reference.vcf_file[7:])
+    contigs = [(name, contig.length)
+               for name, contig in vcf_in.header.contigs.items()]
+    vcf_in.close()
+
+    return contigs
+
+
+def get_vcf_snps(vcf_in):
+    """Iterate over all records of a VCF file in the same order as
+    :func:`ensimpl_snps.create.ensimpl_db.get_snps`, ordered by chromosome
+    name, position and identifier.
+
+    Args:
+        vcf_in (pysam.VariantFile): The open, indexed VCF file.
+
+    Yields:
+        list: The chromosome, position, SNP identifier, reference allele and
+        alternate allele of each record.
+    """
+    for contig in sorted(vcf_in.header.contigs):
+        try:
+            records = vcf_in.fetch(contig)
+        except ValueError:
+            # contig in the header without any records in the index
+            continue
+
+        group = []
+        for rec in records:
+            if group and group[0][1] != rec.pos:
+                yield from sorted(group, key=itemgetter(2))
+                group = []
+
+            group.append([rec.contig, rec.pos, rec.id, rec.ref,
+                          ','.join(rec.alts) if rec.alts else ''])
+
+        yield from sorted(group, key=itemgetter(2))
+
+
+def parseSNPsDelta(db, base_db, reference):
+    """Update a copy of a previous release's database to `reference` by
+    stream diffing the sorted snps of `base_db` against the sorted VCF
+    records, only writing the snps that were inserted, deleted or changed.
+
+    Args:
+        db (str): Ensembl database, a copy of `base_db`.
+        base_db (str): The previous release's database.
+        reference (EnsemblReference): Reference information for the Ensembl
+            information.
+
+    Returns:
+        dict: The number of ``inserted``, ``deleted``, ``updated`` and
+        ``moved`` snps.
+    """
+    # TODO: hardcoded for files right now
+    vcf_in = VariantFile(reference.vcf_file[7:])
+
+    counts = {'inserted': 0, 'deleted': 0, 'updated': 0, 'moved': 0}
+    inserted_ids = set()
+    deleted_ids = set()
+
+    inserts = []
+    deletes = []
+    updates = []
+
+    def flush():
+        ensimpl_db.delete_snps(db, deletes)
+        ensimpl_db.update_snps(db, updates)
+        ensimpl_db.insert_snps(db, inserts)
+        del inserts[:], deletes[:], updates[:]
+
+    # rows from the base are (rowid, chrom, pos, snp_id, ref, alt), rows
+    # from the VCF are [chrom, pos, snp_id, ref, alt]
+    merged = utils.merge_join(ensimpl_db.get_snps(base_db),
+                              get_vcf_snps(vcf_in),
+                              itemgetter(1, 2, 3),
+                              itemgetter(0, 1, 2))
+
+    for old, new in merged:
+        if old is None:
+            inserts.append(new)
+            inserted_ids.add(new[2])
+            counts['inserted'] += 1
+        elif new is None:
+            deletes.append(old[0])
+            deleted_ids.add(old[3])
+            counts['deleted'] += 1
+        elif old[4:] != tuple(new[3:]):
+            updates.append((new[3], new[4], old[0]))
+            counts['updated'] += 1
+
+        if len(inserts) + len(deletes) + len(updates) >= DELTA_BATCH_SIZE:
+            flush()
+
+    flush()
+
+    # a snp that moved was deleted from one position and inserted at another
+    counts['moved'] = len(inserted_ids & deleted_ids)
+
+    LOG.info('Inserted: {inserted:,}, deleted: {deleted:,}, '
+             'updated: {updated:,}, moved: {moved:,}'.format(**counts))
+
+    return counts
+
+
+def find_dbs(directory):
+    """Find all the databases in `directory` or any directory below it.
+
+    Args:
+        directory (str): The directory to search.
+
+    Returns:
+        list: A ``list`` of (version, species identifier, database file)
+        sorted by version and species.
+    """
+    dbs = []
+
+    pattern = os.path.join(directory, '**', 'ensimpl_snps.*.db3')
+    for file_name in glob.glob(pattern, recursive=True):
+        match = REGEX_DB_NAME.search(file_name)
+        if match:
+            dbs.append((int(match.group(1)), match.group(2), file_name))
+
+    return sorted(dbs)
+
+
+def find_base_db(directory, version, species_id):
+    """Find the most recent database for `species_id` in `directory` (or any
+    directory below it) that is older than `version`.
+
+    Args:
+        directory (str): The directory to search.
+        version (str): The Ensembl version being created.
+        species_id (str): The Ensembl species identifier.
+
+    Returns:
+        str: The database file or ``None`` if there is not one.
+    """
+    base_db = None
+
+    for db_version, db_species_id, file_name in find_dbs(directory):
+        if db_species_id == species_id and db_version < int(version):
+            base_db = file_name
+
+    return base_db
+
+
+def create(ensembl, species, directory, resource, base_directory=None,
+           shards=False, fields=None, genotypes=None, strains=None):
     """Create Ensimpl SNPs database(s).  Output database name will be:
 
     "ensembl_snps. ``version`` . ``species`` .db3"
@@ -110,6 +281,18 @@ def create(ensembl, species, directory, resource):
         species (list): A ``list`` of all species to create, ``None`` for all.
         directory (str): Output directory.
         resource (str): Configuration file location to parse.
+        base_directory (str, optional): Directory of previously created
+            databases.  When set, each database is built by applying the
+            changes since the most recent older release found here, falling
+            back to a full build when there is none.
+        shards (bool, optional): Also split each database into per
+            chromosome shards, see :mod:`ensimpl_snps.create.shard_db`.
+        fields (list, optional): Optional VCF fields to store, see
+            :func:`ensimpl_snps.create.ensimpl_db.insert_fields`.
+        genotypes (str, optional): A multi-sample VCF file to store the
+            strain genotypes of, see :mod:`ensimpl_snps.create.genotype_db`.
+        strains (list, optional): The samples of `genotypes` to store,
+            ``None`` for all.
     """
     if ensembl:
         LOG.debug('Ensembl Versions: {}'.format(','.join(ensembl)))
@@ -156,15 +339,54 @@ def create(ensembl, species, directory, resource):
                 ensimpl_file = os.path.join(directory, ensimpl_file)
                 utils.delete_file(ensimpl_file)
     
-                LOG.info('Creating: {}'.format(ensimpl_file))
-                ensimpl_db.initialize(ensimpl_file)
-
-                LOG.info('Extracting and inserting snps...')
-                parseSNPs(ensimpl_file, ensembl_reference)
+                base_db = None
+                if base_directory:
+                    base_db = find_base_db(base_directory, release_version,
+                                           species_id)
+
+                if base_db:
+                    LOG.info('Creating: {} from {}'.format(ensimpl_file,
+                                                           base_db))
+                    shutil.copyfile(base_db, ensimpl_file)
+                    ensimpl_db.initialize(ensimpl_file)
+
+                    # the fields of the base release are stored again below
+                    # when asked for, from the new VCF file
+                    ensimpl_db.drop_fields(ensimpl_file)
+
+                    LOG.info('Applying snp changes...')
+                    parseSNPsDelta(ensimpl_file, base_db, ensembl_reference)
+                else:
+                    LOG.info('Creating: {}'.format(ensimpl_file))
+                    ensimpl_db.initialize(ensimpl_file)
+
+                    LOG.info('Extracting and inserting snps...')
+                    parseSNPs(ensimpl_file, ensembl_reference)
+
+                ensimpl_db.insert_contigs(
+                    ensimpl_file, get_vcf_contigs(ensembl_reference))
     
                 LOG.info('Finalizing...')
                 ensimpl_db.finalize(ensimpl_file, ensembl_reference)
 
+                if fields:
+                    ensimpl_db.insert_fields(ensimpl_file,
+                                             ensembl_reference.vcf_file[7:],
+                                             fields)
+
+                if shards:
+                    shards_dir = shard_db.SHARDS_DIR_NAME.format(
+                        release_version, species_id)
+                    shard_db.create_shards(
+                        ensimpl_file, os.path.join(directory, shards_dir))
+
+                if genotypes:
+                    genotypes_dir = genotype_db.GENOTYPES_DIR_NAME.format(
+                        release_version, species_id)
+                    genotype_db.create_genotypes(
+                        ensimpl_file, genotypes,
+                        os.path.join(directory, genotypes_dir), strains)
+
         LOG.info('DONE')
 
 
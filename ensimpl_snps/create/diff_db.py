@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""This module creates the SNP differences between two Ensembl releases.
+
+The differences are found with two sorted merge joins.  The first walks both
+releases in identifier order and finds the SNPs that were added, removed,
+moved or had their alleles changed.  The second walks the added and removed
+SNPs in (chromosome, position, alleles) order and turns the pairs that are
+the same variant under a new identifier into renames.
+
+The differences are stored ordered by chromosome and position, so
+``diff_id`` can be used to page through them, in a region or not.
+"""
+from itertools import groupby
+from operator import itemgetter
+
+import os
+import sqlite3
+import time
+
+import ensimpl_snps.create.create_ensimpl_snps as create_ensimpl_snps
+import ensimpl_snps.utils as utils
+
+LOG = utils.get_logger()
+
+DIFF_DB_NAME = 'ensimpl_snps.diff.{}.{}.{}.db3'
+
+CHANGE_ADDED = 1
+CHANGE_REMOVED = 2
+CHANGE_MOVED = 3
+CHANGE_ALLELES = 4
+CHANGE_RENAMED = 5
+
+CHANGES = {
+    CHANGE_ADDED: 'added',
+    CHANGE_REMOVED: 'removed',
+    CHANGE_MOVED: 'moved',
+    CHANGE_ALLELES: 'alleles',
+    CHANGE_RENAMED: 'renamed'
+}
+
+# number of rows to hold in memory before writing them
+BATCH_SIZE = 1000000
+
+
+def initialize(db):
+    """Initialize the diff database.
+
+    Args:
+        db (str): Full path to the database file.
+    """
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    for sql in SQL_CREATE_TABLES:
+        LOG.debug(sql)
+        cursor.execute(sql)
+
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+
+def get_snps_by_id(db):
+    """Iterate over the snps of a release grouped by SNP identifier.
+
+    Args:
+        db (str): The release database.
+
+    Yields:
+        tuple: The SNP identifier and a ``list`` of (chromosome, position,
+        SNP identifier, reference allele, alternate allele).
+    """
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    sql_snps = ('SELECT chrom, pos, snp_id, ref, alt '
+                '  FROM snps '
+                ' ORDER BY snp_id, chrom, pos')
+
+    try:
+        for snp_id, rows in groupby(cursor.execute(sql_snps), itemgetter(2)):
+            yield snp_id, list(rows)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def diff_snp(old_rows, new_rows):
+    """Find the differences between the rows of one SNP identifier in two
+    releases.  Positions only in one release are paired up in order as
+    moves, anything left over was added or removed.
+
+    Args:
+        old_rows (list): The rows in the older release.
+        new_rows (list): The rows in the newer release.
+
+    Returns:
+        list: The differences as (change, chromosome, position, SNP
+        identifier, reference allele, alternate allele, old chromosome, old
+        position, old SNP identifier, old reference allele, old alternate
+        allele).
+    """
+    changes = []
+    old_by_pos = {row[:2]: row for row in old_rows}
+    new_by_pos = {row[:2]: row for row in new_rows}
+
+    old_only = [row for row in old_rows if row[:2] not in new_by_pos]
+    new_only = [row for row in new_rows if row[:2] not in old_by_pos]
+
+    for row in new_rows:
+        old = old_by_pos.get(row[:2])
+        if old and old[3:] != row[3:]:
+            changes.append((CHANGE_ALLELES,) + row + old)
+
+    for old, new in zip(old_only, new_only):
+        changes.append((CHANGE_MOVED,) + new + old)
+
+    for old in old_only[len(new_only):]:
+        changes.append((CHANGE_REMOVED,) + old + (None,) * 5)
+
+    for new in new_only[len(old_only):]:
+        changes.append((CHANGE_ADDED,) + new + (None,) * 5)
+
+    return changes
+
+
+def find_renames(cursor):
+    """Pair up the added and removed SNPs that are the same variant under a
+    different identifier.
+
+    Args:
+        cursor (sqlite3.Cursor): The database cursor.
+
+    Returns:
+        list: A ``list`` of (rowid of removed SNP, rowid of added SNP).
+    """
+    sql_stage = ('SELECT rowid, chrom, pos, ref, alt '
+                 '  FROM diff_stage '
+                 ' WHERE change = ? '
+                 ' ORDER BY chrom, pos, ref, alt')
+
+    removed = cursor.connection.cursor().execute(sql_stage, (CHANGE_REMOVED,))
+    added = cursor.connection.cursor().execute(sql_stage, (CHANGE_ADDED,))
+
+    renames = []
+    for old, new in utils.merge_join(removed, added, itemgetter(1, 2, 3, 4)):
+        if old and new:
+            renames.append((old[0], new[0]))
+
+    return renames
+
+
+def create_diff(db, from_db, to_db, from_version, to_version, species_id):
+    """Create the SNP differences between two releases.
+
+    Args:
+        db (str): Full path to the diff database file.
+        from_db (str): The older release database.
+        to_db (str): The newer release database.
+        from_version (int): The Ensembl version of `from_db`.
+        to_version (int): The Ensembl version of `to_db`.
+        species_id (str): The Ensembl species identifier.
+
+    Returns:
+        dict: The number of differences keyed by change name.
+    """
+    LOG.info('Creating differences: {}'.format(db))
+
+    start = time.time()
+
+    utils.delete_file(db)
+    initialize(db)
+
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    sql_stage_insert = ('INSERT INTO diff_stage '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+    LOG.info('Comparing snps by identifier...')
+    changes = []
+    merged = utils.merge_join(get_snps_by_id(from_db), get_snps_by_id(to_db),
+                              itemgetter(0))
+
+    for old, new in merged:
+        changes.extend(diff_snp(old[1] if old else [], new[1] if new else []))
+
+        if len(changes) >= BATCH_SIZE:
+            cursor.executemany(sql_stage_insert, changes)
+            changes = []
+
+    cursor.executemany(sql_stage_insert, changes)
+
+    LOG.info('Comparing added and removed snps by position...')
+    renames = find_renames(cursor)
+
+    sql_renamed = ('INSERT INTO diff_stage '
+                   'SELECT ?, a.chrom, a.pos, a.snp_id, a.ref, a.alt, '
+                   '       r.chrom, r.pos, r.snp_id, r.ref, r.alt '
+                   '  FROM diff_stage a, diff_stage r '
+                   ' WHERE a.rowid = ? AND r.rowid = ?')
+
+    cursor.executemany(sql_renamed, [(CHANGE_RENAMED, added, removed)
+                                     for removed, added in renames])
+    cursor.executemany('DELETE FROM diff_stage WHERE rowid IN (?, ?)',
+                       renames)
+
+    LOG.info('Sorting differences...')
+    cursor.execute('INSERT INTO snp_diff '
+                   'SELECT null, * '
+                   '  FROM diff_stage '
+                   ' ORDER BY chrom, pos, snp_id')
+    cursor.execute('DROP TABLE diff_stage')
+
+    for sql in SQL_INDICES:
+        LOG.debug(sql)
+        cursor.execute(sql)
+
+    counts = {name: 0 for name in CHANGES.values()}
+    for change, num in cursor.execute('SELECT change, count(1) '
+                                      '  FROM snp_diff '
+                                      ' GROUP BY change'):
+        counts[CHANGES[change]] = num
+
+    meta_data = [('from_version', from_version, species_id),
+                 ('to_version', to_version, species_id)]
+    meta_data.extend([('num_{}'.format(name), num, species_id)
+                      for name, num in sorted(counts.items())])
+
+    cursor.executemany('INSERT INTO meta_info VALUES (null, ?, ?, ?)',
+                       meta_data)
+
+    cursor.close()
+    conn.commit()
+
+    # space used by the staging table
+    conn.execute('VACUUM')
+    conn.close()
+
+    LOG.info('Differences: {}'.format(', '.join(
+        '{} {:,}'.format(name, num) for name, num in sorted(counts.items()))))
+    LOG.info('Differences created in: {}'.format(
+        utils.format_time(start, time.time())))
+
+    return counts
+
+
+def create(directory, from_version, to_version, species=None):
+    """Create the SNP differences between two releases for all the species
+    that have databases for both releases in `directory` or any directory
+    below it.  Each diff database is written next to the newer release's
+    database.
+
+    Args:
+        directory (str): The directory holding the release databases.
+        from_version (int): The older Ensembl version.
+        to_version (int): The newer Ensembl version.
+        species (list, optional): A ``list`` of species, ``None`` for all.
+
+    Raises:
+        ValueError: If no species has databases for both releases.
+    """
+    from_dbs = {}
+    to_dbs = {}
+    for version, species_id, release_db in \
+            create_ensimpl_snps.find_dbs(directory):
+        if species and species_id not in species:
+            continue
+        if version == int(from_version):
+            from_dbs[species_id] = release_db
+        elif version == int(to_version):
+            to_dbs[species_id] = release_db
+
+    species_ids = sorted(set(from_dbs) & set(to_dbs))
+
+    if not species_ids:
+        raise ValueError('Unable to find databases for versions {} and '
+                         '{}'.format(from_version, to_version))
+
+    for species_id in species_ids:
+        db = os.path.join(os.path.dirname(to_dbs[species_id]),
+                          DIFF_DB_NAME.format(int(from_version),
+                                              int(to_version), species_id))
+        create_diff(db, from_dbs[species_id], to_dbs[species_id],
+                    int(from_version), int(to_version), species_id)
+
+
+SQL_CREATE_TABLES = ['''
+    CREATE TABLE IF NOT EXISTS meta_info (
+       meta_info_key INTEGER,
+       meta_key TEXT NOT NULL,
+       meta_value TEXT NOT NULL,
+       species_id TEXT NOT NULL,
+       PRIMARY KEY (meta_info_key)
+    );
+''', '''
+    CREATE TABLE IF NOT EXISTS diff_stage (
+       change INTEGER NOT NULL,
+       chrom TEXT NOT NULL,
+       pos INTEGER NOT NULL,
+       snp_id TEXT NOT NULL,
+       ref TEXT,
+       alt TEXT,
+       old_chrom TEXT,
+       old_pos INTEGER,
+       old_snp_id TEXT,
+       old_ref TEXT,
+       old_alt TEXT
+    );
+''', '''
+    CREATE TABLE IF NOT EXISTS snp_diff (
+       diff_id INTEGER,
+       change INTEGER NOT NULL,
+       chrom TEXT NOT NULL,
+       pos INTEGER NOT NULL,
+       snp_id TEXT NOT NULL,
+       ref TEXT,
+       alt TEXT,
+       old_chrom TEXT,
+       old_pos INTEGER,
+       old_snp_id TEXT,
+       old_ref TEXT,
+       old_alt TEXT,
+       PRIMARY KEY (diff_id)
+    );
+''']
+
+SQL_INDICES = [
+    'CREATE INDEX IF NOT EXISTS idx_snp_diff_region ON snp_diff (chrom ASC, pos ASC);',
+]
@@ -4,6 +4,7 @@
 Todo:
     * better documentation
 """
+import os
 import sqlite3
 import time
 
@@ -11,6 +12,10 @@ import ensimpl_snps.utils as utils
 
 LOG = utils.get_logger()
 
+# bin sizes of the precomputed SNP density, finest first, each one a
+# multiple of the one before
+DENSITY_BIN_SIZES = [1000, 10000, 100000, 1000000, 10000000]
+
 
 def initialize(db):
     """Initialize the ensimpl_snps database.
@@ -29,6 +34,11 @@ def initialize(db):
         LOG.debug(sql)
         cursor.execute(sql)
 
+    # databases copied from a release built before variants were classified
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(snps)')]
+    if 'variant_class' not in columns:
+        cursor.execute('ALTER TABLE snps ADD COLUMN variant_class INTEGER')
+
     cursor.close()
     conn.commit()
     conn.close()
@@ -49,7 +59,7 @@ def insert_snps(db, snps):
     start = time.time()
     conn = sqlite3.connect(db)
 
-    sql_snps_insert = ('INSERT INTO snps '
+    sql_snps_insert = ('INSERT INTO snps (chrom, pos, snp_id, ref, alt) '
                        'VALUES (?, ?, ?, ?, ?)')
 
     cursor = conn.cursor()
@@ -63,6 +73,150 @@ def insert_snps(db, snps):
         utils.format_time(start, time.time())))
 
 
+def insert_contigs(db, contigs):
+    """Replace the contigs in the database.
+
+    Args:
+        db (str): Name of the database file.
+        contigs (list): A ``list`` of (chromosome, length), the length can be
+            ``None`` when it is not known.
+    """
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+    LOG.debug('Inserting {:,} contigs...'.format(len(contigs)))
+    cursor.execute('DELETE FROM contigs')
+    cursor.executemany('INSERT INTO contigs VALUES (?, ?)', contigs)
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+
+def delete_snps(db, rowids):
+    """Delete snps from the database.
+
+    Args:
+        db (str): Name of the database file.
+        rowids (list): A ``list`` of the rowids of the snps to delete.
+    """
+    LOG.info('Deleting snps from database: {}'.format(db))
+
+    start = time.time()
+    conn = sqlite3.connect(db)
+
+    cursor = conn.cursor()
+    LOG.debug('Deleting {:,} snps...'.format(len(rowids)))
+    cursor.executemany('DELETE FROM snps WHERE rowid = ?',
+                       [(rowid,) for rowid in rowids])
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+    LOG.info('SNPs deleted in: {}'.format(
+        utils.format_time(start, time.time())))
+
+
+def update_snps(db, snps):
+    """Update the alleles of snps in the database.
+
+    Args:
+        db (str): Name of the database file.
+        snps (list): A ``list`` of (reference allele, alternate allele,
+            rowid).
+    """
+    LOG.info('Updating snps in database: {}'.format(db))
+
+    start = time.time()
+    conn = sqlite3.connect(db)
+
+    cursor = conn.cursor()
+    LOG.debug('Updating {:,} snps...'.format(len(snps)))
+    cursor.executemany('UPDATE snps '
+                       '   SET ref = ?, alt = ?, variant_class = NULL '
+                       ' WHERE rowid = ?', snps)
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+    LOG.info('SNPs updated in: {}'.format(
+        utils.format_time(start, time.time())))
+
+
+def get_snps(db):
+    """Iterate over all snps in the database ordered by chromosome, position
+    and identifier.
+
+    Args:
+        db (str): Name of the database file.
+
+    Yields:
+        tuple: The rowid, chromosome, position, SNP identifier, reference
+        allele and alternate allele of each snp.
+    """
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    sql_snps = ('SELECT rowid, chrom, pos, snp_id, ref, alt '
+                '  FROM snps '
+                ' ORDER BY chrom, pos, snp_id')
+
+    try:
+        for row in cursor.execute(sql_snps):
+            yield row
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def insert_density(cursor):
+    """Precompute the number of SNPs per chromosome for every bin size in
+    :data:`DENSITY_BIN_SIZES`.  Only the finest bins are counted from the
+    ``snps`` table, every coarser level is summed from the level below it.
+
+    Bin ``b`` of size ``s`` covers positions ``b * s + 1`` to
+    ``(b + 1) * s``.
+
+    Args:
+        cursor (sqlite3.Cursor): The database cursor.
+    """
+    cursor.execute('DELETE FROM snp_density')
+
+    sql_density_snps = (
+        'INSERT INTO snp_density '
+        'SELECT chrom, :bin_size, (pos - 1) / :bin_size, count(1) '
+        '  FROM snps '
+        ' GROUP BY chrom, (pos - 1) / :bin_size')
+
+    sql_density_bins = (
+        'INSERT INTO snp_density '
+        'SELECT chrom, :bin_size, bin / :factor, sum(num_snps) '
+        '  FROM snp_density '
+        ' WHERE bin_size = :previous '
+        ' GROUP BY chrom, bin / :factor')
+
+    previous = None
+    for bin_size in DENSITY_BIN_SIZES:
+        LOG.debug('Bin size: {:,}'.format(bin_size))
+        if previous:
+            cursor.execute(sql_density_bins,
+                           {'bin_size': bin_size,
+                            'factor': bin_size // previous,
+                            'previous': previous})
+        else:
+            cursor.execute(sql_density_snps, {'bin_size': bin_size})
+        previous = bin_size
+
+
+def insert_stats(cursor):
+    """Calculate the per chromosome SNP counts, position range and allele
+    class counts in one pass over the ``snps`` table.
+
+    Args:
+        cursor (sqlite3.Cursor): The database cursor.
+    """
+    cursor.execute('DELETE FROM contig_stats')
+    cursor.execute(SQL_INSERT_STATS)
+
+
 def finalize(db, ref):
     """Finalize the database.  Move everything to where it needs to be and
     create the necessary indices.
@@ -79,20 +233,37 @@ def finalize(db, ref):
 
     LOG.info("Finalizing database....")
 
+    # finalize is run again on databases copied from a previous release
+    cursor.execute('DELETE FROM meta_info')
+
     sql_meta_insert = 'INSERT INTO meta_info VALUES (null, ?, ?, ?)'
 
     meta_data = []
     meta_data.append(('version', ref.version, ref.species_id))
     meta_data.append(('assembly', ref.assembly, ref.species_id))
     meta_data.append(('assembly_patch', ref.assembly_patch, ref.species_id))
+    meta_data.append(('density_bin_sizes',
+                      ','.join(map(str, DENSITY_BIN_SIZES)), ref.species_id))
 
     cursor.executemany(sql_meta_insert, meta_data)
 
+    LOG.info('Classifying variants...')
+    cursor.execute(SQL_UPDATE_VARIANT_CLASS)
+
     LOG.info('Creating indices...')
     for sql in SQL_INDICES:
         LOG.debug(sql)
         cursor.execute(sql)
 
+    LOG.info('Calculating SNP density...')
+    insert_density(cursor)
+
+    LOG.info('Calculating statistics...')
+    insert_stats(cursor)
+
+    # contigs without a length in the VCF header end at their last SNP
+    cursor.execute(SQL_INSERT_CONTIG_LENGTHS)
+
     conn.row_factory = sqlite3.Row
 
     LOG.info('Checking...')
@@ -117,6 +288,21 @@ def finalize(db, ref):
 
         cursor.close()
 
+    conn.commit()
+
+    # file sizes are only known once everything else has been written
+    file_sizes = [('db_size', os.path.getsize(db), ref.species_id)]
+    vcf_file = ref.vcf_file[7:]
+    if os.path.isfile(vcf_file):
+        file_sizes.append(('vcf_size', os.path.getsize(vcf_file),
+                           ref.species_id))
+
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM meta_info "
+                   " WHERE meta_key IN ('db_size', 'vcf_size')")
+    cursor.executemany(sql_meta_insert, file_sizes)
+    cursor.close()
+
     conn.commit()
     conn.close()
 
@@ -124,6 +310,107 @@ def finalize(db, ref):
         utils.format_time(start, time.time())))
 
 
+def drop_fields(db):
+    """Drop the optional VCF fields stored by :func:`insert_fields`.  A
+    database copied from a previous release must not keep them, they are
+    for the snps of that release.
+
+    Args:
+        db (str): Name of the database file.
+    """
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    for sql in SQL_CREATE_TABLES:
+        cursor.execute(sql)
+
+    for (table_name,) in cursor.execute(
+            'SELECT table_name FROM snp_fields').fetchall():
+        LOG.debug('Dropping {}'.format(table_name))
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(table_name))
+    cursor.execute('DELETE FROM snp_fields')
+
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+
+def insert_fields(db, vcf_file, fields):
+    """Store optional VCF fields of the snps, replacing any stored before.
+
+    Each field is a column group of its own, a table named
+    "snp_field_<n>" holding the rowid of the snp and the value as written
+    in the VCF file, and only for the snps that have a value.  Lookups only
+    read the tables of the fields they ask for and the ``snps`` table stays
+    as it is.  The ``snp_fields`` table lists the fields.
+
+    The snps are matched on chromosome, position and identifier, so this
+    must run after the indices are created.
+
+    Args:
+        db (str): Name of the database file.
+        vcf_file (str): The VCF file of the snps.
+        fields (list): "QUAL", "FILTER" or INFO keys.
+
+    Raises:
+        ValueError: If a field name is invalid.
+    """
+    for field in fields:
+        if not utils.REGEX_FIELD_NAME.match(field):
+            raise ValueError('Invalid field: {}'.format(field))
+
+    LOG.info('Inserting fields {} into database: {}'.format(
+        ', '.join(fields), db))
+
+    start = time.time()
+
+    # a database copied from a previous release has its rowids changed
+    drop_fields(db)
+
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    cursor.execute(SQL_CREATE_VCF_FIELDS)
+
+    sql_value_insert = 'INSERT INTO vcf_fields VALUES (?, ?, ?, ?, ?)'
+    values = []
+
+    with utils.open_resource(vcf_file) as fd:
+        for line in fd:
+            line = line.decode('utf-8')
+            if line.startswith('#'):
+                continue
+
+            columns = line.rstrip('\n').split('\t')
+            for field_id, field in enumerate(fields):
+                value = utils.vcf_field(columns, field)
+                if value is not None:
+                    values.append((columns[0], int(columns[1]), columns[2],
+                                   field_id, value))
+
+            if len(values) >= 1000000:
+                cursor.executemany(sql_value_insert, values)
+                values = []
+
+    cursor.executemany(sql_value_insert, values)
+
+    for field_id, field in enumerate(fields):
+        table_name = 'snp_field_{}'.format(field_id)
+        cursor.execute(SQL_CREATE_FIELD_TABLE.format(table_name))
+        cursor.execute(SQL_INSERT_FIELD.format(table_name), (field_id,))
+        LOG.debug('{}: {:,} values'.format(field, cursor.rowcount))
+        cursor.execute('INSERT INTO snp_fields VALUES (?, ?, ?)',
+                       (field_id, field, table_name))
+
+    cursor.execute('DROP TABLE vcf_fields')
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+    LOG.info('Fields inserted in: {}'.format(
+        utils.format_time(start, time.time())))
+
+
 SQL_CREATE_TABLES = ['''
     CREATE TABLE IF NOT EXISTS meta_info (
        meta_info_key INTEGER,
@@ -138,10 +425,75 @@ SQL_CREATE_TABLES = ['''
        pos INTEGER NOT NULL,
        snp_id TEXT NOT NULL,
        ref TEXT,
-       alt TEXT
+       alt TEXT,
+       variant_class INTEGER
+    );
+''', '''
+    CREATE TABLE IF NOT EXISTS snp_density (
+       chrom TEXT NOT NULL,
+       bin_size INTEGER NOT NULL,
+       bin INTEGER NOT NULL,
+       num_snps INTEGER NOT NULL,
+       PRIMARY KEY (chrom, bin_size, bin)
+    ) WITHOUT ROWID;
+''', '''
+    CREATE TABLE IF NOT EXISTS contig_stats (
+       chrom TEXT NOT NULL,
+       num_snps INTEGER NOT NULL,
+       min_pos INTEGER,
+       max_pos INTEGER,
+       num_snv INTEGER NOT NULL,
+       num_mnv INTEGER NOT NULL,
+       num_insertion INTEGER NOT NULL,
+       num_deletion INTEGER NOT NULL,
+       num_multi_allelic INTEGER NOT NULL,
+       num_other INTEGER NOT NULL,
+       PRIMARY KEY (chrom)
+    );
+''', '''
+    CREATE TABLE IF NOT EXISTS contigs (
+       chrom TEXT NOT NULL,
+       length INTEGER,
+       PRIMARY KEY (chrom)
+    );
+''', '''
+    CREATE TABLE IF NOT EXISTS snp_fields (
+       field_id INTEGER NOT NULL,
+       name TEXT NOT NULL,
+       table_name TEXT NOT NULL,
+       PRIMARY KEY (field_id)
     );
 ''']
 
+SQL_CREATE_VCF_FIELDS = '''
+    CREATE TEMPORARY TABLE vcf_fields (
+       chrom TEXT NOT NULL,
+       pos INTEGER NOT NULL,
+       snp_id TEXT NOT NULL,
+       field_id INTEGER NOT NULL,
+       value TEXT NOT NULL
+    );
+'''
+
+SQL_CREATE_FIELD_TABLE = '''
+    CREATE TABLE {} (
+       snp_rowid INTEGER NOT NULL,
+       value TEXT NOT NULL,
+       PRIMARY KEY (snp_rowid)
+    );
+'''
+
+SQL_INSERT_FIELD = '''
+INSERT OR IGNORE INTO {}
+SELECT s.rowid, v.value
+  FROM vcf_fields v, snps s
+ WHERE s.snp_id = v.snp_id
+   AND s.chrom = v.chrom
+   AND s.pos = v.pos
+   AND v.field_id = ?
+ ORDER BY s.rowid
+'''
+
 SQL_INDICES = [
 #    'CREATE INDEX IF NOT EXISTS idx_snps_chrom ON snps (chrom ASC);',
 #    'CREATE INDEX IF NOT EXISTS idx_snps_pos ON snps (pos ASC);',
@@ -154,8 +506,69 @@ SQL_SELECT_FINAL_INFO = [
 SELECT distinct meta_key meta_key, meta_value, species_id
   FROM meta_info
  ORDER BY meta_key       
+    ''',
+    '''
+SELECT chrom, num_snps, max_pos
+  FROM contig_stats
+ ORDER BY chrom
     '''
 ]
 
+SQL_VARIANT_CLASS = '''
+CASE WHEN alt IS NULL OR alt = '' OR alt = '.' THEN 'other'
+     WHEN instr(alt, ',') > 0 THEN 'multi_allelic'
+     WHEN length(ref) = 1 AND length(alt) = 1 THEN 'snv'
+     WHEN length(ref) = length(alt) THEN 'mnv'
+     WHEN length(ref) < length(alt) THEN 'insertion'
+     ELSE 'deletion'
+END
+'''
+
+# stores the code of the class, its index in utils.VARIANT_CLASSES, of the
+# snps not classified yet
+SQL_UPDATE_VARIANT_CLASS = '''
+UPDATE snps
+   SET variant_class = CASE {} {} END
+ WHERE variant_class IS NULL
+'''.format(SQL_VARIANT_CLASS,
+           ' '.join("WHEN '{}' THEN {}".format(name, code)
+                    for code, name in enumerate(utils.VARIANT_CLASSES)))
+
+
+SQL_INSERT_STATS = '''
+INSERT INTO contig_stats
+SELECT chrom,
+       count(1),
+       min(pos),
+       max(pos),
+       sum(variant_class = 'snv'),
+       sum(variant_class = 'mnv'),
+       sum(variant_class = 'insertion'),
+       sum(variant_class = 'deletion'),
+       sum(variant_class = 'multi_allelic'),
+       sum(variant_class = 'other')
+  FROM (SELECT chrom, pos, {} variant_class FROM snps)
+ GROUP BY chrom
+'''.format(SQL_VARIANT_CLASS)
+
+SQL_INSERT_CONTIG_LENGTHS = '''
+INSERT OR REPLACE INTO contigs
+SELECT s.chrom, s.max_pos
+  FROM contig_stats s
+  LEFT JOIN contigs c ON c.chrom = s.chrom
+ WHERE c.length IS NULL
+'''
+
 SQL_SELECT_CHECKS = [
+    '''
+SELECT *
+  FROM contig_stats
+ WHERE min_pos < 1
+    ''',
+    '''
+SELECT s.*, c.length
+  FROM contig_stats s, contigs c
+ WHERE s.chrom = c.chrom
+   AND s.max_pos > c.length
+    '''
 ]
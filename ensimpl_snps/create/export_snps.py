@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""This module exports the SNPs of a release to Parquet or Arrow IPC files
+for bulk analytics with pandas, Spark, DuckDB and the like.
+
+The SNPs are partitioned by chromosome in the Hive layout::
+
+    <output>/<version>/<species>/chrom=<chromosome>/part-0.parquet
+
+so the chromosome is not stored in the files.  The SNPs are written ordered
+by position in row groups of :data:`ROW_GROUP_SIZE` rows, which keeps the
+position statistics of each row group tight enough for readers to skip the
+row groups outside of a range.  Only one row group is held in memory at a
+time.
+
+``pyarrow`` is only needed by this module and is imported when an export is
+run.
+"""
+import os
+import time
+
+import pysam
+
+import ensimpl_snps.create.ensimpl_db as ensimpl_db
+import ensimpl_snps.db_config as db_config
+import ensimpl_snps.utils as utils
+
+LOG = utils.get_logger()
+
+FORMATS = {
+    'parquet': 'parquet',
+    'arrow': 'arrow'
+}
+
+SOURCES = ['db', 'vcf']
+
+ROW_GROUP_SIZE = 131072
+
+COLUMNS = ['pos', 'snp_id', 'ref', 'alt']
+
+
+def _import_pyarrow():
+    """Import ``pyarrow``.
+
+    Returns:
+        tuple: The ``pyarrow`` and ``pyarrow.parquet`` modules.
+
+    Raises:
+        ValueError: If ``pyarrow`` is not installed.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError('pyarrow is needed to export, install it with '
+                         '"pip install pyarrow"')
+
+    return pyarrow, pyarrow.parquet
+
+
+def get_db_snps(db):
+    """Iterate over the snps of an ensimpl snps database.
+
+    Args:
+        db (str): The ensimpl snps database.
+
+    Yields:
+        tuple: The chromosome, position, SNP identifier, reference allele and
+        alternate allele, ordered by chromosome and position.
+    """
+    for row in ensimpl_db.get_snps(db):
+        yield row[1:]
+
+
+def get_vcf_snps(vcf):
+    """Iterate over the snps of a tabix indexed VCF file.
+
+    Args:
+        vcf (str): The VCF file.
+
+    Yields:
+        tuple: The chromosome, position, SNP identifier, reference allele and
+        alternate allele, ordered by chromosome and position.
+    """
+    with pysam.TabixFile(vcf) as tbx:
+        for contig in tbx.contigs:
+            for row in tbx.fetch(contig, parser=pysam.asTuple()):
+                yield row[0], int(row[1]), row[2], row[3], row[4]
+
+
+class PartitionWriter:
+    """Write the SNPs of one chromosome, one row group at a time.
+
+    Attributes:
+        file_name (str): The file being written.
+        num_snps (int): The number of SNPs written.
+    """
+    def __init__(self, file_name, fmt, compression, row_group_size):
+        """Initialization.
+
+        Args:
+            file_name (str): The file to write.
+            fmt (str): One of :data:`FORMATS`.
+            compression (str): The compression codec.
+            row_group_size (int): The number of rows in a row group.
+        """
+        self._pa, self._pq = _import_pyarrow()
+
+        self.file_name = file_name
+        self.num_snps = 0
+        self._row_group_size = row_group_size
+        self._columns = [[] for _ in COLUMNS]
+        self._schema = self._pa.schema([
+            ('pos', self._pa.int32()),
+            ('snp_id', self._pa.string()),
+            ('ref', self._pa.string()),
+            ('alt', self._pa.string())
+        ])
+
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+        if fmt == 'parquet':
+            self._writer = self._pq.ParquetWriter(
+                file_name, self._schema, compression=compression,
+                write_statistics=['pos'])
+        else:
+            options = self._pa.ipc.IpcWriteOptions(
+                compression=None if compression == 'none' else compression)
+            self._writer = self._pa.ipc.new_file(file_name, self._schema,
+                                                 options=options)
+
+    def write(self, snp):
+        """Add a SNP.
+
+        Args:
+            snp (tuple): The position, SNP identifier, reference allele and
+                alternate allele.
+        """
+        for column, value in zip(self._columns, snp):
+            column.append(value)
+
+        if len(self._columns[0]) >= self._row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Write the SNPs held in memory as one row group."""
+        if not self._columns[0]:
+            return
+
+        batch = self._pa.record_batch(
+            [self._pa.array(column, type=field.type)
+             for column, field in zip(self._columns, self._schema)],
+            schema=self._schema)
+
+        if isinstance(self._writer, self._pq.ParquetWriter):
+            self._writer.write_batch(batch, row_group_size=len(batch))
+        else:
+            self._writer.write_batch(batch)
+
+        self.num_snps += len(batch)
+        self._columns = [[] for _ in COLUMNS]
+
+    def close(self):
+        """Write the remaining SNPs and close the file."""
+        self.flush()
+        self._writer.close()
+
+
+def export_snps(snps, directory, fmt='parquet', compression='zstd',
+                row_group_size=ROW_GROUP_SIZE):
+    """Export `snps` partitioned by chromosome.
+
+    Args:
+        snps (iterable): The SNPs ordered by chromosome and position, each
+            element being a ``tuple`` of chromosome, position, SNP
+            identifier, reference allele and alternate allele.
+        directory (str): The directory to write the partitions to.
+        fmt (str, optional): One of :data:`FORMATS`.
+        compression (str, optional): The compression codec, ``none`` for
+            none.
+        row_group_size (int, optional): The number of rows in a row group.
+
+    Returns:
+        dict: The number of SNPs written keyed by chromosome.
+    """
+    counts = {}
+    writer = None
+    chrom = None
+
+    try:
+        for snp in snps:
+            if snp[0] != chrom:
+                if writer:
+                    writer.close()
+                    counts[chrom] = writer.num_snps
+
+                chrom = snp[0]
+                if chrom in counts:
+                    raise ValueError('SNPs are not ordered by chromosome, '
+                                     '{} found twice'.format(chrom))
+
+                file_name = os.path.join(directory, 'chrom={}'.format(chrom),
+                                         'part-0.{}'.format(FORMATS[fmt]))
+                LOG.debug('Writing {}'.format(file_name))
+                writer = PartitionWriter(file_name, fmt, compression,
+                                         row_group_size)
+
+            writer.write(snp[1:])
+    finally:
+        if writer:
+            writer.close()
+            counts[chrom] = writer.num_snps
+
+    return counts
+
+
+def export(directory, output, versions=None, species=None, fmt='parquet',
+           source='db', compression='zstd', row_group_size=ROW_GROUP_SIZE):
+    """Export the SNPs of the releases in `directory`.
+
+    Args:
+        directory (str): The ensimpl snps data directory.
+        output (str): The directory to export to.
+        versions (list, optional): A ``list`` of Ensembl versions, ``None``
+            for all.
+        species (list, optional): A ``list`` of species, ``None`` for all.
+        fmt (str, optional): One of :data:`FORMATS`.
+        source (str, optional): One of :data:`SOURCES`, read the SNPs from
+            the database or from the tabix indexed VCF file.
+        compression (str, optional): The compression codec, ``none`` for
+            none.
+        row_group_size (int, optional): The number of rows in a row group.
+
+    Raises:
+        ValueError: If `fmt` or `source` is not valid or nothing matches
+            `versions` and `species`.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Invalid format: {}'.format(fmt))
+
+    if source not in SOURCES:
+        raise ValueError('Invalid source: {}'.format(source))
+
+    # fail before reading anything if pyarrow is missing
+    _import_pyarrow()
+
+    db_config.init(directory)
+
+    releases = []
+    for release in db_config.ENSIMPL_SNPS_DBS:
+        if versions and int(release['version']) not in \
+                [int(v) for v in versions]:
+            continue
+        if species and release['species'] not in species:
+            continue
+        if source in release:
+            releases.append(release)
+
+    if not releases:
+        raise ValueError('Nothing to export from {}'.format(directory))
+
+    for release in releases:
+        start = time.time()
+        destination = os.path.join(output, str(release['version']),
+                                   release['species'])
+
+        LOG.info('Exporting {} to {}'.format(release[source], destination))
+
+        if source == 'db':
+            snps = get_db_snps(release['db'])
+        else:
+            snps = get_vcf_snps(release['vcf'])
+
+        counts = export_snps(snps, destination, fmt, compression,
+                             row_group_size)
+
+        LOG.info('{:,} snps in {} chromosomes exported in: {}'.format(
+            sum(counts.values()), len(counts),
+            utils.format_time(start, time.time())))
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""This module stores the genotypes of the samples of a multi-sample VCF
+file, like the inbred and founder strains of the Mouse Genomes Project, for
+the SNPs of an ensimpl snps database, see :mod:`ensimpl_snps.fetch.genotypes`.
+
+The genotypes of "ensimpl_snps.92.Mm.db3" are written to the directory
+"ensimpl_snps.92.Mm.genotypes" next to it.  Every SNP of the database has a
+row in the matrix of its chromosome.  The VCF records are matched to the
+SNPs on chromosome, position and reference allele, and the SNPs without a
+record are not called for any strain.
+
+A genotype is coded as the number of alternate alleles called, so which
+alternate allele of a multi-allelic SNP was called is not kept.  The VCF
+file is read once, in order, and must be sorted like a tabix indexed file.
+SNP and indel files can be joined with ``bcftools concat``.
+"""
+from array import array
+from itertools import groupby
+from operator import itemgetter
+
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+import numpy as np
+
+import ensimpl_snps.create.create_ensimpl_snps as create_ensimpl_snps
+import ensimpl_snps.fetch.genotypes as genotypes
+import ensimpl_snps.fetch.utils as fetch_utils
+import ensimpl_snps.utils as utils
+
+LOG = utils.get_logger()
+
+GENOTYPES_DIR_NAME = 'ensimpl_snps.{}.{}.genotypes'
+
+GENOTYPES_DB_NAME = genotypes.GENOTYPES_DB_NAME
+
+# the positions, rowids and genotypes of a chromosome
+MATRIX_FILE_NAME = '{}.{}.npy'
+
+REGEX_UNSAFE = re.compile(r'[^\w.-]')
+
+REGEX_ALLELE_SEPARATOR = re.compile(r'[/|]')
+
+
+def genotype_code(gt):
+    """Get the 2 bit code of a genotype.
+
+    Args:
+        gt (str): The GT value of a sample, like "0/1", "1|1" or "1".
+
+    Returns:
+        int: One of the codes in :mod:`ensimpl_snps.fetch.genotypes`.
+    """
+    alleles = REGEX_ALLELE_SEPARATOR.split(gt)
+
+    if not gt or '.' in alleles:
+        return genotypes.NO_CALL
+
+    num_alt = sum(allele != '0' for allele in alleles)
+
+    if num_alt == 0:
+        return genotypes.HOM_REF
+    elif num_alt == len(alleles):
+        return genotypes.HOM_ALT
+
+    return genotypes.HET
+
+
+class _GenotypeCodes(dict):
+    """The code of each GT value, worked out the first time it is seen."""
+    def __missing__(self, gt):
+        code = self[gt] = genotype_code(gt.decode('utf-8'))
+        return code
+
+
+def read_samples(vcf_file):
+    """Get the names of the samples in a VCF file.
+
+    Args:
+        vcf_file (str): The VCF file.
+
+    Returns:
+        list: The sample names.
+
+    Raises:
+        ValueError: If the file has no samples.
+    """
+    with utils.open_resource(vcf_file) as fd:
+        for line in fd:
+            line = line.decode('utf-8')
+            if line.startswith('#CHROM'):
+                samples = line.rstrip('\n').split('\t')[9:]
+                if samples:
+                    return samples
+                break
+            elif not line.startswith('#'):
+                break
+
+    raise ValueError('No samples found in {}'.format(vcf_file))
+
+
+def read_records(vcf_file, samples=None):
+    """Read the genotypes of some samples from a VCF file.
+
+    Args:
+        vcf_file (str): The VCF file.
+        samples (list, optional): The index of each sample to read, ``None``
+            for all.
+
+    Yields:
+        tuple: The chromosome, position, reference allele and the ``bytes``
+        of the genotype code of each sample.
+    """
+    codes = _GenotypeCodes()
+    no_calls = None
+
+    with utils.open_resource(vcf_file) as fd:
+        for line in fd:
+            if line.startswith(b'#'):
+                continue
+
+            values = line.rstrip(b'\r\n').split(b'\t')
+            sample_values = values[9:] if samples is None else \
+                [values[9 + sample] for sample in samples]
+
+            # GT is the first key of the format when there is one
+            if values[8].split(b':', 1)[0] == b'GT':
+                record_codes = bytes([codes[value.split(b':', 1)[0]]
+                                      for value in sample_values])
+            else:
+                no_calls = no_calls or \
+                    bytes([genotypes.NO_CALL] * len(sample_values))
+                record_codes = no_calls
+
+            yield (values[0].decode('utf-8'), int(values[1]),
+                   values[3].decode('utf-8'), record_codes)
+
+
+def _write_matrix(cursor, genotypes_dir, chrom, min_rowid, max_rowid,
+                  records, num_strains):
+    """Write the genotypes of the SNPs of one chromosome.
+
+    Args:
+        cursor (sqlite3.Cursor): A cursor of the ensimpl snps database.
+        genotypes_dir (str): The genotypes directory.
+        chrom (str): The chromosome.
+        min_rowid (int): The smallest rowid of a SNP on `chrom`.
+        max_rowid (int): The largest rowid of a SNP on `chrom`.
+        records (iterable): The records of `chrom`, see
+            :func:`read_records`.
+        num_strains (int): The number of strains.
+
+    Returns:
+        tuple: The number of SNPs, the number of them with a record and the
+        positions, rowids and genotypes file names.
+
+    Raises:
+        ValueError: If the records are not sorted by position.
+    """
+    rowids = array('q')
+    positions = array('I')
+    refs = []
+
+    for rowid, pos, ref in cursor.execute(SQL_SELECT_SNPS, {
+            'chrom': chrom, 'min_rowid': min_rowid, 'max_rowid': max_rowid}):
+        rowids.append(rowid)
+        positions.append(pos)
+        refs.append(ref)
+
+    num_snps = len(rowids)
+    codes = np.full((num_snps, num_strains), genotypes.NO_CALL,
+                    dtype=np.uint8)
+    called = np.zeros(num_snps, dtype=bool)
+
+    # both are ordered by position, the first record of a SNP is used
+    idx = 0
+    previous = 0
+    for _, pos, ref, record_codes in records:
+        if pos < previous:
+            raise ValueError('The VCF file is not sorted, chromosome {} '
+                             'position {}'.format(chrom, pos))
+        previous = pos
+
+        while idx < num_snps and positions[idx] < pos:
+            idx += 1
+
+        row = idx
+        while row < num_snps and positions[row] == pos:
+            if refs[row] == ref and not called[row]:
+                codes[row] = np.frombuffer(record_codes, dtype=np.uint8)
+                called[row] = True
+            row += 1
+
+    safe_chrom = REGEX_UNSAFE.sub('_', chrom)
+    file_names = [MATRIX_FILE_NAME.format(kind, safe_chrom)
+                  for kind in ['positions', 'rowids', 'genotypes']]
+    matrices = [np.asarray(positions, dtype=np.uint32),
+                np.asarray(rowids, dtype=np.int64),
+                genotypes.pack_genotypes(codes)]
+
+    for file_name, matrix in zip(file_names, matrices):
+        np.save(os.path.join(genotypes_dir, file_name), matrix)
+
+    return (num_snps, int(called.sum())) + tuple(file_names)
+
+
+def create_genotypes(db, vcf_file, genotypes_dir, strains=None):
+    """Store the genotypes of the samples in `vcf_file` for the snps in
+    `db`.
+
+    Args:
+        db (str): The ensimpl snps database.
+        vcf_file (str): The multi-sample VCF file.
+        genotypes_dir (str): The directory to write the genotypes to,
+            replaced if it exists.
+        strains (list, optional): The samples to store, ``None`` for all.
+
+    Raises:
+        ValueError: If a strain is not a sample of `vcf_file` or the file is
+            not sorted.
+    """
+    LOG.info('Creating genotypes: {}'.format(genotypes_dir))
+
+    start = time.time()
+
+    samples = read_samples(vcf_file)
+
+    for strain in strains or []:
+        if strain not in samples:
+            raise ValueError('Strain {} is not in {}'.format(strain,
+                                                              vcf_file))
+
+    indices = [samples.index(strain) for strain in strains] \
+        if strains else None
+    strains = strains or samples
+
+    if os.path.isdir(genotypes_dir):
+        shutil.rmtree(genotypes_dir)
+    os.makedirs(genotypes_dir)
+
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    # the rowids of a chromosome are contiguous unless the database was
+    # built from the previous release, the chromosome is checked either way
+    chroms = {row[0]: row[1:] for row in
+              cursor.execute(SQL_SELECT_CHROM_ROWIDS).fetchall()}
+    aliases = {alias: chrom for chrom in chroms
+               for alias in fetch_utils.contig_aliases(chrom)}
+
+    matrices = {}
+    for vcf_chrom, records in groupby(read_records(vcf_file, indices),
+                                      itemgetter(0)):
+        chrom = aliases.get(vcf_chrom.upper())
+
+        if chrom is None:
+            LOG.debug('Skipping chromosome {}'.format(vcf_chrom))
+            continue
+        elif chrom in matrices:
+            raise ValueError('The VCF file is not sorted, chromosome {} is '
+                             'not in one block'.format(vcf_chrom))
+
+        matrices[chrom] = _write_matrix(cursor, genotypes_dir, chrom,
+                                        chroms[chrom][0], chroms[chrom][1],
+                                        records, len(strains))
+        LOG.debug('Chromosome {}: {:,} snps, {:,} with genotypes'.format(
+            chrom, *matrices[chrom][:2]))
+
+    for chrom in sorted(set(chroms) - set(matrices)):
+        LOG.debug('Chromosome {}: no genotypes'.format(chrom))
+        matrices[chrom] = _write_matrix(cursor, genotypes_dir, chrom,
+                                        chroms[chrom][0], chroms[chrom][1],
+                                        [], len(strains))
+
+    cursor.close()
+    conn.close()
+
+    conn = sqlite3.connect(os.path.join(genotypes_dir, GENOTYPES_DB_NAME))
+    cursor = conn.cursor()
+
+    for sql in SQL_CREATE_TABLES:
+        cursor.execute(sql)
+
+    cursor.executemany('INSERT INTO strains VALUES (?, ?)',
+                       enumerate(strains))
+    cursor.executemany('INSERT INTO matrices VALUES (?, ?, ?, ?, ?, ?)',
+                       [(chrom,) + matrix
+                        for chrom, matrix in sorted(matrices.items())])
+
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+    LOG.info('{:,} strains, {:,} of {:,} snps with genotypes'.format(
+        len(strains), sum(matrix[1] for matrix in matrices.values()),
+        sum(matrix[0] for matrix in matrices.values())))
+    LOG.info('Genotypes created in: {}'.format(
+        utils.format_time(start, time.time())))
+
+
+def create(directory, vcf_file, versions=None, species=None, strains=None):
+    """Create the genotypes of every ensimpl snps database in `directory` or
+    any directory below it.  The genotypes directory is written next to its
+    database.
+
+    Args:
+        directory (str): The directory holding the databases.
+        vcf_file (str): The multi-sample VCF file.
+        versions (list, optional): A ``list`` of Ensembl versions, ``None``
+            for all.
+        species (list, optional): A ``list`` of species, ``None`` for all.
+        strains (list, optional): The samples to store, ``None`` for all.
+
+    Returns:
+        list: The genotypes directories that were created.
+    """
+    dirs = []
+    for version, species_id, db in create_ensimpl_snps.find_dbs(directory):
+        if versions and version not in [int(v) for v in versions]:
+            continue
+        if species and species_id not in species:
+            continue
+
+        genotypes_dir = os.path.join(
+            os.path.dirname(db), GENOTYPES_DIR_NAME.format(version,
+                                                           species_id))
+        create_genotypes(db, vcf_file, genotypes_dir, strains)
+        dirs.append(genotypes_dir)
+
+    return dirs
+
+
+SQL_SELECT_CHROM_ROWIDS = '''
+SELECT chrom, min(rowid), max(rowid)
+  FROM snps
+ GROUP BY chrom
+ ORDER BY chrom
+'''
+
+SQL_SELECT_SNPS = '''
+SELECT rowid, pos, ref
+  FROM snps
+ WHERE rowid BETWEEN :min_rowid AND :max_rowid
+   AND chrom = :chrom
+ ORDER BY pos, rowid
+'''
+
+SQL_CREATE_TABLES = ['''
+    CREATE TABLE IF NOT EXISTS strains (
+       strain_id INTEGER NOT NULL,
+       name TEXT NOT NULL,
+       PRIMARY KEY (strain_id)
+    );
+''', '''
+    CREATE TABLE IF NOT EXISTS matrices (
+       chrom TEXT NOT NULL,
+       num_snps INTEGER NOT NULL,
+       num_called INTEGER NOT NULL,
+       positions_file TEXT NOT NULL,
+       rowids_file TEXT NOT NULL,
+       genotypes_file TEXT NOT NULL,
+       PRIMARY KEY (chrom)
+    );
+''']
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""This module creates the cross release presence index, which records the
+Ensembl releases each SNP identifier is found in and where it was located.
+
+Every species has its releases numbered by a bit.  For each SNP identifier
+the index keeps a bitmap of the releases it is in, a bitmap of the releases
+it moved in and the position in the most recent release.  The position is
+also recorded in the ``positions`` table for every release where it changed,
+so the position in any release is the most recent change at or before it.
+"""
+from operator import itemgetter
+
+import os
+import sqlite3
+import time
+
+import ensimpl_snps.create.create_ensimpl_snps as create_ensimpl_snps
+import ensimpl_snps.db_config as db_config
+import ensimpl_snps.utils as utils
+
+LOG = utils.get_logger()
+
+PRESENCE_DB_NAME = db_config.ENSIMPL_SNPS_PRESENCE_DB_NAME
+
+# the bitmaps are stored as signed 64 bit integers
+MAX_RELEASES = 63
+
+# number of rows to hold in memory before writing them
+BATCH_SIZE = 1000000
+
+
+def initialize(db):
+    """Initialize the presence database.
+
+    Args:
+        db (str): Full path to the database file.
+    """
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    for sql in SQL_CREATE_TABLES:
+        LOG.debug(sql)
+        cursor.execute(sql)
+
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+
+def get_releases(db, species_id):
+    """Get the releases already in the index for `species_id`.
+
+    Args:
+        db (str): Full path to the database file.
+        species_id (str): The Ensembl species identifier.
+
+    Returns:
+        list: A ``list`` of (bit, version) ordered by bit.
+    """
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    sql_releases = ('SELECT bit, version '
+                    '  FROM releases '
+                    ' WHERE species_id = ? '
+                    ' ORDER BY bit')
+
+    releases = cursor.execute(sql_releases, (species_id,)).fetchall()
+
+    cursor.close()
+    conn.close()
+
+    return releases
+
+
+def delete_species(db, species_id):
+    """Delete the releases and identifiers of `species_id` from the index,
+    leaving the other species as they are.
+
+    Args:
+        db (str): Full path to the database file.
+        species_id (str): The Ensembl species identifier.
+    """
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+
+    for table_name in ['releases', 'presence', 'positions']:
+        cursor.execute('DELETE FROM {} WHERE species_id = ?'.format(
+            table_name), (species_id,))
+
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+
+def get_release_snps(release_db):
+    """Iterate over the snps of a release, one row per SNP identifier.  If an
+    identifier is found more than once, the first position is used.
+
+    Args:
+        release_db (str): The release database.
+
+    Yields:
+        tuple: The SNP identifier, chromosome and position.
+    """
+    conn = sqlite3.connect(release_db)
+    cursor = conn.cursor()
+
+    sql_snps = ('SELECT snp_id, chrom, pos '
+                '  FROM snps '
+                ' ORDER BY snp_id, chrom, pos')
+
+    try:
+        previous = None
+        for row in cursor.execute(sql_snps):
+            if row[0] != previous:
+                previous = row[0]
+                yield row
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def add_release(db, release_db, version, species_id, bit):
+    """Add a release to the index.  The existing identifiers and the
+    identifiers of the release are read in identifier order and merged, so
+    memory use does not depend on the number of identifiers.  Only the
+    identifiers of the release are written, to a temporary table replacing
+    their rows once the merge is done, the other rows and species are left
+    as they are.
+
+    Args:
+        db (str): Full path to the presence database file.
+        release_db (str): The release database.
+        version (int): The Ensembl version of `release_db`.
+        species_id (str): The Ensembl species identifier.
+        bit (int): The bit of the release.
+    """
+    LOG.info('Adding release {} {} as bit {}'.format(version, species_id, bit))
+
+    start = time.time()
+    mask = 1 << bit
+
+    conn = sqlite3.connect(db)
+    read_cursor = conn.cursor()
+    write_cursor = conn.cursor()
+
+    write_cursor.execute('DROP TABLE IF EXISTS temp.presence_release')
+    write_cursor.execute(SQL_CREATE_PRESENCE.format('temp.presence_release'))
+
+    sql_presence = ('SELECT snp_id, releases, moved, chrom, pos '
+                    '  FROM presence '
+                    ' WHERE species_id = ? '
+                    ' ORDER BY snp_id')
+
+    sql_presence_insert = ('INSERT INTO temp.presence_release '
+                           'VALUES (?, ?, ?, ?, ?, ?)')
+
+    sql_positions_insert = 'INSERT INTO positions VALUES (?, ?, ?, ?, ?)'
+
+    presence = []
+    positions = []
+
+    def flush():
+        write_cursor.executemany(sql_presence_insert, presence)
+        write_cursor.executemany(sql_positions_insert, positions)
+        del presence[:], positions[:]
+
+    merged = utils.merge_join(read_cursor.execute(sql_presence, (species_id,)),
+                              get_release_snps(release_db),
+                              itemgetter(0))
+
+    for old, new in merged:
+        if new is None:
+            continue
+        elif old is None:
+            presence.append((species_id, new[0], mask, 0, new[1], new[2]))
+            positions.append((species_id, new[0], bit, new[1], new[2]))
+        else:
+            snp_id, releases, moved, chrom, pos = old
+            if (chrom, pos) != new[1:]:
+                moved |= mask
+                positions.append((species_id, snp_id, bit, new[1], new[2]))
+            presence.append((species_id, snp_id, releases | mask, moved,
+                             new[1], new[2]))
+
+        if len(presence) >= BATCH_SIZE:
+            flush()
+
+    flush()
+
+    read_cursor.close()
+
+    write_cursor.execute('INSERT OR REPLACE INTO presence '
+                         'SELECT * FROM temp.presence_release')
+    write_cursor.execute('DROP TABLE temp.presence_release')
+    write_cursor.execute('INSERT INTO releases VALUES (?, ?, ?)',
+                         (species_id, bit, version))
+    write_cursor.close()
+
+    conn.commit()
+    conn.close()
+
+    LOG.info('Release added in: {}'.format(
+        utils.format_time(start, time.time())))
+
+
+def create(directory, species=None):
+    """Create or update the presence index for all the databases in
+    `directory` or any directory below it.  The index is written to
+    :data:`PRESENCE_DB_NAME` in `directory`.
+
+    Releases must be added oldest first.  Newer releases are appended to an
+    existing index, but if an older release is found the index of that
+    species is rebuilt.
+
+    Args:
+        directory (str): The directory holding the release databases.
+        species (list, optional): A ``list`` of species to index, ``None``
+            for all.
+    """
+    db = os.path.join(directory, PRESENCE_DB_NAME)
+
+    all_dbs = {}
+    for version, species_id, release_db in \
+            create_ensimpl_snps.find_dbs(directory):
+        if not species or species_id in species:
+            all_dbs.setdefault(species_id, []).append((version, release_db))
+
+    initialize(db)
+
+    for species_id, release_dbs in sorted(all_dbs.items()):
+        releases = get_releases(db, species_id)
+        indexed = [version for _, version in releases]
+
+        if indexed and \
+                [version for version, _ in release_dbs][:len(indexed)] != \
+                indexed:
+            LOG.warning('Releases out of order for {}, rebuilding '
+                        'the index'.format(species_id))
+            delete_species(db, species_id)
+            indexed = []
+
+        if len(release_dbs) > MAX_RELEASES:
+            raise ValueError('Too many releases for {}: {} > {}'.format(
+                species_id, len(release_dbs), MAX_RELEASES))
+
+        for bit, (version, release_db) in enumerate(release_dbs):
+            if bit >= len(indexed):
+                add_release(db, release_db, version, species_id, bit)
+
+
+SQL_CREATE_PRESENCE = '''
+    CREATE TABLE IF NOT EXISTS {} (
+       species_id TEXT NOT NULL,
+       snp_id TEXT NOT NULL,
+       releases INTEGER NOT NULL,
+       moved INTEGER NOT NULL,
+       chrom TEXT NOT NULL,
+       pos INTEGER NOT NULL,
+       PRIMARY KEY (species_id, snp_id)
+    ) WITHOUT ROWID;
+'''
+
+SQL_CREATE_TABLES = ['''
+    CREATE TABLE IF NOT EXISTS releases (
+       species_id TEXT NOT NULL,
+       bit INTEGER NOT NULL,
+       version INTEGER NOT NULL,
+       PRIMARY KEY (species_id, bit)
+    );
+''', SQL_CREATE_PRESENCE.format('presence'), '''
+    CREATE TABLE IF NOT EXISTS positions (
+       species_id TEXT NOT NULL,
+       snp_id TEXT NOT NULL,
+       bit INTEGER NOT NULL,
+       chrom TEXT NOT NULL,
+       pos INTEGER NOT NULL,
+       PRIMARY KEY (species_id, snp_id, bit)
+    ) WITHOUT ROWID;
+''']
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""This module splits an ensimpl snps database into per chromosome shards,
+see :mod:`ensimpl_snps.fetch.shards`.
+
+The shards of "ensimpl_snps.92.Mm.db3" are written to the directory
+"ensimpl_snps.92.Mm.shards" next to it, one database per chromosome, each
+holding the ``snps`` table and its identifier index.  The shards are written
+by separate processes at the same time.  The router database in the same
+directory lists the shards and maps every SNP identifier to the shards
+holding it.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import os
+import re
+import shutil
+import sqlite3
+import time
+
+import ensimpl_snps.create.create_ensimpl_snps as create_ensimpl_snps
+import ensimpl_snps.utils as utils
+
+LOG = utils.get_logger()
+
+SHARDS_DIR_NAME = 'ensimpl_snps.{}.{}.shards'
+
+ROUTER_DB_NAME = 'router.db3'
+
+SHARD_DB_NAME = 'shard.{}.db3'
+
+REGEX_UNSAFE = re.compile(r'[^\w.-]')
+
+
+def _create_shard(db, shard_db, chrom, min_rowid, max_rowid):
+    """Copy the SNPs of one chromosome into a shard database.
+
+    Args:
+        db (str): The ensimpl snps database.
+        shard_db (str): Full path to the shard database.
+        chrom (str): The chromosome.
+        min_rowid (int): The smallest rowid of a SNP on `chrom` in `db`.
+        max_rowid (int): The largest rowid of a SNP on `chrom` in `db`.
+
+    Returns:
+        int: The number of SNPs copied.
+    """
+    utils.delete_file(shard_db)
+
+    conn = sqlite3.connect(shard_db)
+    cursor = conn.cursor()
+
+    for sql in SQL_CREATE_SHARD_TABLES:
+        cursor.execute(sql)
+
+    cursor.execute('ATTACH DATABASE ? AS src', (db,))
+    cursor.execute(SQL_COPY_SNPS, {'chrom': chrom, 'min_rowid': min_rowid,
+                                   'max_rowid': max_rowid})
+    num_snps = cursor.rowcount
+    conn.commit()
+    cursor.execute('DETACH DATABASE src')
+
+    for sql in SQL_SHARD_INDICES:
+        cursor.execute(sql)
+
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+    return num_snps
+
+
+def create_shards(db, shards_dir, workers=None):
+    """Split the snps in `db` into per chromosome shards and create the
+    router database.
+
+    Args:
+        db (str): The ensimpl snps database.
+        shards_dir (str): The directory to write the shards to, replaced if
+            it exists.
+        workers (int, optional): The number of shards written at the same
+            time, the number of CPUs if ``None``.
+    """
+    LOG.info('Creating shards: {}'.format(shards_dir))
+
+    start = time.time()
+
+    if os.path.isdir(shards_dir):
+        shutil.rmtree(shards_dir)
+    os.makedirs(shards_dir)
+
+    conn = sqlite3.connect(db)
+    # the rowids of a chromosome are contiguous unless the database was
+    # built from the previous release, the chromosome is checked either way
+    chroms = conn.execute(SQL_SELECT_CHROM_ROWIDS).fetchall()
+    conn.close()
+
+    shards = []
+    for shard_id, (chrom, min_rowid, max_rowid) in enumerate(chroms):
+        file_name = SHARD_DB_NAME.format(REGEX_UNSAFE.sub('_', chrom))
+        shards.append((shard_id, chrom, file_name, min_rowid, max_rowid))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_create_shard, db,
+                                   os.path.join(shards_dir, shard[2]),
+                                   shard[1], shard[3], shard[4])
+                   for shard in shards]
+        num_snps = [future.result() for future in futures]
+
+    LOG.info('Creating router...')
+
+    router_db = os.path.join(shards_dir, ROUTER_DB_NAME)
+    conn = sqlite3.connect(router_db)
+    cursor = conn.cursor()
+
+    for sql in SQL_CREATE_ROUTER_TABLES:
+        cursor.execute(sql)
+
+    for (shard_id, chrom, file_name, _, _), count in zip(shards, num_snps):
+        LOG.debug('Shard {}: {} with {:,} snps'.format(shard_id, chrom,
+                                                       count))
+        cursor.execute('INSERT INTO shards VALUES (?, ?, ?, ?)',
+                       (shard_id, chrom, file_name, count))
+        cursor.execute('ATTACH DATABASE ? AS shard',
+                       (os.path.join(shards_dir, file_name),))
+        cursor.execute(SQL_INSERT_ROUTES, (shard_id,))
+        conn.commit()
+        cursor.execute('DETACH DATABASE shard')
+
+    cursor.close()
+    conn.commit()
+    conn.close()
+
+    LOG.info('{:,} snps in {} shards'.format(sum(num_snps), len(shards)))
+    LOG.info('Shards created in: {}'.format(
+        utils.format_time(start, time.time())))
+
+
+def create(directory, versions=None, species=None, workers=None):
+    """Create the shards of every ensimpl snps database in `directory` or any
+    directory below it.  The shards directory is written next to its
+    database.
+
+    Args:
+        directory (str): The directory holding the databases.
+        versions (list, optional): A ``list`` of Ensembl versions, ``None``
+            for all.
+        species (list, optional): A ``list`` of species, ``None`` for all.
+        workers (int, optional): The number of shards written at the same
+            time, the number of CPUs if ``None``.
+
+    Returns:
+        list: The shards directories that were created.
+    """
+    dirs = []
+    for version, species_id, db in create_ensimpl_snps.find_dbs(directory):
+        if versions and version not in [int(v) for v in versions]:
+            continue
+        if species and species_id not in species:
+            continue
+
+        shards_dir = os.path.join(os.path.dirname(db),
+                                  SHARDS_DIR_NAME.format(version, species_id))
+        create_shards(db, shards_dir, workers)
+        dirs.append(shards_dir)
+
+    return dirs
+
+
+SQL_CREATE_SHARD_TABLES = ['''
+    CREATE TABLE IF NOT EXISTS snps (
+       chrom TEXT NOT NULL,
+       pos INTEGER NOT NULL,
+       snp_id TEXT NOT NULL,
+       ref TEXT,
+       alt TEXT
+    );
+''']
+
+SQL_SHARD_INDICES = [
+    'CREATE INDEX IF NOT EXISTS idx_snps_id ON snps (snp_id ASC);',
+]
+
+SQL_SELECT_CHROM_ROWIDS = '''
+SELECT chrom, min(rowid), max(rowid)
+  FROM snps
+ GROUP BY chrom
+ ORDER BY chrom
+'''
+
+SQL_COPY_SNPS = '''
+INSERT INTO snps
+SELECT chrom, pos, snp_id, ref, alt
+  FROM src.snps
+ WHERE rowid BETWEEN :min_rowid AND :max_rowid
+   AND chrom = :chrom
+ ORDER BY pos
+'''
+
+SQL_CREATE_ROUTER_TABLES = ['''
+    CREATE TABLE IF NOT EXISTS shards (
+       shard_id INTEGER NOT NULL,
+       chrom TEXT NOT NULL,
+       file_name TEXT NOT NULL,
+       num_snps INTEGER NOT NULL,
+       PRIMARY KEY (shard_id)
+    );
+''', '''
+    CREATE TABLE IF NOT EXISTS snp_shards (
+       snp_id TEXT NOT NULL,
+       shard_id INTEGER NOT NULL,
+       PRIMARY KEY (snp_id, shard_id)
+    ) WITHOUT ROWID;
+''']
+
+SQL_INSERT_ROUTES = '''
+INSERT OR IGNORE INTO snp_shards
+SELECT DISTINCT snp_id, ?
+  FROM shard.snps
+ ORDER BY snp_id
+'''
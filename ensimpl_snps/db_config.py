@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import glob
 import os
+import re
 import sys
 
 import ensimpl_snps.utils as utils
@@ -9,6 +10,13 @@ ENSIMPL_SNPS_DB_NAME = 'ensimpl_snps.*.db3'
 ENSIMPL_SNPS_DBS = None
 ENSIMPL_SNPS_DB_DICT = None
 ENSIMPL_SNPS_DIR = None
+ENSIMPL_SNPS_PRESENCE_DB = None
+ENSIMPL_SNPS_PRESENCE_DB_NAME = 'ensimpl_snps.presence.db3'
+
+REGEX_DIFF_DB_NAME = re.compile(r'ensimpl_snps\.diff\.(\d+)\.(\d+)\.(\w+)\.db3$')
+REGEX_SHARDS_DIR_NAME = re.compile(r'ensimpl_snps\.(\d+)\.(\w+)\.shards$')
+REGEX_GENOTYPES_DIR_NAME = re.compile(
+    r'ensimpl_snps\.(\d+)\.(\w+)\.genotypes$')
 
 
 def get_ensimpl_snp_db(version, species):
@@ -36,12 +44,54 @@ def get_ensimpl_snp_db(version, species):
         raise ValueError('Unable to find version "{}" and species "{}"'.format(version, species))
 
 
-def get_all_ensimpl_snps_dbs(top_dir):
-    """Configure the list of ensimpl snp db files in `directory`.  This will
-    set values for :data:`ENSIMPL_SNPS_DBS` and :data:`ENSIMPL_SNPS_DBS_DICT`.
+def get_ensimpl_snps_diff_db(from_version, to_version, species):
+    """Get the database of SNP differences between two releases.
+
+    Args:
+        from_version (int): The older Ensembl version number.
+        to_version (int): The newer Ensembl version number.
+        species (str): The short identifier of a species.
+
+    Returns:
+        str: The database file.
+
+    Raises:
+        ValueError: If unable to find the differences.
+    """
+    try:
+        return get_ensimpl_snp_db(to_version, species)['diffs'][int(from_version)]
+    except Exception as e:
+        raise ValueError('Unable to find differences from version "{}" to '
+                         '"{}" for species "{}"'.format(from_version,
+                                                        to_version,
+                                                        species)) from e
+
+
+def get_ensimpl_snps_presence_db():
+    """Get the cross release presence index.
+
+    Returns:
+        str: The database file.
+
+    Raises:
+        ValueError: If there is no presence index.
+    """
+    if not ENSIMPL_SNPS_PRESENCE_DB:
+        raise ValueError('No presence index found')
+
+    return ENSIMPL_SNPS_PRESENCE_DB
+
+
+def find_ensimpl_snps_dbs(top_dir):
+    """Find the ensimpl snp db files, VCF files, columnar stores, shards,
+    strain genotypes and release differences in the version directories of
+    `top_dir`.
 
     Args:
         top_dir (str): The directory path.
+
+    Returns:
+        dict: The files of each release keyed by "version:species".
     """
     version_dict = {}
     for directory in sorted(os.listdir(top_dir)):
@@ -52,11 +102,50 @@ def get_all_ensimpl_snps_dbs(top_dir):
                 f = os.path.abspath(os.path.join(d, file))
                 if os.path.isfile(f):
                     files_in_dir.append(f)
+                elif REGEX_SHARDS_DIR_NAME.match(file) and \
+                        os.path.isfile(os.path.join(f, 'router.db3')):
+                    species = REGEX_SHARDS_DIR_NAME.match(file).group(2)
+                    k = '{}:{}'.format(directory, species)
+                    temp = version_dict.get(k, {})
+                    temp['shards'] = f
+                    temp['species'] = species
+                    temp['version'] = directory
+                    version_dict[k] = temp
+                elif REGEX_GENOTYPES_DIR_NAME.match(file) and \
+                        os.path.isfile(os.path.join(f, 'genotypes.db3')):
+                    species = REGEX_GENOTYPES_DIR_NAME.match(file).group(2)
+                    k = '{}:{}'.format(directory, species)
+                    temp = version_dict.get(k, {})
+                    temp['genotypes'] = f
+                    temp['species'] = species
+                    temp['version'] = directory
+                    version_dict[k] = temp
             if len(files_in_dir):
                 version = files_in_dir[0].split('/')[-2]
                 for file in files_in_dir:
                     elems = file.split('/')
-                    if file[-4:] == '.db3':
+                    diff_match = REGEX_DIFF_DB_NAME.search(file)
+                    if diff_match:
+                        species = diff_match.group(3)
+                        k = '{}:{}'.format(version, species)
+                        temp = version_dict.get(k, {})
+                        diffs = temp.get('diffs', {})
+                        diffs[int(diff_match.group(1))] = file
+                        temp['diffs'] = diffs
+                        temp['species'] = species
+                        temp['version'] = version
+                        version_dict[k] = temp
+
+                    elif file[-5:] == '.snpc':
+                        species = elems[-1].split('.')[-2]
+                        k = '{}:{}'.format(version, species)
+                        temp = version_dict.get(k, {})
+                        temp['columnar'] = file
+                        temp['species'] = species
+                        temp['version'] = version
+                        version_dict[k] = temp
+
+                    elif file[-4:] == '.db3':
                         species = elems[-1].split('.')[-2]
                         k = '{}:{}'.format(version, species)
                         temp = version_dict.get(k, {})
@@ -78,10 +167,23 @@ def get_all_ensimpl_snps_dbs(top_dir):
                             k = '{}:Hs'.format(version)
                             temp = version_dict.get(k, {})
                             temp['vcf'] = file
-                            temp['species'] = 'Mm'
+                            temp['species'] = 'Hs'
                             temp['version'] = version
                             version_dict[k] = temp
 
+    return version_dict
+
+
+def get_all_ensimpl_snps_dbs(top_dir):
+    """Configure the list of ensimpl snp db files in `directory`.  This will
+    set values for :data:`ENSIMPL_SNPS_DBS`, :data:`ENSIMPL_SNPS_DBS_DICT`
+    and :data:`ENSIMPL_SNPS_PRESENCE_DB`.
+
+    Args:
+        top_dir (str): The directory path.
+    """
+    version_dict = find_ensimpl_snps_dbs(top_dir)
+
     # sort the databases in descending order by version and than species for
     # readability in the API
     all_sorted_dbs = utils.multikeysort(version_dict.values(),
@@ -92,7 +194,12 @@ def get_all_ensimpl_snps_dbs(top_dir):
     global ENSIMPL_SNPS_DB_DICT
     ENSIMPL_SNPS_DB_DICT = version_dict
     global ENSIMPL_SNPS_DIR
-    ENSIMPL_SNPS_DIR = os.path.abspath(directory)
+    ENSIMPL_SNPS_DIR = os.path.abspath(top_dir)
+
+    presence_db = os.path.join(top_dir, ENSIMPL_SNPS_PRESENCE_DB_NAME)
+    global ENSIMPL_SNPS_PRESENCE_DB
+    ENSIMPL_SNPS_PRESENCE_DB = presence_db if os.path.isfile(presence_db) \
+        else None
 
 
 def init(directory=None):
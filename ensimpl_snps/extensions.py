@@ -1,4 +1,4 @@
 # -*- coding: utf-8 -*-
-from flask_debugtoolbar import DebugToolbarExtension
+from ensimpl_snps.admission import AdmissionControl
 
-debug_toolbar = DebugToolbarExtension()
+admission = AdmissionControl()
@@ -0,0 +1,642 @@
+# -*- coding: utf_8 -*-
+"""Annotate intervals and coordinates in bulk with the SNPs of a release.
+
+Rather than one lookup per interval or coordinate, the input is put in
+genome order and the SNPs are read in one sweep per chromosome, so the cost
+follows the size of the genome covered and not the number of rows.
+"""
+from itertools import chain, groupby
+
+import heapq
+import os
+import sys
+import tempfile
+import time
+
+import pysam
+
+import ensimpl_snps.utils as utils
+import ensimpl_snps.fetch.utils as fetch_utils
+
+LOG = utils.get_logger()
+
+# intervals closer than this are read with one tabix fetch, which is cheaper
+# than seeking again
+MERGE_GAP = 10000
+
+# number of rows sorted in memory at a time when the input is not sorted
+SORT_BUFFER_SIZE = 1000000
+
+# rows between progress messages
+PROGRESS_ROWS = 1000000
+
+FORMATS = ['vcf', 'tsv']
+
+
+class Interval:
+    """A BED interval.
+
+    Attributes:
+        chromosome (str): The chromosome as found in the BED file.
+        start (int): The 0-based start.
+        end (int): The end, not included.
+        fields (list): All the fields of the BED line.
+    """
+    __slots__ = ['chromosome', 'start', 'end', 'fields']
+
+    def __init__(self, fields):
+        """Initialization.
+
+        Args:
+            fields (list): The fields of a BED line.
+
+        Raises:
+            ValueError: If there are less than 3 fields or the start and end
+                are not valid.
+        """
+        if len(fields) < 3:
+            raise ValueError('BED lines need at least 3 fields')
+
+        self.fields = fields
+        self.chromosome = fields[0]
+        self.start = int(fields[1])
+        self.end = int(fields[2])
+
+        if self.start < 0 or self.end < self.start:
+            raise ValueError('Invalid interval: {}'.format(
+                '\t'.join(fields[:3])))
+
+
+def read_bed(stream):
+    """Read the intervals of a BED file.  Header, comment and blank lines are
+    skipped.
+
+    Args:
+        stream (file): The open BED file.
+
+    Returns:
+        list: A ``list`` of :class:`Interval` in the order of the file.
+
+    Raises:
+        ValueError: If a line is invalid, with its line number.
+    """
+    intervals = []
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip() or line.startswith(('#', 'track', 'browser')):
+            continue
+
+        try:
+            intervals.append(Interval(line.rstrip('\r\n').split('\t')))
+        except ValueError as e:
+            raise ValueError('Line {}: {}'.format(line_number, e))
+
+    return intervals
+
+
+def merge_intervals(intervals, gap=MERGE_GAP):
+    """Merge sorted intervals of one chromosome into blocks that are read
+    with one fetch each.
+
+    Args:
+        intervals (list): The :class:`Interval` objects ordered by start.
+        gap (int, optional): Intervals less than `gap` apart are merged.
+
+    Returns:
+        list: A ``list`` of (start, end, intervals) with 0-based `start` and
+        the intervals of each block.
+    """
+    blocks = []
+
+    for interval in intervals:
+        if blocks and interval.start <= blocks[-1][1] + gap:
+            block = blocks[-1]
+            block[1] = max(block[1], interval.end)
+            block[2].append(interval)
+        else:
+            blocks.append([interval.start, interval.end, [interval]])
+
+    return [tuple(block) for block in blocks]
+
+
+def _sweep(snps, intervals):
+    """Sweep the SNPs of one block over the intervals in it.
+
+    Args:
+        snps (iterable): The SNPs ordered by position.
+        intervals (list): The :class:`Interval` objects ordered by start.
+
+    Yields:
+        tuple: An :class:`Interval` and a SNP in it, in SNP order.
+    """
+    active = []
+    next_interval = 0
+
+    for snp in snps:
+        pos = snp[1]
+
+        # a 1-based position is in [start, end) when start < pos <= end
+        if any(interval.end < pos for interval in active):
+            active = [interval for interval in active if interval.end >= pos]
+
+        while next_interval < len(intervals) and \
+                intervals[next_interval].start < pos:
+            if intervals[next_interval].end >= pos:
+                active.append(intervals[next_interval])
+            next_interval += 1
+
+        for interval in active:
+            yield interval, snp
+
+
+def _fetch(tbx, chromosome, start, end):
+    """Iterate over the SNPs whose position lies in (`start`, `end`], with
+    0-based `start`, from an open tabix file.
+
+    Yields:
+        list: The chromosome, position, SNP identifier, reference allele and
+        alternate allele of each SNP.
+    """
+    for row in tbx.fetch(chromosome, start, end, parser=pysam.asTuple()):
+        pos = int(row[1])
+        if start < pos <= end:
+            yield [row[0], pos, row[2], row[3], row[4]]
+
+
+def annotate_bed(intervals, version, species, counts=False,
+                 gap=MERGE_GAP):
+    """Find the SNPs overlapping every interval.
+
+    The intervals are sorted and merged per chromosome and the SNPs of each
+    merged block are read once and swept over the intervals in it.  The
+    chromosome names of the intervals are resolved with the contig aliases
+    of the database, intervals on unknown chromosomes are skipped.
+
+    Args:
+        intervals (list): The :class:`Interval` objects.
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+        counts (bool, optional): ``True`` to only count the SNPs in each
+            interval.
+        gap (int, optional): Intervals less than `gap` apart are read with
+            one fetch.
+
+    Yields:
+        tuple: When `counts` is ``False`` an :class:`Interval` and a SNP in
+        it, ordered by chromosome and SNP position.  Otherwise an
+        :class:`Interval` and the number of SNPs in it, ordered by
+        chromosome and interval start.
+    """
+    LOG.debug('intervals={:,}'.format(len(intervals)))
+    LOG.debug('version={}'.format(version))
+    LOG.debug('species={}'.format(species))
+
+    contigs = fetch_utils.get_contigs(version, species)
+
+    by_chromosome = {}
+    skipped = 0
+    for interval in intervals:
+        contig = contigs.get(interval.chromosome.upper())
+        if contig:
+            by_chromosome.setdefault(contig[0], []).append(interval)
+        else:
+            skipped += 1
+
+    if skipped:
+        LOG.warning('Skipped {:,} intervals on unknown '
+                    'chromosomes'.format(skipped))
+
+    start_time = time.time()
+    num_bases = 0
+
+    tbx = pysam.TabixFile(fetch_utils.get_tabix_file(version, species))
+    tabix_contigs = set(tbx.contigs)
+
+    try:
+        for chromosome in sorted(by_chromosome):
+            chromosome_intervals = sorted(by_chromosome[chromosome],
+                                          key=lambda i: (i.start, i.end))
+
+            for start, end, block in merge_intervals(chromosome_intervals,
+                                                     gap):
+                num_bases += end - start
+
+                if chromosome not in tabix_contigs:
+                    found = iter(())
+                else:
+                    found = _sweep(_fetch(tbx, chromosome, start, end), block)
+
+                if counts:
+                    num_snps = {id(interval): 0 for interval in block}
+                    for interval, _ in found:
+                        num_snps[id(interval)] += 1
+                    for interval in block:
+                        yield interval, num_snps[id(interval)]
+                else:
+                    yield from found
+    finally:
+        tbx.close()
+
+    LOG.info('{:,} intervals, {:,} bases read in: {}'.format(
+        len(intervals) - skipped, num_bases,
+        utils.format_time(start_time, time.time())))
+
+
+class RowParser:
+    """Get the coordinates and alleles of the rows of a VCF or TSV file.
+
+    Attributes:
+        fmt (str): One of :data:`FORMATS`.
+        header (bool): ``True`` if a TSV file has a line of column names.
+    """
+    def __init__(self, fmt='vcf', chrom_col=1, pos_col=2, ref_col=None,
+                 alt_col=None, header=False):
+        """Initialization.  The columns are 1-based and only used for TSV
+        files, VCF files always use the VCF columns.
+
+        Args:
+            fmt (str, optional): One of :data:`FORMATS`.
+            chrom_col (int, optional): The chromosome column.
+            pos_col (int, optional): The position column.
+            ref_col (int, optional): The reference allele column.
+            alt_col (int, optional): The alternate allele column.
+            header (bool, optional): ``True`` if the first line of a TSV file,
+                after any lines starting with "#", holds the column names.
+        """
+        if fmt not in FORMATS:
+            raise ValueError('Invalid format: {}'.format(fmt))
+
+        self.fmt = fmt
+        self.header = header and fmt == 'tsv'
+
+        if fmt == 'vcf':
+            chrom_col, pos_col, ref_col, alt_col = 1, 2, 4, 5
+
+        self._chrom = chrom_col - 1
+        self._pos = pos_col - 1
+        self._ref = ref_col - 1 if ref_col else None
+        self._alt = alt_col - 1 if alt_col else None
+
+    def key(self, line):
+        """Get the chromosome and position of a row.
+
+        Args:
+            line (str): The row, without the line end.
+
+        Returns:
+            tuple: The chromosome and position.
+
+        Raises:
+            ValueError: If the row does not have a valid position.
+        """
+        fields = line.split('\t')
+        return fields[self._chrom], int(fields[self._pos])
+
+    def alleles(self, line):
+        """Get the reference and alternate alleles of a row.
+
+        Args:
+            line (str): The row, without the line end.
+
+        Returns:
+            tuple: The reference allele and the ``set`` of alternate alleles,
+            ``None`` if the alleles are not known.
+        """
+        if self._ref is None or self._alt is None:
+            return None
+
+        fields = line.split('\t')
+        return fields[self._ref].upper(), \
+            set(fields[self._alt].upper().split(','))
+
+    def annotate(self, line, snp_ids):
+        """Add the SNP identifiers to a row.  VCF rows get them in the ID
+        column, keeping the original identifier when none are found, TSV
+        rows get an extra column.
+
+        Args:
+            line (str): The row, without the line end.
+            snp_ids (list): The SNP identifiers found for the row.
+
+        Returns:
+            str: The annotated row.
+        """
+        if self.fmt == 'tsv':
+            return '{}\t{}'.format(line, ';'.join(snp_ids) or '.')
+
+        if not snp_ids:
+            return line
+
+        fields = line.split('\t')
+        fields[2] = ';'.join(snp_ids)
+        return '\t'.join(fields)
+
+
+def is_sorted(lines, parser):
+    """Check that the rows are coordinate sorted, every chromosome in one
+    block and ordered by position within it.
+
+    Args:
+        lines (iterable): The rows, header lines starting with "#" are
+            skipped.
+        parser (RowParser): Gets the coordinates of a row.
+
+    Returns:
+        bool: ``True`` if the rows are sorted.
+    """
+    seen = set()
+    previous = (None, 0)
+
+    for line in lines:
+        if line.startswith('#'):
+            continue
+
+        chrom, pos = parser.key(line.rstrip('\r\n'))
+
+        if chrom != previous[0]:
+            if chrom in seen:
+                return False
+            seen.add(chrom)
+        elif pos < previous[1]:
+            return False
+
+        previous = (chrom, pos)
+
+    return True
+
+
+def external_sort(lines, parser, buffer_size=SORT_BUFFER_SIZE,
+                  tmp_dir=None):
+    """Sort rows by chromosome and position holding at most `buffer_size`
+    rows in memory.  Sorted runs are written to temporary files and merged.
+
+    Args:
+        lines (iterable): The rows, without header lines.
+        parser (RowParser): Gets the coordinates of a row.
+        buffer_size (int, optional): The number of rows in each run.
+        tmp_dir (str, optional): Where to write the runs.
+
+    Yields:
+        str: The rows ordered by chromosome and position, rows with the same
+        coordinates stay in input order.
+    """
+    def sort_key(line):
+        return parser.key(line.rstrip('\n'))
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as directory:
+        runs = []
+        buffer = []
+
+        def write_run():
+            buffer.sort(key=sort_key)
+            run = os.path.join(directory, 'run.{}'.format(len(runs)))
+            with open(run, 'w') as f:
+                f.writelines(buffer)
+            runs.append(run)
+            del buffer[:]
+
+        for line in lines:
+            buffer.append(line if line.endswith('\n') else line + '\n')
+            if len(buffer) >= buffer_size:
+                write_run()
+
+        if not runs:
+            # everything fits in memory
+            buffer.sort(key=sort_key)
+            yield from buffer
+            return
+
+        if buffer:
+            write_run()
+
+        LOG.info('Merging {:,} sorted runs'.format(len(runs)))
+
+        files = [open(run) for run in runs]
+        try:
+            yield from heapq.merge(*files, key=sort_key)
+        finally:
+            for f in files:
+                f.close()
+
+
+def _tabix_snps(tbx, chromosome):
+    """Iterate over the SNPs of a chromosome in a tabix file.
+
+    Yields:
+        tuple: The position, SNP identifier, reference allele and alternate
+        allele ordered by position.
+    """
+    for row in tbx.fetch(chromosome, parser=pysam.asTuple()):
+        yield int(row[1]), row[2], row[3], row[4]
+
+
+def _db_snps(conn, chromosome):
+    """Iterate over the SNPs of a chromosome in an ensimpl snps database.
+
+    Yields:
+        tuple: The position, SNP identifier, reference allele and alternate
+        allele ordered by position.
+    """
+    cursor = conn.cursor()
+    try:
+        yield from cursor.execute('SELECT pos, snp_id, ref, alt '
+                                  '  FROM snps '
+                                  ' WHERE chrom = ? '
+                                  ' ORDER BY pos', (chromosome,))
+    finally:
+        cursor.close()
+
+
+def _matching_ids(parser, line, snps):
+    """Get the identifiers of the SNPs at the position of a row, only those
+    with the same alleles when the alleles of the row are known.
+    """
+    alleles = parser.alleles(line)
+
+    if alleles is None:
+        return [snp[1] for snp in snps]
+
+    ref, alts = alleles
+    return [snp[1] for snp in snps
+            if (snp[2] or '').upper() == ref and
+            alts & set((snp[3] or '').upper().split(','))]
+
+
+def annotate_rows(lines, parser, version, species, source='tabix'):
+    """Annotate coordinate sorted rows with the identifiers of the SNPs at
+    their positions.  Every chromosome of the rows is merge joined with the
+    SNPs of the same chromosome in one pass.
+
+    Args:
+        lines (iterable): The rows, coordinate sorted as checked by
+            :func:`is_sorted`.  Lines starting with "#" are passed through.
+        parser (RowParser): Reads and annotates the rows.
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+        source (str, optional): Read the SNPs from the ``tabix`` file or the
+            ``db``.
+
+    Yields:
+        tuple: Each annotated row, without the line end, and the number of
+        SNP identifiers added to it.
+    """
+    contigs = fetch_utils.get_contigs(version, species)
+
+    if source == 'db':
+        conn = fetch_utils.connect_to_database(version, species)
+        read_snps = lambda chrom: _db_snps(conn, chrom)
+        close = conn.close
+    else:
+        tbx = pysam.TabixFile(fetch_utils.get_tabix_file(version, species))
+        tabix_contigs = set(tbx.contigs)
+        read_snps = lambda chrom: _tabix_snps(tbx, chrom) \
+            if chrom in tabix_contigs else iter(())
+        close = tbx.close
+
+    def rows():
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if line.startswith('#'):
+                yield None, line
+            else:
+                yield parser.key(line), line
+
+    try:
+        for chrom, chrom_rows in groupby(rows(), lambda row: row[0] and
+                                         row[0][0]):
+            if chrom is None:
+                for _, line in chrom_rows:
+                    yield line, 0
+                continue
+
+            contig = contigs.get(chrom.upper())
+            if not contig:
+                for _, line in chrom_rows:
+                    yield parser.annotate(line, []), 0
+                continue
+
+            merged = utils.merge_join(
+                groupby(chrom_rows, lambda row: row[0][1]),
+                groupby(read_snps(contig[0]), lambda snp: snp[0]),
+                lambda group: group[0])
+
+            for row_group, snp_group in merged:
+                if row_group is None:
+                    continue
+
+                snps = list(snp_group[1]) if snp_group else []
+
+                for _, line in row_group[1]:
+                    snp_ids = _matching_ids(parser, line, snps) \
+                        if snps else []
+                    yield parser.annotate(line, snp_ids), len(snp_ids)
+    finally:
+        close()
+
+
+def _split_header(lines, parser):
+    """Split the header lines, starting with "#" and the TSV column names,
+    from the rows.
+
+    Args:
+        lines (iterable): The lines of the file.
+        parser (RowParser): Knows if there are column names.
+
+    Returns:
+        tuple: A ``list`` of the header lines and an iterator over the rows.
+    """
+    header = []
+    names = parser.header
+
+    for line in lines:
+        if line.startswith('#'):
+            header.append(line)
+        elif names:
+            header.append(line.rstrip('\r\n') + '\tsnp_id\n')
+            names = False
+        else:
+            return header, chain([line], lines)
+
+    return header, iter(())
+
+
+def annotate_file(input_file, output, version, species, parser,
+                  source='tabix', presorted=None,
+                  buffer_size=SORT_BUFFER_SIZE, tmp_dir=None):
+    """Annotate a VCF or TSV file with the identifiers of the SNPs at the
+    position of every row, using constant memory.
+
+    When the rows are coordinate sorted they are merge joined with the SNPs
+    as they are read, otherwise they are put in order with an external sort
+    first and written in that order.
+
+    Args:
+        input_file (str): The file to annotate, may be compressed, ``-`` for
+            stdin.
+        output (file): The open output.
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+        parser (RowParser): Reads and annotates the rows.
+        source (str, optional): Read the SNPs from the ``tabix`` file or the
+            ``db``.
+        presorted (bool, optional): ``True`` if the rows are known to be
+            sorted, ``False`` if not, ``None`` to check.  stdin is only
+            checked when ``True``.
+        buffer_size (int, optional): The number of rows sorted in memory.
+        tmp_dir (str, optional): Where to write the external sort runs.
+
+    Returns:
+        dict: The number of ``rows``, ``annotated`` rows and ``snp_ids``
+        added, whether the input was ``sorted`` and the ``rows_per_second``.
+    """
+    def open_input():
+        if input_file == '-':
+            return sys.stdin
+        return utils.open_resource(input_file, 'rt')
+
+    if presorted is None:
+        if input_file == '-':
+            presorted = False
+        else:
+            with open_input() as f:
+                presorted = is_sorted(_split_header(f, parser)[1], parser)
+
+    LOG.info('Input is {}sorted'.format('' if presorted else 'not '))
+
+    start_time = time.time()
+    stats = {'rows': 0, 'annotated': 0, 'snp_ids': 0, 'sorted': presorted}
+
+    f = open_input()
+
+    try:
+        header, rows = _split_header(f, parser)
+        output.writelines(header)
+
+        if not presorted:
+            rows = external_sort(rows, parser, buffer_size, tmp_dir)
+
+        for line, num_ids in annotate_rows(rows, parser, version, species,
+                                           source):
+            output.write(line)
+            output.write('\n')
+
+            stats['rows'] += 1
+            stats['snp_ids'] += num_ids
+            if num_ids:
+                stats['annotated'] += 1
+
+            if stats['rows'] % PROGRESS_ROWS == 0:
+                LOG.info('{:,} rows, {:,.0f} rows/s'.format(
+                    stats['rows'],
+                    stats['rows'] / max(time.time() - start_time, 1e-6)))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    stats['rows_per_second'] = \
+        stats['rows'] / max(time.time() - start_time, 1e-6)
+
+    LOG.info('{rows:,} rows, {annotated:,} annotated with {snp_ids:,} ids, '
+             '{rows_per_second:,.0f} rows/s'.format(**stats))
+
+    return stats
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""A compressed, chunked, column oriented SNP store.
+
+Each chromosome is split into chunks of :data:`CHUNK_SIZE` SNPs.  Within a
+chunk the positions are delta encoded, the "rs" identifiers are stored as
+integers and the (reference, alternate) allele pairs are dictionary encoded.
+Each column is written one after the other and the chunk is compressed with
+zlib.
+
+The chunks are kept in a SQLite file, which also holds the small chunk index
+used for range lookups and an identifier to chunk table used for identifier
+lookups.  Identifiers that are not "rs" followed by a number are kept in a
+separate table.
+
+Like a tabix lookup, a region holds every SNP overlapping it, so a deletion
+starting before the region but reaching into it is included.  The chunk
+index keeps the longest reference allele of each chunk to find them.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+
+import re
+import sqlite3
+import struct
+import sys
+import zlib
+
+import ensimpl_snps.utils as utils
+
+CHUNK_SIZE = 4096
+
+COMPRESSION_LEVEL = 6
+
+# number of decoded chunks kept in memory by each store
+CACHE_SIZE = 64
+
+REGEX_RS_ID = re.compile(r'^rs(\d+)$')
+
+HEADER = struct.Struct('<IIII')
+
+
+def _to_bytes(values):
+    """Get the little endian bytes of an ``array``."""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    """Create an ``array`` from little endian bytes."""
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def encode_chunk(snps):
+    """Encode and compress a chunk of SNPs on the same chromosome.
+
+    Args:
+        snps (list): The SNPs ordered by position, each element being a
+            ``list`` of chromosome, position, SNP identifier, reference
+            allele and alternate allele.
+
+    Returns:
+        bytes: The compressed chunk.
+    """
+    deltas = array('I')
+    rs_numbers = array('Q')
+    allele_codes = array('H')
+    alleles = OrderedDict()
+    other_ids = []
+
+    previous = 0
+    for idx, snp in enumerate(snps):
+        deltas.append(snp[1] - previous)
+        previous = snp[1]
+
+        match = REGEX_RS_ID.match(snp[2])
+        if match:
+            rs_numbers.append(int(match.group(1)))
+        else:
+            rs_numbers.append(0)
+            other_ids.append('{}\t{}'.format(idx, snp[2]))
+
+        pair = '{}\t{}'.format(snp[3] or '', snp[4] or '')
+        allele_codes.append(alleles.setdefault(pair, len(alleles)))
+
+    allele_bytes = '\n'.join(alleles).encode('utf-8')
+    other_bytes = '\n'.join(other_ids).encode('utf-8')
+
+    data = b''.join([
+        HEADER.pack(len(snps), len(alleles), len(allele_bytes),
+                    len(other_bytes)),
+        _to_bytes(deltas),
+        _to_bytes(rs_numbers),
+        _to_bytes(allele_codes),
+        allele_bytes,
+        other_bytes
+    ])
+
+    return zlib.compress(data, COMPRESSION_LEVEL)
+
+
+def decode_chunk(data):
+    """Decompress and decode a chunk.
+
+    Args:
+        data (bytes): The compressed chunk.
+
+    Returns:
+        tuple: The positions, SNP identifiers and allele pairs as ``lists``.
+        Each allele pair is a ``tuple`` of reference and alternate allele.
+    """
+    data = zlib.decompress(data)
+    num_snps, num_alleles, allele_len, other_len = HEADER.unpack_from(data)
+
+    offset = HEADER.size
+    deltas = _from_bytes('I', data[offset:offset + num_snps * 4])
+    offset += num_snps * 4
+    rs_numbers = _from_bytes('Q', data[offset:offset + num_snps * 8])
+    offset += num_snps * 8
+    allele_codes = _from_bytes('H', data[offset:offset + num_snps * 2])
+    offset += num_snps * 2
+
+    pairs = [tuple(pair.split('\t')) for pair in
+             data[offset:offset + allele_len].decode('utf-8').split('\n')]
+    offset += allele_len
+
+    ids = ['rs{}'.format(rs) for rs in rs_numbers]
+    if other_len:
+        for other in data[offset:offset + other_len].decode('utf-8').split('\n'):
+            idx, snp_id = other.split('\t')
+            ids[int(idx)] = snp_id
+
+    positions = list(accumulate(deltas))
+    alleles = [pairs[code] for code in allele_codes]
+
+    return positions, ids, alleles
+
+
+class ColumnarStore:
+    """Read SNPs from a columnar store.
+
+    Attributes:
+        file_name (str): The store file.
+    """
+    def __init__(self, file_name):
+        """Initialization.
+
+        Args:
+            file_name (str): The store file.
+        """
+        self.file_name = file_name
+        self._conn = sqlite3.connect(file_name)
+        self._cache = OrderedDict()
+
+    def close(self):
+        """Close the store."""
+        self._conn.close()
+        self._cache.clear()
+
+    def _chunk(self, chunk_id):
+        """Get a decoded chunk, from the cache if possible.
+
+        Args:
+            chunk_id (int): The chunk identifier.
+
+        Returns:
+            tuple: The chromosome and the decoded chunk.
+        """
+        chunk = self._cache.get(chunk_id)
+
+        if chunk:
+            self._cache.move_to_end(chunk_id)
+            return chunk
+
+        chrom, data = self._conn.execute(
+            'SELECT chrom, data FROM chunks WHERE chunk_id = ?',
+            (chunk_id,)).fetchone()
+
+        chunk = (chrom, decode_chunk(data))
+        self._cache[chunk_id] = chunk
+
+        if len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+        return chunk
+
+    def _region_chunks(self, chrom, start, end):
+        """Get the chunks holding SNPs that overlap [`start`, `end`].
+
+        Args:
+            chrom (str): The chromosome.
+            start (int): The start position.
+            end (int): The end position.
+
+        Returns:
+            list: A ``tuple`` of chunk identifier, start position, end
+            position, number of SNPs and longest reference allele for each
+            chunk, ordered by position.
+        """
+        sql_chunks = ('SELECT chunk_id, start_pos, end_pos, num_snps, '
+                      '       max_ref_len '
+                      '  FROM chunks '
+                      ' WHERE chrom = ? '
+                      '   AND start_pos <= ? '
+                      '   AND end_pos + max_ref_len - 1 >= ? '
+                      ' ORDER BY start_pos')
+
+        return self._conn.execute(sql_chunks, (chrom, end, start)).fetchall()
+
+    def by_region(self, chrom, start, end, limit=None, classes=None):
+        """Get the SNPs overlapping [`start`, `end`], those with a position
+        in it and those whose reference allele reaches into it.
+
+        Args:
+            chrom (str): The chromosome.
+            start (int): The start position.
+            end (int): The end position.
+            limit (int, optional): Maximum number of SNPs to return, ``None``
+                for all.
+            classes (set, optional): Only get the SNPs of these variant
+                classes, see :func:`ensimpl_snps.utils.classify_variant`.
+
+        Returns:
+            list: The SNPs ordered by position, each element being a ``list``
+            of chromosome, position, SNP identifier, reference allele and
+            alternate allele.
+        """
+        snps = []
+
+        if end < start:
+            return snps
+
+        # the class of each distinct allele pair, worked out once
+        keep = {}
+
+        for chunk_id, _, _, _, max_ref_len in self._region_chunks(chrom, start,
+                                                                  end):
+            chrom, (positions, ids, alleles) = self._chunk(chunk_id)
+            first = bisect_left(positions, start - max_ref_len + 1)
+            last = bisect_right(positions, end)
+            for idx in range(first, last):
+                if positions[idx] < start and \
+                        positions[idx] + len(alleles[idx][0]) - 1 < start:
+                    continue
+
+                if classes:
+                    pair = alleles[idx]
+                    if pair not in keep:
+                        keep[pair] = utils.classify_variant(*pair) in classes
+                    if not keep[pair]:
+                        continue
+
+                snps.append([chrom, positions[idx], ids[idx],
+                             alleles[idx][0], alleles[idx][1]])
+                if limit and len(snps) >= limit:
+                    return snps
+
+        return snps
+
+    def count_region(self, chrom, start, end):
+        """Count the SNPs overlapping [`start`, `end`], the same SNPs as
+        :meth:`by_region`.  Only the chunks at the ends of the region are
+        decoded, the others are counted from the chunk index.
+
+        Args:
+            chrom (str): The chromosome.
+            start (int): The start position.
+            end (int): The end position.
+
+        Returns:
+            int: The number of SNPs.
+        """
+        count = 0
+
+        if end < start:
+            return count
+
+        for chunk_id, start_pos, end_pos, num_snps, max_ref_len in \
+                self._region_chunks(chrom, start, end):
+            if start <= start_pos and end_pos <= end:
+                count += num_snps
+                continue
+
+            positions, _, alleles = self._chunk(chunk_id)[1]
+            first = bisect_left(positions, start - max_ref_len + 1)
+            last = bisect_right(positions, end)
+            count += sum(1 for idx in range(first, last)
+                         if positions[idx] >= start or
+                         positions[idx] + len(alleles[idx][0]) - 1 >= start)
+
+        return count
+
+    def by_ids(self, ids):
+        """Get the SNPs with the identifiers in `ids`.  Every chunk that
+        holds one of the identifiers is decoded once.
+
+        Args:
+            ids (list): A ``list`` of ids to look for.
+
+        Returns:
+            list: The SNPs ordered by chromosome and position, each element
+            being a ``list`` of chromosome, position, SNP identifier,
+            reference allele and alternate allele.
+        """
+        rs_numbers = set()
+        other_ids = set()
+
+        for snp_id in ids:
+            match = REGEX_RS_ID.match(snp_id)
+            if match:
+                rs_numbers.add(int(match.group(1)))
+            else:
+                other_ids.add(snp_id)
+
+        cursor = self._conn.cursor()
+        temp_table = 'lookup_ids_{}'.format(utils.create_random_string())
+
+        cursor.execute(('CREATE TEMPORARY TABLE {} ( '
+                        'rs INTEGER, '
+                        'PRIMARY KEY (rs) '
+                        ');').format(temp_table))
+        cursor.executemany('INSERT INTO {} VALUES (?)'.format(temp_table),
+                           [(_,) for _ in rs_numbers])
+
+        sql_chunks = ('SELECT chunk_id '
+                      '  FROM rs_ids '
+                      ' WHERE rs IN (SELECT rs FROM {}) '
+                      ' UNION '
+                      'SELECT chunk_id '
+                      '  FROM other_ids '
+                      ' WHERE snp_id IN ({})').format(
+            temp_table, ', '.join('?' * len(other_ids)))
+
+        chunk_ids = sorted(row[0] for row in
+                           cursor.execute(sql_chunks, list(other_ids)))
+
+        cursor.execute('DROP TABLE {}'.format(temp_table))
+        cursor.close()
+
+        wanted = set(ids)
+        snps = []
+
+        for chunk_id in chunk_ids:
+            chrom, (positions, snp_ids, alleles) = self._chunk(chunk_id)
+            for idx, snp_id in enumerate(snp_ids):
+                if snp_id in wanted:
+                    snps.append([chrom, positions[idx], snp_id,
+                                 alleles[idx][0], alleles[idx][1]])
+
+        snps.sort(key=lambda snp: (snp[0], snp[1]))
+
+        return snps
@@ -0,0 +1,236 @@
+# -*- coding: utf_8 -*-
+"""Use the SNP databases from Python without the web application.
+
+:class:`EmbeddedClient` is configured with a data directory, the same one
+the web application uses, keeps its database connection and tabix handle
+open between calls and returns NumPy structured arrays or pandas
+``DataFrames``.  The SNPs are read as text, in bulk, and parsed into columns
+by NumPy, so no Python object is made for every row.
+
+Example:
+    >>> with EmbeddedClient('/data/ensimpl_snps', species='Mm') as client:
+    ...     snps = client.lookup_ids(['rs3683945', 'rs13476251'])
+    ...     frame = client.fetch_regions(['1:10M-11M'], as_frame=True)
+
+pandas is only needed for ``DataFrames`` and is imported when one is asked
+for.  A client is not meant to be shared between threads.
+"""
+from collections import OrderedDict
+
+import io
+import sqlite3
+
+import numpy as np
+import pysam
+
+import ensimpl_snps.db_config as db_config
+import ensimpl_snps.fetch.utils as fetch_utils
+import ensimpl_snps.utils as utils
+
+LOG = utils.get_logger()
+
+SNP_FIELDS = ['chrom', 'pos', 'snp_id', 'ref', 'alt']
+
+# number of ids looked up with one query
+LOOKUP_BATCH_SIZE = 100000
+
+
+class EmbeddedClient:
+    """Look up SNPs of one release of one species.
+
+    Attributes:
+        directory (str): The data directory.
+        version (int): The Ensembl version.
+        species (str): The Ensembl species identifier.
+        contigs (dict): The contig aliases, see
+            :func:`ensimpl_snps.fetch.utils.load_contigs`.
+    """
+    def __init__(self, directory, version=None, species='Mm'):
+        """Initialization.
+
+        Args:
+            directory (str): The data directory, holding a directory of files
+                for each version.
+            version (int, optional): The Ensembl version, ``None`` for the
+                most recent one of `species`.
+            species (str, optional): The Ensembl species identifier.
+
+        Raises:
+            ValueError: If there is no database for `version` and `species`.
+        """
+        releases = [release for release in
+                    db_config.find_ensimpl_snps_dbs(directory).values()
+                    if release['species'] == species and 'db' in release]
+
+        if version is not None:
+            releases = [release for release in releases
+                        if int(release['version']) == int(version)]
+
+        if not releases:
+            raise ValueError('Unable to find version "{}" and species "{}" '
+                             'in {}'.format(version, species, directory))
+
+        release = max(releases, key=lambda r: int(r['version']))
+
+        self.directory = directory
+        self.version = int(release['version'])
+        self.species = species
+        self.contigs = fetch_utils.load_contigs(release['db'])
+
+        self._conn = sqlite3.connect(release['db'])
+        self._conn.execute('CREATE TEMPORARY TABLE lookup_ids ( '
+                           'query_id TEXT, '
+                           'PRIMARY KEY (query_id))')
+        self._tbx = pysam.TabixFile(release['vcf']) \
+            if release.get('vcf') else None
+
+    def close(self):
+        """Close the database connection and tabix handle."""
+        self._conn.close()
+        if self._tbx:
+            self._tbx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def lookup_ids(self, ids, as_frame=False,
+                   batch_size=LOOKUP_BATCH_SIZE):
+        """Get the SNPs with the identifiers in `ids`.
+
+        Args:
+            ids (list): The SNP identifiers.
+            as_frame (bool, optional): ``True`` for a pandas ``DataFrame``.
+            batch_size (int, optional): The number of ids in each query.
+
+        Returns:
+            The SNPs found, ordered by chromosome and position within each
+            batch, as a structured array with the fields in
+            :data:`SNP_FIELDS` or as a ``DataFrame``.
+        """
+        sql_snps = ("SELECT group_concat(chrom || char(9) || pos || char(9) "
+                    "       || snp_id || char(9) || ifnull(ref, '') "
+                    "       || char(9) || ifnull(alt, ''), char(10)) "
+                    "  FROM (SELECT s.* "
+                    "          FROM snps s, lookup_ids l "
+                    "         WHERE s.snp_id = l.query_id "
+                    "         ORDER BY s.chrom, s.pos)")
+
+        ids = list(OrderedDict.fromkeys(ids))
+        texts = []
+        cursor = self._conn.cursor()
+
+        try:
+            for i in range(0, len(ids), batch_size):
+                cursor.execute('DELETE FROM lookup_ids')
+                cursor.executemany('INSERT OR IGNORE INTO lookup_ids '
+                                   'VALUES (?)',
+                                   [(_,) for _ in ids[i:i + batch_size]])
+                text = cursor.execute(sql_snps).fetchone()[0]
+                if text:
+                    texts.append(text)
+        finally:
+            cursor.close()
+
+        return _to_result('\n'.join(texts), as_frame)
+
+    def fetch_regions(self, regions, as_frame=False, clamp=True):
+        """Get the SNPs in each region, the same SNPs as
+        :func:`ensimpl_snps.fetch.search.by_region`.
+
+        Args:
+            regions (list): The region strings, like "1:10M-11M" or
+                "chr2:15000000-15100000".  All are checked against the
+                contigs before any is read.
+            as_frame (bool, optional): ``True`` for a pandas ``DataFrame``.
+            clamp (bool, optional): ``True`` to clamp regions to the contig
+                lengths, ``False`` to reject them.
+
+        Returns:
+            The SNPs, region by region, as a structured array with the field
+            ``region``, the index of the region in `regions`, followed by the
+            fields in :data:`SNP_FIELDS`, or as a ``DataFrame``.
+
+        Raises:
+            ValueError: If a region is invalid or there is no tabix file.
+        """
+        if not self._tbx:
+            raise ValueError('No tabix file for version "{}" and species '
+                             '"{}"'.format(self.version, self.species))
+
+        locations = fetch_utils.str_to_regions(regions, self.contigs, clamp)
+        tabix_contigs = set(self._tbx.contigs)
+
+        texts = []
+        counts = []
+
+        for location in locations:
+            lines = []
+            if location.chromosome in tabix_contigs:
+                lines = list(self._tbx.fetch(location.chromosome,
+                                             location.start_position,
+                                             location.end_position))
+            counts.append(len(lines))
+            if lines:
+                texts.append('\n'.join(lines))
+
+        region_index = np.repeat(np.arange(len(locations), dtype=np.int32),
+                                 counts)
+
+        return _to_result('\n'.join(texts), as_frame, region_index)
+
+
+def _column(values, dtype=None):
+    """Convert a column of strings, sizing strings to the longest value."""
+    if dtype:
+        return values.astype(dtype)
+
+    width = int(np.char.str_len(values).max()) if len(values) else 1
+    return values.astype('U{}'.format(max(width, 1)))
+
+
+def _to_result(text, as_frame=False, region_index=None):
+    """Parse tab delimited SNPs, the first columns being those in
+    :data:`SNP_FIELDS`, into a structured array or ``DataFrame``.
+
+    Args:
+        text (str): The SNPs, one per line.
+        as_frame (bool, optional): ``True`` for a pandas ``DataFrame``.
+        region_index (numpy.ndarray, optional): The region of each SNP.
+
+    Returns:
+        The SNPs as a structured array or ``DataFrame``.
+    """
+    if text:
+        values = np.loadtxt(io.StringIO(text), dtype=str, delimiter='\t',
+                            comments=None, quotechar=None, ndmin=2,
+                            usecols=range(len(SNP_FIELDS)))
+    else:
+        values = np.empty((0, len(SNP_FIELDS)), dtype='U1')
+
+    columns = [('chrom', _column(values[:, 0])),
+               ('pos', _column(values[:, 1], np.uint32)),
+               ('snp_id', _column(values[:, 2])),
+               ('ref', _column(values[:, 3])),
+               ('alt', _column(values[:, 4]))]
+
+    if region_index is not None:
+        columns.insert(0, ('region', region_index))
+
+    if as_frame:
+        try:
+            import pandas
+        except ImportError:
+            raise ValueError('pandas is needed for DataFrames, install it '
+                             'with "pip install pandas"')
+
+        return pandas.DataFrame(dict(columns), columns=[c[0] for c in columns])
+
+    snps = np.empty(len(values), dtype=[(name, column.dtype)
+                                        for name, column in columns])
+    for name, column in columns:
+        snps[name] = column
+
+    return snps
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Read the strain genotypes of a release, see
+:mod:`ensimpl_snps.create.genotype_db`.
+
+Every chromosome has a SNP by strain matrix of genotypes, two bits each.
+The matrix is stored one strain after the other, so a strain is a run of
+bytes with the genotypes of four consecutive SNPs in each byte, the first
+SNP in the lowest bits.  Alongside it are the position and the rowid in the
+``snps`` table of every SNP, in the same order.
+
+The files are NumPy arrays opened as memory maps, so a region of a subset
+of strains only reads the bytes of those strains covering the region.
+"""
+import os
+import sqlite3
+
+import numpy as np
+
+GENOTYPES_DB_NAME = 'genotypes.db3'
+
+# the 2 bit genotype codes
+HOM_REF = 0
+HET = 1
+HOM_ALT = 2
+NO_CALL = 3
+
+# number of genotypes in a byte
+GENOTYPES_PER_BYTE = 4
+
+# the genotypes returned for the codes, the number of alternate alleles
+GENOTYPE_VALUES = [0, 1, 2, None]
+
+SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+
+SQL_SELECT_STRAINS = 'SELECT name FROM strains ORDER BY strain_id'
+
+SQL_SELECT_MATRICES = ('SELECT chrom, num_snps, positions_file, rowids_file, '
+                       '       genotypes_file '
+                       '  FROM matrices')
+
+
+def pack_genotypes(codes):
+    """Pack the genotype codes of a chromosome, four to a byte.
+
+    Args:
+        codes (numpy.ndarray): The codes of every SNP (rows) and strain
+            (columns).
+
+    Returns:
+        numpy.ndarray: The packed matrix, a row of bytes for each strain.
+    """
+    num_snps, num_strains = codes.shape
+    row_bytes = -(-num_snps // GENOTYPES_PER_BYTE)
+
+    padded = np.full((num_strains, row_bytes * GENOTYPES_PER_BYTE), NO_CALL,
+                     dtype=np.uint8)
+    padded[:, :num_snps] = codes.T
+    padded = padded.reshape(num_strains, row_bytes, GENOTYPES_PER_BYTE)
+
+    return np.bitwise_or.reduce(padded << SHIFTS, axis=2).astype(np.uint8)
+
+
+def unpack_genotypes(packed, first, last, rows=None):
+    """Unpack the genotype codes of SNPs [`first`, `last`) of some strains.
+    Only the bytes holding them are read.
+
+    Args:
+        packed (numpy.ndarray): The packed matrix, see
+            :func:`pack_genotypes`.
+        first (int): The index of the first SNP.
+        last (int): The index after the last SNP.
+        rows (list, optional): The rows of the strains, ``None`` for all.
+
+    Returns:
+        numpy.ndarray: The codes of every strain (rows) and SNP (columns).
+    """
+    first_byte = first // GENOTYPES_PER_BYTE
+    last_byte = -(-last // GENOTYPES_PER_BYTE)
+
+    if rows is None:
+        block = np.array(packed[:, first_byte:last_byte])
+    else:
+        block = packed[rows, first_byte:last_byte]
+
+    codes = (block[:, :, None] >> SHIFTS) & 3
+    codes = codes.reshape(block.shape[0], -1)
+
+    offset = first_byte * GENOTYPES_PER_BYTE
+    return codes[:, first - offset:last - offset]
+
+
+class GenotypeStore:
+    """Get the genotypes of the strains of a release.
+
+    Attributes:
+        directory (str): The genotypes directory.
+        strains (list): The strain names, in the order of the matrices.
+        matrices (dict): Chromosome to a (number of SNPs, positions file,
+            rowids file, genotypes file) ``tuple``.
+    """
+    def __init__(self, directory):
+        """Initialization.
+
+        Args:
+            directory (str): The genotypes directory.
+        """
+        self.directory = directory
+
+        conn = sqlite3.connect(os.path.join(directory, GENOTYPES_DB_NAME))
+        try:
+            self.strains = [row[0] for row in
+                            conn.execute(SQL_SELECT_STRAINS)]
+            self.matrices = {
+                row[0]: (row[1],) + tuple(os.path.join(directory, file_name)
+                                          for file_name in row[2:])
+                for row in conn.execute(SQL_SELECT_MATRICES)
+            }
+        finally:
+            conn.close()
+
+    def strain_indices(self, strains=None):
+        """Get the rows of strains in the matrices.
+
+        Args:
+            strains (list, optional): The strain names, ``None`` for all.
+
+        Returns:
+            list: The row of each strain.
+
+        Raises:
+            ValueError: When a strain is not in the store.
+        """
+        if not strains:
+            return list(range(len(self.strains)))
+
+        indices = {name: idx for idx, name in enumerate(self.strains)}
+
+        for strain in strains:
+            if strain not in indices:
+                raise ValueError('Unknown strain: {}, the strains are: '
+                                 '{}'.format(strain, ', '.join(self.strains)))
+
+        return [indices[strain] for strain in strains]
+
+    def by_region(self, chrom, start, end, strains=None, limit=None):
+        """Get the genotypes of the SNPs with a position in [`start`,
+        `end`].
+
+        Args:
+            chrom (str): The chromosome.
+            start (int): The start position.
+            end (int): The end position.
+            strains (list, optional): The strain names, ``None`` for all.
+            limit (int, optional): Maximum number of SNPs to return, ``None``
+                for all.
+
+        Returns:
+            tuple: The rowids of the SNPs in the ``snps`` table, ordered by
+            position, and a ``numpy.ndarray`` of the genotype codes of every
+            SNP (rows) and strain (columns).
+        """
+        indices = self.strain_indices(strains)
+
+        if chrom not in self.matrices:
+            return [], np.empty((0, len(indices)), dtype=np.uint8)
+
+        _, positions_file, rowids_file, genotypes_file = \
+            self.matrices[chrom]
+
+        positions = np.load(positions_file, mmap_mode='r')
+        first = int(np.searchsorted(positions, start, side='left'))
+        last = int(np.searchsorted(positions, end, side='right'))
+
+        if limit:
+            last = min(last, first + limit)
+
+        if first >= last:
+            return [], np.empty((0, len(indices)), dtype=np.uint8)
+
+        rowids = np.load(rowids_file, mmap_mode='r')[first:last].tolist()
+
+        genotypes = np.load(genotypes_file, mmap_mode='r')
+        codes = unpack_genotypes(genotypes, first, last, indices)
+
+        return rowids, codes.T
@@ -1,6 +1,9 @@
 # -*- coding: utf_8 -*-
 import sqlite3
 
+from natsort import natsorted
+
+import ensimpl_snps.db_config as db_config
 import ensimpl_snps.utils as utils
 import ensimpl_snps.fetch.utils as fetch_utils
 
@@ -43,3 +46,112 @@ def meta(version, species_id):
     cursor.close()
 
     return meta_info
+
+
+def contigs(version, species_id):
+    """Get the precomputed statistics of every chromosome.
+
+    Args:
+        version (int): Ensembl version.
+        species_id (str): Ensembl species identifier.
+
+    Returns:
+        list: A ``list`` of ``dicts`` in chromosome order with the following
+        keys:
+            * chrom
+            * num_snps
+            * min_pos
+            * max_pos
+            * num_snv
+            * num_mnv
+            * num_insertion
+            * num_deletion
+            * num_multi_allelic
+            * num_other
+
+    Raises:
+        ValueError: If the database has no statistics.
+    """
+    sql_contigs = '''
+        SELECT *
+          FROM contig_stats
+    '''
+
+    conn = fetch_utils.connect_to_database(version, species_id)
+    cursor = conn.cursor()
+
+    try:
+        rows = utils.dictify_cursor(cursor.execute(sql_contigs))
+    except sqlite3.OperationalError:
+        raise ValueError('No statistics for version "{}" and species '
+                         '"{}"'.format(version, species_id))
+    finally:
+        cursor.close()
+        conn.close()
+
+    return natsorted(rows, key=lambda row: row['chrom'])
+
+
+def info(version=None):
+    """Get the database information and precomputed statistics for every
+    species of an Ensembl version.
+
+    Args:
+        version (int, optional): Ensembl version, ``None`` for the latest.
+
+    Returns:
+        dict: A ``dict`` with the keys ``version`` and ``species``.
+        ``species`` is a ``dict`` keyed by species identifier with the
+        following keys:
+            * assembly
+            * assembly_patch
+            * num_snps
+            * db_size
+            * vcf_size
+            * stats, see :func:`contigs`
+
+    Raises:
+        ValueError: If `version` cannot be found.
+    """
+    sql_meta = '''
+        SELECT meta_key, meta_value
+          FROM meta_info
+         WHERE species_id = :species_id
+    '''
+
+    all_dbs = [db for db in db_config.ENSIMPL_SNPS_DBS if 'db' in db]
+
+    if version is None:
+        if not all_dbs:
+            raise ValueError('No databases found')
+        version = max(int(db['version']) for db in all_dbs)
+
+    statistics = {'version': int(version), 'species': {}}
+
+    for db in all_dbs:
+        if int(db['version']) != int(version):
+            continue
+
+        species_id = db['species']
+
+        conn = fetch_utils.connect_to_database(version, species_id)
+        cursor = conn.cursor()
+        meta_info = dict(cursor.execute(sql_meta, {'species_id': species_id}))
+        cursor.close()
+        conn.close()
+
+        stats = contigs(version, species_id)
+
+        statistics['species'][species_id] = {
+            'assembly': meta_info.get('assembly'),
+            'assembly_patch': meta_info.get('assembly_patch'),
+            'num_snps': sum(row['num_snps'] for row in stats),
+            'db_size': int(meta_info.get('db_size', 0)),
+            'vcf_size': int(meta_info.get('vcf_size', 0)),
+            'stats': stats
+        }
+
+    if not statistics['species']:
+        raise ValueError('Unable to find version "{}"'.format(version))
+
+    return statistics
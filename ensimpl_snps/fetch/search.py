@@ -1,95 +1,408 @@
 # -*- coding: utf_8 -*-
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+import queue
+import random
 import re
-import sqlite3
 import time
 
-import pysam
-
 import ensimpl_snps.utils as utils
+import ensimpl_snps.fetch.columnar as columnar
+import ensimpl_snps.fetch.shards as shards
+import ensimpl_snps.fetch.tabix_index as tabix_index
 import ensimpl_snps.fetch.utils as fetch_utils
 
 REGEX_SNP_ID = re.compile("rs[0-9]{1,}", re.IGNORECASE)
-REGEX_REGION = re.compile("(CHR|)*\s*([0-9]{1,2}|X|Y|MT)\s*(-|:)?\s*(\d+)\s*(MB|M|K|)?\s*(-|:|)?\s*(\d+|)\s*(MB|M|K|)?", re.IGNORECASE)
 
+# largest position a tabix index can address
+MAX_POSITION = 2 ** 29
 
-def by_ids(ids, version, species):
-    """Perform the search for ids.
+# initial half width and growth factor of the nearest SNP search window
+NEAREST_WINDOW = 1000
+NEAREST_GROWTH = 4
+
+# number of density bins to aim for when no resolution is asked for and the
+# most that will be returned
+DENSITY_BINS = 1000
+DENSITY_MAX_BINS = 100000
+
+# number of ids looked up to estimate how many of a larger list exist
+ESTIMATE_SAMPLE_SIZE = 1000
+
+# what the region and id searches return
+SEARCH_MODES = ['rows', 'count', 'estimate']
+
+# the values of every SNP, optional fields are added after them
+DEFAULT_FIELDS = ['chrom', 'pos', 'snp_id', 'ref', 'alt']
+
+# how the region search is sent, raw lines are only read from the VCF
+REGION_FORMATS = ['json', 'tsv']
+
+# number of SNPs read by rowid with one query
+ROWID_BATCH_SIZE = 500
+
+SQL_DENSITY_BIN_SIZES = (
+    'SELECT meta_value '
+    '  FROM meta_info '
+    " WHERE meta_key = 'density_bin_sizes' "
+    '   AND species_id = :species_id')
+
+# the change types stored in the SNP differences between releases
+DIFF_CHANGES = {
+    'added': 1,
+    'removed': 2,
+    'moved': 3,
+    'alleles': 4,
+    'renamed': 5
+}
+
+
+def _query_ids(cursor, ids, field_tables=None, classes=None):
+    """Get the SNPs with the identifiers in `ids` from an ensimpl snps
+    database.  The cursor can be reused for any number of calls.
 
     Args:
+        cursor (sqlite3.Cursor): The database cursor.
         ids (list): A ``list`` of ids to look for.
+        field_tables (list, optional): The tables of the optional fields to
+            add, see :func:`field_tables`.
+        classes (set, optional): Only get the SNPs of these variant
+            classes, the database must have them stored.
+
+    Returns:
+        list: The SNPs ordered by chromosome and position, each element being
+        a ``list`` of chromosome, position, SNP identifier, reference allele
+        and alternate allele, followed by the value of each field.
+    """
+    temp_table = 'lookup_ids_{}'.format(utils.create_random_string())
+
+    # create a temp table and insert into
+    SQL_TEMP = ('CREATE TEMPORARY TABLE {} ( '
+                'query_id TEXT, '
+                'PRIMARY KEY (query_id) '
+                ');').format(temp_table)
+
+    cursor.execute(SQL_TEMP)
+
+    SQL_TEMP = 'INSERT OR IGNORE INTO {} VALUES (?);'.format(temp_table)
+    query_ids = [(_,) for _ in ids]
+    cursor.executemany(SQL_TEMP, query_ids)
+
+    SQL_QUERY = ('SELECT s.chrom, s.pos, s.snp_id, s.ref, s.alt{} '
+                 '  FROM snps s {}'
+                 ' WHERE s.snp_id IN (SELECT distinct query_id FROM {}) {}'
+                 ' ORDER BY s.chrom, s.pos').format(
+        ''.join(', f{}.value'.format(idx)
+                for idx in range(len(field_tables or []))),
+        ''.join('LEFT JOIN {0} f{1} ON f{1}.snp_rowid = s.rowid '.format(
+            table, idx) for idx, table in enumerate(field_tables or [])),
+        temp_table,
+        '  AND s.variant_class IN ({}) '.format(','.join(
+            str(utils.VARIANT_CLASSES.index(c)) for c in sorted(classes)))
+        if classes else '')
+
+    snps = [list(row) for row in cursor.execute(SQL_QUERY)]
+
+    cursor.execute('DROP TABLE {}'.format(temp_table))
+
+    return snps
+
+
+def field_tables(fields, version, species):
+    """Get the tables of the optional fields of a release.
+
+    Args:
+        fields (list): The field names.
         version (int): The Ensembl version.
         species (str): The Ensembl species identifier.
 
     Returns:
-        dict: A ``dict`` withe keys return ``snps`` and ``snps_not_found``.
+        list: The table of each field.
 
     Raises:
-        ValueError: When `ids` is empty.
+        ValueError: When a field is not stored for the release.
     """
-    LOG = utils.get_logger()
-    LOG.debug('ids={} ...'.format(ids[0:max(len(ids), 10)]))
-    LOG.debug('version={}'.format(version))
-    LOG.debug('species={}'.format(species))
+    stored = fetch_utils.get_fields(version, species)
 
-    try:
-        conn = fetch_utils.connect_to_database(version, species)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+    for field in fields:
+        if field not in stored:
+            raise ValueError('Unknown field: {}, the fields are: {}'.format(
+                field, ', '.join(sorted(stored)) or 'none'))
 
-        if not ids:
-            raise ValueError('no ids were passed in')
+    return [stored[field] for field in fields]
 
-        temp_table = 'lookup_ids_{}'.format(utils.create_random_string())
 
-        # create a temp table and insert into
-        SQL_TEMP = ('CREATE TEMPORARY TABLE {} ( '
-                    'query_id TEXT, '
-                    'PRIMARY KEY (query_id) '
-                    ');').format(temp_table)
+def check_variant_classes(classes, version=None, species=None):
+    """Check the variant classes to filter on.
+
+    Args:
+        classes (list): The variant classes, see
+            :data:`ensimpl_snps.utils.VARIANT_CLASSES`.
+        version (int, optional): The Ensembl version, to also check that the
+            variant classes of the release are stored, as the id searches
+            need.
+        species (str, optional): The Ensembl species identifier.
+
+    Returns:
+        set: The variant classes.
 
-        cursor.execute(SQL_TEMP)
+    Raises:
+        ValueError: When a class is invalid or the release does not have them
+            stored.
+    """
+    for variant_class in classes:
+        if variant_class not in utils.VARIANT_CLASSES:
+            raise ValueError('Invalid variant class: {}, the classes are: '
+                             '{}'.format(variant_class,
+                                         ', '.join(utils.VARIANT_CLASSES)))
 
-        SQL_TEMP = 'INSERT INTO {} VALUES (?);'.format(temp_table)
-        query_ids = [(_,) for _ in ids]
-        cursor.executemany(SQL_TEMP, query_ids)
+    if classes and version and not fetch_utils.is_classified(version,
+                                                             species):
+        raise ValueError('The variant classes of version {} are not stored, '
+                         'the database needs to be created again'.format(
+                             version))
 
-        SQL_QUERY = ('SELECT s.* '
-                     '  FROM snps s '
-                     ' WHERE s.snp_id IN (SELECT distinct query_id FROM {}) '
-                     ' ORDER BY s.chrom, s.pos').format(temp_table)
+    return set(classes)
 
-        LOG.info('Query: {}'.format(SQL_QUERY))
 
-        start_time = time.time()
+def _open_ids_search(version, species):
+    """Open the shards if there are some, otherwise the columnar store if
+    there is one, otherwise the database, for looking up SNP identifiers.
 
-        snps = []
-        snp_ids = []
-        for row in cursor.execute(SQL_QUERY):
-            snps.append([
-                row['chrom'],
-                row['pos'],
-                row['snp_id'],
-                row['ref'],
-                row['alt']
-            ])
-            snp_ids.append(row['snp_id'])
-
-        LOG.info('Done: {}'.format(utils.format_time(start_time, time.time())))
+    Args:
+        version (int): The Ensembl version.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        tuple: A function taking a ``list`` of ids and returning the SNPs as
+        :func:`_query_ids` does, and a function closing what was opened.
+    """
+    shards_dir = fetch_utils.get_shards_dir(version, species)
+
+    if shards_dir:
+        store = shards.ShardedStore(shards_dir)
+        return store.by_ids, store.close
+
+    columnar_file = fetch_utils.get_columnar_file(version, species)
+
+    if columnar_file:
+        store = columnar.ColumnarStore(columnar_file)
+        return store.by_ids, store.close
 
+    conn = fetch_utils.connect_to_database(version, species)
+    cursor = conn.cursor()
+
+    def close():
         cursor.close()
         conn.close()
 
-        snps_found = set(snp_ids)
+    return lambda ids: _query_ids(cursor, ids), close
+
+
+def _search_ids(ids, version, species, fields=None, classes=None):
+    """Open the shards, columnar store or database, look up `ids` and close
+    it.  Only the database has the optional `fields` and variant
+    `classes`."""
+    if fields or classes:
+        tables = field_tables(fields or [], version, species)
+        classes = check_variant_classes(classes or [], version, species)
+        conn = fetch_utils.connect_to_database(version, species)
+
+        try:
+            return _query_ids(conn.cursor(), ids, tables, classes)
+        finally:
+            conn.close()
+
+    search_ids, close = _open_ids_search(version, species)
+
+    try:
+        return search_ids(ids)
+    finally:
+        close()
+
+
+def by_ids(ids, version, species, fields=None, classes=None):
+    """Perform the search for ids.
+
+    Args:
+        ids (list): A ``list`` of ids to look for.
+        version (int): The Ensembl version.
+        species (str): The Ensembl species identifier.
+        fields (list, optional): Optional fields to add to each SNP, see
+            :func:`ensimpl_snps.fetch.utils.get_fields`.
+        classes (list, optional): Only get the SNPs of these variant
+            classes, see :data:`ensimpl_snps.utils.VARIANT_CLASSES`.  The
+            ids of the SNPs left out are in ``snps_not_found``.
+
+    Returns:
+        dict: A ``dict`` withe keys return ``snps`` and ``snps_not_found``.
+
+    Raises:
+        ValueError: When `ids` is empty.
+    """
+    LOG = utils.get_logger()
+
+    try:
+        if not ids:
+            raise ValueError('no ids were passed in')
+
+        start_time = time.time()
+
+        # identical lookups running at the same time share one query
+        key = ('ids', int(version), species, fetch_utils.ids_key(ids),
+               tuple(fields or []), tuple(sorted(classes or [])))
+        snps = fetch_utils.SINGLE_FLIGHT.do(key, _search_ids, ids, version,
+                                            species, fields, classes)
+
+        utils.log_event(LOG, logging.INFO, 'by_ids done', ids=len(ids),
+                        version=version, species=species,
+                        seconds='{:.4f}'.format(time.time() - start_time))
+
+        snps_found = set(snp[2] for snp in snps)
         snps_not_found = [x for x in ids if x not in snps_found]
 
+        # the snps may be shared with other callers
         return {'snps': snps, 'snps_not_found': snps_not_found}
 
     except Exception as e:
         LOG.error('Error: {}'.format(e))
-        return None
+        raise
+
+
+def lookup_ids(id_chunks, version, species, workers=1):
+    """Look up chunks of ids, streaming the results.  Each worker thread
+    opens the database or columnar store once, reuses it for every chunk it
+    is given and closes it when there are no more chunks.  Only a few chunks
+    are in flight at a time, so memory use depends on the chunk size and not
+    on the number of ids.
+
+    Args:
+        id_chunks (iterable): ``lists`` of ids to look for.
+        version (int): The Ensembl version.
+        species (str): The Ensembl species identifier.
+        workers (int, optional): The number of worker threads.
+
+    Yields:
+        dict: A ``dict`` with the keys ``snps`` and ``snps_not_found`` for
+        each chunk, in the order of `id_chunks`.
+    """
+    workers = max(1, workers)
+    tasks = queue.Queue()
+    pending = deque()
+
+    def search_chunks():
+        opened = None
+
+        try:
+            for future, ids in iter(tasks.get, None):
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    if opened is None:
+                        opened = _open_ids_search(version, species)
+
+                    snps = opened[0](ids)
+                    snps_found = set(snp[2] for snp in snps)
+
+                    future.set_result({
+                        'snps': snps,
+                        'snps_not_found': [x for x in ids
+                                           if x not in snps_found]})
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            # a connection can only be closed by the thread that opened it
+            if opened:
+                opened[1]()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(workers):
+            executor.submit(search_chunks)
+
+        try:
+            for ids in id_chunks:
+                future = Future()
+                tasks.put((future, ids))
+                pending.append(future)
+
+                if len(pending) > 2 * workers:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+            for _ in range(workers):
+                tasks.put(None)
+
+
+def _region_snps(region, version, species, limit=None, fields=None,
+                 classes=None):
+    """Get the SNPs in a parsed region from the columnar store if there is
+    one, otherwise the tabix file.  Optional `fields` are read from the
+    tabix file.  SNPs not of the variant `classes` are skipped while
+    reading.
+
+    Args:
+        region (:class:`ensimpl_snps.fetch.utils.Region`): The region.
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+        limit (int, optional): Maximum number of SNPs to return, ``None`` for
+            all.
+        fields (list, optional): Optional fields to add to each SNP.
+        classes (set, optional): Only get the SNPs of these variant classes.
+
+    Returns:
+        list: The SNPs in `region`, see :func:`by_region`.
+    """
+    columnar_file = fetch_utils.get_columnar_file(version, species)
+
+    if columnar_file and not fields:
+        # the same positions as the tabix fetch below, which treats the
+        # start as 0-based
+        store = columnar.ColumnarStore(columnar_file)
+        try:
+            return store.by_region(region.chromosome,
+                                   region.start_position + 1,
+                                   region.end_position, limit, classes)
+        finally:
+            store.close()
+
+    import pysam
+
+    tbx = _open_tabix(version, species)
+
+    try:
+        snps = []
+        for row in tbx.fetch('{}'.format(region.chromosome),
+                             region.start_position,
+                             region.end_position,
+                             parser=pysam.asTuple()):
+            if classes and \
+                    utils.classify_variant(row[3], row[4]) not in classes:
+                continue
+
+            # the position is an int, like from the columnar store
+            snp = [row[0], int(row[1]), row[2], row[3], row[4]]
+            if fields:
+                snp.extend(utils.vcf_field(row, field) for field in fields)
+            snps.append(snp)
+            if limit and len(snps) >= limit:
+                break
+
+        return snps
+    finally:
+        tbx.close()
 
 
-def by_region(region, version, species, limit=None):
+def by_region(region, version, species, limit=None, fields=None,
+              classes=None):
     """Perform the search by region.
 
     Args:
@@ -98,6 +411,10 @@ def by_region(region, version, species, limit=None):
         species (str): The Ensembl species identifier.
         limit (int, optional): Maximum number of SNPs to return, ``None`` for
             all.
+        fields (list, optional): Optional fields to add to each SNP, see
+            :func:`ensimpl_snps.fetch.utils.get_fields`.
+        classes (list, optional): Only get the SNPs of these variant
+            classes, see :data:`ensimpl_snps.utils.VARIANT_CLASSES`.
 
     Returns:
         list: All the SNPs in `region`.  Each element is another ``list`` with
@@ -107,44 +424,1117 @@ def by_region(region, version, species, limit=None):
             * SNP identifier
             * reference allele
             * alternate allele
+            * the value of each field, ``None`` when it has none
 
     Raises:
-        ValueError: When `region` is empty.
+        ValueError: When `region` is empty or invalid, like outside of its
+            chromosome.
     """
     LOG = utils.get_logger()
 
-    LOG.debug(sqlite3.version_info)
-    LOG.debug(sqlite3.version)
+    try:
 
-    LOG.debug('range={}'.format(region))
+        if not region:
+            raise ValueError('no region was passed in')
+
+        new_region = fetch_utils.str_to_regions(
+            [region], fetch_utils.get_contigs(version, species))[0]
+
+        if fields:
+            field_tables(fields, version, species)
+
+        classes = check_variant_classes(classes or [])
+
+        start_time = time.time()
+
+        # identical regions fetched at the same time share one scan
+        key = ('region', int(version), species, new_region.chromosome,
+               new_region.start_position, new_region.end_position, limit,
+               tuple(fields or []), tuple(sorted(classes)))
+        snps = fetch_utils.SINGLE_FLIGHT.do(key, _region_snps, new_region,
+                                            version, species, limit, fields,
+                                            classes)
+
+        utils.log_event(LOG, logging.INFO, 'by_region done', region=region,
+                        version=version, species=species, limit=limit,
+                        seconds='{:.4f}'.format(time.time() - start_time))
+
+        return snps
+    except Exception as e:
+        LOG.error('Error: {}'.format(e))
+        raise
+
+
+def region_lines(region, version, species, limit=None, columns=5,
+                 classes=None):
+    """Perform the search by region, getting the raw VCF lines.  The lines
+    are read straight from the compressed blocks and cut to `columns`
+    without being parsed, for sending them on as they are.
+
+    The region is checked before returning, the file is only read as the
+    result is iterated.
+
+    Args:
+        region (str): The region to look for SNPs.
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+        limit (int, optional): Maximum number of SNPs to return, ``None`` for
+            all.
+        columns (int, optional): The number of leading VCF columns to keep,
+            ``None`` for the whole line.  The default keeps the values of
+            :func:`by_region`.
+        classes (list, optional): Only get the SNPs of these variant
+            classes, see :data:`ensimpl_snps.utils.VARIANT_CLASSES`.
+
+    Returns:
+        generator: ``bytes`` of one or more lines at a time, each line
+        ending with a newline.
+
+    Raises:
+        ValueError: When `region` is empty or invalid.
+    """
+    if not region:
+        raise ValueError('no region was passed in')
+
+    new_region = fetch_utils.str_to_regions(
+        [region], fetch_utils.get_contigs(version, species))[0]
+
+    classes = check_variant_classes(classes or [])
+
+    vcf_file = fetch_utils.get_tabix_file(version, species)
+
+    # read the index now so a missing index is reported here
+    tabix_index.load_index(vcf_file)
+
+    def generate():
+        num_lines = 0
+
+        for lines in tabix_index.fetch_lines(vcf_file, new_region.chromosome,
+                                             new_region.start_position,
+                                             new_region.end_position,
+                                             columns, classes):
+            count = lines.count(b'\n')
+
+            if limit and num_lines + count >= limit:
+                cut = -1
+                for _ in range(limit - num_lines):
+                    cut = lines.find(b'\n', cut + 1)
+                yield lines[:cut + 1]
+                return
+
+            num_lines += count
+            yield lines
+
+    return generate()
+
+
+def genotypes_by_region(region, version, species, strains=None, limit=None):
+    """Get the genotypes of strains for the SNPs in a region, see
+    :mod:`ensimpl_snps.fetch.genotypes`.  Only the genotypes of `strains`
+    are read.
+
+    Args:
+        region (str): The region to look for SNPs.
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+        strains (list, optional): The strain names, ``None`` for all.
+        limit (int, optional): Maximum number of SNPs to return, ``None`` for
+            all.
+
+    Returns:
+        dict: A ``dict`` with the keys ``strains`` and ``snps``.  Each element
+        in ``snps`` is a ``list`` of chromosome, position, SNP identifier,
+        reference allele and alternate allele, followed by the genotype of
+        each strain: the number of alternate alleles called or ``None`` when
+        there is no call.
+
+    Raises:
+        ValueError: When the release has no genotypes or `region` or a
+            strain is invalid.
+    """
+    # numpy is only loaded by the workers serving genotypes
+    import ensimpl_snps.fetch.genotypes as genotypes
+
+    LOG = utils.get_logger()
+
+    LOG.debug('region={}'.format(region))
     LOG.debug('version={}'.format(version))
     LOG.debug('species_id={}'.format(species))
-    LOG.debug('limit={}'.format(limit))
+    LOG.debug('strains={}'.format(strains))
+
+    genotypes_dir = fetch_utils.get_genotypes_dir(version, species)
 
+    if not genotypes_dir:
+        raise ValueError('No genotypes for version "{}" and species '
+                         '"{}"'.format(version, species))
+
+    new_region = fetch_utils.str_to_regions(
+        [region], fetch_utils.get_contigs(version, species))[0]
+
+    start_time = time.time()
+
+    # the same positions as the region search
+    store = genotypes.GenotypeStore(genotypes_dir)
+    strains = strains or store.strains
+    rowids, codes = store.by_region(new_region.chromosome,
+                                    new_region.start_position + 1,
+                                    new_region.end_position, strains, limit)
+
+    snps = {}
+    conn = fetch_utils.connect_to_database(version, species)
+    cursor = conn.cursor()
 
     try:
+        for idx in range(0, len(rowids), ROWID_BATCH_SIZE):
+            batch = rowids[idx:idx + ROWID_BATCH_SIZE]
+            SQL_QUERY = ('SELECT rowid, chrom, pos, snp_id, ref, alt '
+                         '  FROM snps '
+                         ' WHERE rowid IN ({})').format(
+                ', '.join('?' * len(batch)))
 
-        if not region:
-            raise ValueError('no ids were passed in')
+            for row in cursor.execute(SQL_QUERY, batch):
+                snps[row[0]] = list(row[1:])
+    finally:
+        cursor.close()
+        conn.close()
 
-        new_region = fetch_utils.str_to_region(region)
+    values = genotypes.GENOTYPE_VALUES
+    snps = [snps[rowid] + [values[code] for code in row]
+            for rowid, row in zip(rowids, codes.tolist())]
 
-        tabix_file = fetch_utils.get_tabix_file(version, species)
-        tbx = pysam.TabixFile(tabix_file)
+    LOG.info('Done: {}'.format(utils.format_time(start_time, time.time())))
 
+    return {'strains': strains, 'snps': snps}
 
-        start_time = time.time()
 
-        snps = []
-        for row in tbx.fetch('{}'.format(new_region.chromosome),
-                             new_region.start_position,
-                             new_region.end_position,
-                             parser=pysam.asTuple()):
-            snps.append(list(row[:5]))
+def estimate_region_blocks(region, version, species):
+    """Estimate the cost of :func:`by_region` from the tabix index, without
+    reading any SNPs.
+
+    Args:
+        region (str): The region to look for SNPs.
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        int: The estimated number of compressed blocks to read.
+
+    Raises:
+        ValueError: When `region` is invalid.
+    """
+    new_region = fetch_utils.str_to_regions(
+        [region], fetch_utils.get_contigs(version, species))[0]
+
+    index = tabix_index.load_index(
+        fetch_utils.get_tabix_file(version, species))
+
+    return index.blocks(new_region.chromosome, new_region.start_position,
+                        new_region.end_position)
+
 
-        LOG.info('Done: {}'.format(utils.format_time(start_time, time.time())))
+def _fetch_snps(tbx, chromosome, start, end):
+    """Get the SNPs whose position lies in [`start`, `end`] (1-based and
+    inclusive) from an open tabix file.
 
+    Tabix returns every record that overlaps the interval, so records that
+    start before `start` (deletions) are dropped to make sure neighbouring
+    windows never return the same SNP twice.
+
+    Args:
+        tbx (pysam.TabixFile): The open tabix file.
+        chromosome (str): The chromosome.
+        start (int): The start position.
+        end (int): The end position.
+
+    Returns:
+        list: The SNPs, each element being a ``list`` of chromosome, position,
+        SNP identifier, reference allele and alternate allele.
+    """
+    import pysam
+
+    snps = []
+
+    if end < start:
         return snps
-    except Exception as e:
-        LOG.error('Error: {}'.format(e))
-        return None
+
+    for row in tbx.fetch(chromosome, start - 1, end, parser=pysam.asTuple()):
+        pos = int(row[1])
+        if start <= pos <= end:
+            snps.append([row[0], pos, row[2], row[3], row[4]])
+
+    return snps
+
+
+def _nearest(tbx, location, k):
+    """Find the `k` SNPs closest to `location` by growing a window outward
+    around the position.  Each pass only reads the two new flanks, and the
+    search stops as soon as `k` SNPs are known to be within the radius that
+    has been completely read.
+
+    Args:
+        tbx (pysam.TabixFile): The open tabix file.
+        location (Region): The position to search around.
+        k (int): The number of SNPs to find.
+
+    Returns:
+        list: The `k` closest SNPs ordered by distance and position.
+    """
+    chromosome = location.chromosome
+    position = location.start_position
+
+    # [low, high] is the range that has already been read
+    low = position + 1
+    high = position
+    window = NEAREST_WINDOW
+    found = []
+
+    while True:
+        new_low = max(1, position - window)
+        new_high = min(MAX_POSITION, position + window)
+
+        found.extend(_fetch_snps(tbx, chromosome, new_low, low - 1))
+        found.extend(_fetch_snps(tbx, chromosome, high + 1, new_high))
+        low, high = new_low, new_high
+
+        left_done = low == 1
+        right_done = high == MAX_POSITION
+
+        if left_done and right_done:
+            break
+
+        # every SNP within `radius` of `position` has been read
+        radius = min(MAX_POSITION if left_done else position - low,
+                     MAX_POSITION if right_done else high - position)
+
+        if sum(1 for snp in found if abs(snp[1] - position) <= radius) >= k:
+            break
+
+        window *= NEAREST_GROWTH
+
+    found.sort(key=lambda snp: (abs(snp[1] - position), snp[1]))
+
+    return found[:k]
+
+
+def _flank(tbx, location, step):
+    """Find the closest SNP strictly before (`step` < 0) or strictly after
+    (`step` > 0) `location`, growing the window in one direction only.
+
+    Args:
+        tbx (pysam.TabixFile): The open tabix file.
+        location (Region): The position to search from.
+        step (int): The direction to search in.
+
+    Returns:
+        list: The closest SNP or ``None`` if there is not one.
+    """
+    chromosome = location.chromosome
+    position = location.start_position
+    edge = position
+    window = NEAREST_WINDOW
+
+    while True:
+        if step < 0:
+            if edge <= 1:
+                return None
+            start, end = max(1, position - window), edge - 1
+            snps = _fetch_snps(tbx, chromosome, start, end)
+            if snps:
+                return snps[-1]
+            edge = start
+        else:
+            if edge >= MAX_POSITION:
+                return None
+            start, end = edge + 1, min(MAX_POSITION, position + window)
+            snps = _fetch_snps(tbx, chromosome, start, end)
+            if snps:
+                return snps[0]
+            edge = end
+
+        window *= NEAREST_GROWTH
+
+
+def _open_tabix(version, species):
+    """Open the tabix file for `version` and `species`.
+
+    Args:
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        pysam.TabixFile: The open tabix file.
+    """
+    # pysam is only loaded by the first search that reads a tabix file
+    import pysam
+
+    tabix_file = fetch_utils.get_tabix_file(version, species)
+    return pysam.TabixFile(tabix_file)
+
+
+def _parse_positions(positions, version, species):
+    """Parse and validate all `positions` before any searching is done.
+
+    Args:
+        positions (list): A ``list`` of position strings.
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        list: A ``list`` of :class:`Region` objects.
+
+    Raises:
+        ValueError: When `positions` is empty or a position is invalid.
+    """
+    if not positions:
+        raise ValueError('no positions were passed in')
+
+    contigs = fetch_utils.get_contigs(version, species)
+    locations = []
+
+    for position in positions:
+        location = fetch_utils.str_to_position(position)
+        contig = contigs.get(location.chromosome.upper())
+        if not contig:
+            raise ValueError('Unknown chromosome: {}'.format(position))
+        location.chromosome, length = contig
+        if location.start_position < 1 or \
+                (length and location.start_position > length):
+            raise ValueError('Position outside of chromosome: '
+                             '{}'.format(position))
+        locations.append(location)
+
+    return locations
+
+
+def nearest(positions, version, species, k=1):
+    """Find the `k` closest SNPs to each position in `positions`.
+
+    Args:
+        positions (list): A ``list`` of positions like "1:10000000".
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+        k (int, optional): The number of SNPs to find for each position.
+
+    Returns:
+        list: One ``dict`` per position, in the same order as `positions`,
+        with the keys ``position`` and ``snps``.  ``snps`` holds the SNPs
+        ordered by distance, each element being a ``list`` of chromosome,
+        position, SNP identifier, reference allele and alternate allele.
+
+    Raises:
+        ValueError: When `positions` is empty or invalid or `k` is less
+            than 1.
+    """
+    LOG = utils.get_logger()
+
+    LOG.debug('positions={}'.format(len(positions) if positions else 0))
+    LOG.debug('version={}'.format(version))
+    LOG.debug('species_id={}'.format(species))
+    LOG.debug('k={}'.format(k))
+
+    k = int(k)
+
+    if k < 1:
+        raise ValueError('k must be at least 1')
+
+    start_time = time.time()
+
+    tbx = _open_tabix(version, species)
+
+    try:
+        locations = _parse_positions(positions, version, species)
+
+        results = []
+        for position, location in zip(positions, locations):
+            results.append({'position': position,
+                            'snps': _nearest(tbx, location, k)})
+    finally:
+        tbx.close()
+
+    LOG.info('Done: {}'.format(utils.format_time(start_time, time.time())))
+
+    return results
+
+
+def flanking(positions, version, species):
+    """Find the closest SNP on each side of each position in `positions`.
+
+    Args:
+        positions (list): A ``list`` of positions like "1:10000000".
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        list: One ``dict`` per position, in the same order as `positions`,
+        with the keys ``position``, ``left`` and ``right``.  ``left`` and
+        ``right`` are the closest SNP before and after the position or
+        ``None``.
+
+    Raises:
+        ValueError: When `positions` is empty or invalid.
+    """
+    LOG = utils.get_logger()
+
+    LOG.debug('positions={}'.format(len(positions) if positions else 0))
+    LOG.debug('version={}'.format(version))
+    LOG.debug('species_id={}'.format(species))
+
+    start_time = time.time()
+
+    tbx = _open_tabix(version, species)
+
+    try:
+        locations = _parse_positions(positions, version, species)
+
+        results = []
+        for position, location in zip(positions, locations):
+            results.append({'position': position,
+                            'left': _flank(tbx, location, -1),
+                            'right': _flank(tbx, location, 1)})
+    finally:
+        tbx.close()
+
+    LOG.info('Done: {}'.format(utils.format_time(start_time, time.time())))
+
+    return results
+
+
+def _density_bin_sizes(cursor, species):
+    """Get the precomputed SNP density bin sizes.
+
+    Args:
+        cursor (sqlite3.Cursor): The database cursor.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        list: The bin sizes from smallest to largest, empty if the database
+        has no SNP density.
+    """
+    row = cursor.execute(SQL_DENSITY_BIN_SIZES,
+                         {'species_id': species}).fetchone()
+
+    return [int(size) for size in row[0].split(',')] if row else []
+
+
+def density(region, version, species, bin_size=None):
+    """Get the number of SNPs in `region` from the precomputed SNP density.
+    The work done depends on the number of bins returned, not on the number
+    of SNPs in `region`.
+
+    Requested bin sizes that are not precomputed are summed from the largest
+    precomputed bin size that divides them.
+
+    Args:
+        region (str): The region to count SNPs in.
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+        bin_size (int, optional): The bin size, ``None`` to pick one that
+            gives about :data:`DENSITY_BINS` bins over `region`.
+
+    Returns:
+        dict: A ``dict`` with the keys ``bin_size`` and ``bins``.  ``bins``
+        holds every bin overlapping `region`, each element being a ``list``
+        of chromosome, bin start, bin end and number of SNPs in the whole bin.
+
+    Raises:
+        ValueError: When `region` is empty or invalid, `bin_size` cannot be
+            built from the precomputed bins, too many bins would be returned
+            or the database has no SNP density.
+    """
+    LOG = utils.get_logger()
+
+    LOG.debug('range={}'.format(region))
+    LOG.debug('version={}'.format(version))
+    LOG.debug('species_id={}'.format(species))
+    LOG.debug('bin_size={}'.format(bin_size))
+
+    if not region:
+        raise ValueError('no region was passed in')
+
+    new_region = fetch_utils.str_to_regions(
+        [region], fetch_utils.get_contigs(version, species))[0]
+    # the same positions as by_region, which treats the start as 0-based
+    start = max(1, new_region.start_position + 1)
+    end = new_region.end_position
+
+    if end < start:
+        raise ValueError('Invalid region: {}'.format(region))
+
+    sql_density = (
+        'SELECT bin, num_snps '
+        '  FROM snp_density '
+        ' WHERE chrom = :chrom '
+        '   AND bin_size = :bin_size '
+        '   AND bin BETWEEN :first AND :last')
+
+    start_time = time.time()
+
+    conn = fetch_utils.connect_to_database(version, species)
+    cursor = conn.cursor()
+
+    try:
+        stored_sizes = _density_bin_sizes(cursor, species)
+
+        if not stored_sizes:
+            raise ValueError('No SNP density for version "{}" and species '
+                             '"{}"'.format(version, species))
+
+        if bin_size:
+            bin_size = int(bin_size)
+            divisors = [s for s in stored_sizes if bin_size % s == 0]
+
+            if not divisors:
+                raise ValueError('Bin size must be a multiple of '
+                                 '{}'.format(stored_sizes[0]))
+
+            stored_size = divisors[-1]
+        else:
+            span = end - start + 1
+            bin_size = stored_sizes[-1]
+            for size in stored_sizes:
+                if span <= size * DENSITY_BINS:
+                    bin_size = size
+                    break
+            stored_size = bin_size
+
+        factor = bin_size // stored_size
+        first = (start - 1) // bin_size
+        last = (end - 1) // bin_size
+        num_bins = last - first + 1
+
+        if num_bins > DENSITY_MAX_BINS:
+            raise ValueError('Too many bins requested: {:,} > {:,}'.format(
+                num_bins, DENSITY_MAX_BINS))
+
+        counts = [0] * num_bins
+        params = {'chrom': new_region.chromosome,
+                  'bin_size': stored_size,
+                  'first': first * factor,
+                  'last': (last + 1) * factor - 1}
+
+        for stored_bin, num_snps in cursor.execute(sql_density, params):
+            counts[stored_bin // factor - first] += num_snps
+    finally:
+        cursor.close()
+        conn.close()
+
+    bins = []
+    for idx, num_snps in enumerate(counts):
+        bin_start = (first + idx) * bin_size + 1
+        bins.append([new_region.chromosome, bin_start,
+                     bin_start + bin_size - 1, num_snps])
+
+    LOG.info('Done: {}'.format(utils.format_time(start_time, time.time())))
+
+    return {'bin_size': bin_size, 'bins': bins}
+
+
+def _count_snps(tbx, chromosome, start, end):
+    """Count the SNPs whose position lies in [`start`, `end`] (1-based and
+    inclusive) in an open tabix file, like :func:`_fetch_snps` but without
+    parsing the rows.
+
+    Args:
+        tbx (pysam.TabixFile): The open tabix file.
+        chromosome (str): The chromosome.
+        start (int): The start position.
+        end (int): The end position.
+
+    Returns:
+        int: The number of SNPs.
+    """
+    if end < start or chromosome not in tbx.contigs:
+        return 0
+
+    return sum(1 for line in tbx.fetch(chromosome, start - 1, end)
+               if start <= int(line.split('\t', 2)[1]) <= end)
+
+
+def _count_overlapping(tbx, chromosome, start, end):
+    """Count the SNPs whose position lies before `start` but whose reference
+    allele reaches into [`start`, `end`] (deletions), in an open tabix file.
+
+    Args:
+        tbx (pysam.TabixFile): The open tabix file.
+        chromosome (str): The chromosome.
+        start (int): The start position.
+        end (int): The end position.
+
+    Returns:
+        int: The number of SNPs.
+    """
+    if end < start or chromosome not in tbx.contigs:
+        return 0
+
+    return sum(1 for line in tbx.fetch(chromosome, start - 1, start)
+               if int(line.split('\t', 2)[1]) < start)
+
+
+def count_regions(regions, version, species):
+    """Count the SNPs in each region exactly, without reading them.  The
+    SNPs overlapping a region are counted, the same SNPs as returned by
+    :func:`by_region`.
+
+    With a columnar store only the chunks at the ends of a region are
+    decoded.  Otherwise the whole precomputed density bins in a region are
+    summed and only the ends of the region are read from the tabix file,
+    along with the deletions reaching into the region from before it.
+
+    Args:
+        regions (list): The regions, like "1:10000000-10500000".
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        list: A ``dict`` for each region with the keys ``region`` and
+        ``num_snps``.
+
+    Raises:
+        ValueError: When a region is invalid.
+    """
+    LOG = utils.get_logger()
+    LOG.debug('regions={}'.format(regions[:10]))
+
+    if not regions:
+        raise ValueError('no region was passed in')
+
+    locations = fetch_utils.str_to_regions(
+        regions, fetch_utils.get_contigs(version, species))
+
+    start_time = time.time()
+    counts = []
+
+    columnar_file = fetch_utils.get_columnar_file(version, species)
+
+    if columnar_file:
+        store = columnar.ColumnarStore(columnar_file)
+        try:
+            for location in locations:
+                # the same positions as by_region
+                counts.append(store.count_region(location.chromosome,
+                                                 location.start_position + 1,
+                                                 location.end_position))
+        finally:
+            store.close()
+    else:
+        sql_density = ('SELECT ifnull(sum(num_snps), 0) '
+                       '  FROM snp_density '
+                       ' WHERE chrom = ? '
+                       '   AND bin_size = ? '
+                       '   AND bin BETWEEN ? AND ?')
+
+        conn = fetch_utils.connect_to_database(version, species)
+        tbx = _open_tabix(version, species)
+
+        try:
+            sizes = _density_bin_sizes(conn.cursor(), species)
+            bin_size = sizes[0] if sizes else None
+
+            for location in locations:
+                chrom = location.chromosome
+                start = location.start_position + 1
+                end = location.end_position
+
+                overlapping = _count_overlapping(tbx, chrom, start, end)
+
+                # the bins wholly inside [start, end], bin b holding the
+                # positions b * bin_size + 1 to (b + 1) * bin_size
+                first = (start + bin_size - 2) // bin_size if bin_size else 0
+                last = end // bin_size - 1 if bin_size else -1
+
+                if first > last:
+                    counts.append(overlapping +
+                                  _count_snps(tbx, chrom, start, end))
+                    continue
+
+                num_snps = overlapping
+                num_snps += conn.execute(sql_density, (chrom, bin_size,
+                                                       first,
+                                                       last)).fetchone()[0]
+                num_snps += _count_snps(tbx, chrom, start, first * bin_size)
+                num_snps += _count_snps(tbx, chrom, (last + 1) * bin_size + 1,
+                                        end)
+                counts.append(num_snps)
+        finally:
+            tbx.close()
+            conn.close()
+
+    LOG.info('Done: {}'.format(utils.format_time(start_time, time.time())))
+
+    return [{'region': str(location), 'num_snps': num_snps}
+            for location, num_snps in zip(locations, counts)]
+
+
+def estimate_regions(regions, version, species):
+    """Estimate the number of SNPs in each region without reading any.
+
+    The estimate comes from the precomputed density, the bins at the ends of
+    a region counted by how much of them it covers, or from the tabix index
+    if the database has no density.
+
+    Args:
+        regions (list): The regions, like "1:10000000-10500000".
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        list: A ``dict`` for each region with the keys ``region`` and
+        ``num_snps``.
+
+    Raises:
+        ValueError: When a region is invalid.
+    """
+    if not regions:
+        raise ValueError('no region was passed in')
+
+    locations = fetch_utils.str_to_regions(
+        regions, fetch_utils.get_contigs(version, species))
+
+    sql_density = ('SELECT bin, num_snps '
+                   '  FROM snp_density '
+                   ' WHERE chrom = ? '
+                   '   AND bin_size = ? '
+                   '   AND bin BETWEEN ? AND ?')
+
+    estimates = []
+    conn = fetch_utils.connect_to_database(version, species)
+
+    try:
+        sizes = _density_bin_sizes(conn.cursor(), species)
+        index = None if sizes else tabix_index.load_index(
+            fetch_utils.get_tabix_file(version, species))
+
+        for location in locations:
+            start = location.start_position + 1
+            end = location.end_position
+
+            if end < start:
+                estimates.append(0)
+                continue
+
+            if index:
+                num_snps = index.estimate_records(location.chromosome,
+                                                  start - 1, end)
+                estimates.append(int(round(num_snps or 0)))
+                continue
+
+            # the smallest bins giving no more than DENSITY_BINS bins
+            bin_size = sizes[-1]
+            for size in sizes:
+                if end - start + 1 <= size * DENSITY_BINS:
+                    bin_size = size
+                    break
+
+            num_snps = 0.0
+            for bin_number, bin_snps in conn.execute(
+                    sql_density, (location.chromosome, bin_size,
+                                  (start - 1) // bin_size,
+                                  (end - 1) // bin_size)):
+                bin_start = bin_number * bin_size + 1
+                bin_end = bin_start + bin_size - 1
+                overlap = min(end, bin_end) - max(start, bin_start) + 1
+                num_snps += bin_snps * overlap / bin_size
+
+            estimates.append(int(round(num_snps)))
+    finally:
+        conn.close()
+
+    return [{'region': str(location), 'num_snps': num_snps}
+            for location, num_snps in zip(locations, estimates)]
+
+
+def _count_ids(cursor, ids):
+    """Count the SNPs with the identifiers in `ids`.
+
+    Args:
+        cursor (sqlite3.Cursor): The database cursor.
+        ids (list): A ``list`` of ids to look for.
+
+    Returns:
+        tuple: The number of SNPs and the number of distinct ids found.
+    """
+    temp_table = 'count_ids_{}'.format(utils.create_random_string())
+
+    cursor.execute(('CREATE TEMPORARY TABLE {} ( '
+                    'query_id TEXT, '
+                    'PRIMARY KEY (query_id) '
+                    ');').format(temp_table))
+    cursor.executemany('INSERT OR IGNORE INTO {} VALUES (?);'.format(
+        temp_table), [(_,) for _ in ids])
+
+    row = cursor.execute(('SELECT count(*), count(DISTINCT s.snp_id) '
+                          '  FROM snps s '
+                          ' WHERE s.snp_id IN (SELECT query_id FROM {})'
+                          ).format(temp_table)).fetchone()
+
+    cursor.execute('DROP TABLE {}'.format(temp_table))
+
+    return row[0], row[1]
+
+
+def count_ids(ids, version, species):
+    """Count the SNPs with the identifiers in `ids` exactly, without reading
+    them.
+
+    Args:
+        ids (list): A ``list`` of ids to look for.
+        version (int): The Ensembl version.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        dict: A ``dict`` with the keys ``num_snps``, the number of SNPs,
+        ``num_found`` and ``num_unknown``, the numbers of distinct ids found
+        and not found.
+
+    Raises:
+        ValueError: When `ids` is empty.
+    """
+    if not ids:
+        raise ValueError('no ids were passed in')
+
+    distinct_ids = set(ids)
+    conn = fetch_utils.connect_to_database(version, species)
+    cursor = conn.cursor()
+
+    try:
+        num_snps, num_found = _count_ids(cursor, distinct_ids)
+    finally:
+        cursor.close()
+        conn.close()
+
+    return {'num_snps': num_snps,
+            'num_found': num_found,
+            'num_unknown': len(distinct_ids) - num_found}
+
+
+def estimate_ids(ids, version, species, sample_size=ESTIMATE_SAMPLE_SIZE):
+    """Estimate the number of SNPs with the identifiers in `ids` from a
+    random sample of them.  Lists no longer than the sample are counted
+    exactly.
+
+    Args:
+        ids (list): A ``list`` of ids to look for.
+        version (int): The Ensembl version.
+        species (str): The Ensembl species identifier.
+        sample_size (int, optional): The number of ids looked up.
+
+    Returns:
+        dict: The same ``dict`` as :func:`count_ids`, with estimates.
+
+    Raises:
+        ValueError: When `ids` is empty.
+    """
+    distinct_ids = list(set(ids))
+
+    if len(distinct_ids) <= sample_size:
+        return count_ids(distinct_ids, version, species)
+
+    conn = fetch_utils.connect_to_database(version, species)
+    cursor = conn.cursor()
+
+    try:
+        num_snps, num_found = _count_ids(
+            cursor, random.sample(distinct_ids, sample_size))
+    finally:
+        cursor.close()
+        conn.close()
+
+    scale = len(distinct_ids) / sample_size
+    num_found = int(round(num_found * scale))
+
+    return {'num_snps': int(round(num_snps * scale)),
+            'num_found': num_found,
+            'num_unknown': len(distinct_ids) - num_found}
+
+
+def history(ids, species):
+    """Find the Ensembl releases each id is in and where it was located,
+    using the cross release presence index.
+
+    Args:
+        ids (list): A ``list`` of ids to look for.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        dict: A ``dict`` with the keys ``snps`` and ``snps_not_found``.
+        ``snps`` has one ``dict`` per id found with the following keys:
+            * id
+            * versions, the releases the id is in
+            * moved, the releases where the position changed
+            * positions, a ``list`` of [version, chromosome, position] for
+              every release where the position changed
+
+    Raises:
+        ValueError: When `ids` is empty or there is no presence index.
+    """
+    LOG = utils.get_logger()
+
+    LOG.debug('ids={}'.format(len(ids) if ids else 0))
+    LOG.debug('species={}'.format(species))
+
+    if not ids:
+        raise ValueError('no ids were passed in')
+
+    conn = fetch_utils.connect_to_presence_database()
+    cursor = conn.cursor()
+
+    try:
+        temp_table = 'lookup_ids_{}'.format(utils.create_random_string())
+
+        cursor.execute(('CREATE TEMPORARY TABLE {} ( '
+                        'query_id TEXT, '
+                        'PRIMARY KEY (query_id) '
+                        ');').format(temp_table))
+
+        cursor.executemany('INSERT OR IGNORE INTO {} VALUES (?);'.format(
+            temp_table), [(_,) for _ in ids])
+
+        versions = dict(cursor.execute(
+            'SELECT bit, version FROM releases WHERE species_id = ?',
+            (species,)))
+
+        def to_versions(bitmap):
+            return [versions[bit] for bit in sorted(versions)
+                    if bitmap & (1 << bit)]
+
+        SQL_PRESENCE = ('SELECT p.snp_id, p.releases, p.moved '
+                        '  FROM presence p '
+                        ' WHERE p.species_id = ? '
+                        '   AND p.snp_id IN (SELECT query_id FROM {}) '
+                        ' ORDER BY p.snp_id').format(temp_table)
+
+        SQL_POSITIONS = ('SELECT p.snp_id, p.bit, p.chrom, p.pos '
+                         '  FROM positions p '
+                         ' WHERE p.species_id = ? '
+                         '   AND p.snp_id IN (SELECT query_id FROM {}) '
+                         ' ORDER BY p.snp_id, p.bit').format(temp_table)
+
+        start_time = time.time()
+
+        found = {}
+        for snp_id, releases, moved in cursor.execute(SQL_PRESENCE,
+                                                      (species,)):
+            found[snp_id] = {'id': snp_id,
+                             'versions': to_versions(releases),
+                             'moved': to_versions(moved),
+                             'positions': []}
+
+        for snp_id, bit, chrom, pos in cursor.execute(SQL_POSITIONS,
+                                                      (species,)):
+            found[snp_id]['positions'].append([versions[bit], chrom, pos])
+
+        LOG.info('Done: {}'.format(utils.format_time(start_time,
+                                                     time.time())))
+    finally:
+        cursor.close()
+        conn.close()
+
+    snps = [found[x] for x in ids if x in found]
+    snps_not_found = [x for x in ids if x not in found]
+
+    return {'snps': snps, 'snps_not_found': snps_not_found}
+
+
+def diff(from_version, to_version, species, region=None, changes=None,
+         cursor=0, limit=10000):
+    """Get a page of the precomputed SNP differences between two releases.
+
+    Args:
+        from_version (int): The older Ensembl version number.
+        to_version (int): The newer Ensembl version number.
+        species (str): The Ensembl species identifier.
+        region (str, optional): Only get differences in this region, for
+            removed SNPs the old position is used.
+        changes (list, optional): Only get these changes, any of the keys of
+            :data:`DIFF_CHANGES`.
+        cursor (int, optional): The ``next`` value of the previous page, 0
+            for the first page.
+        limit (int, optional): The maximum number of differences.
+
+    Returns:
+        dict: A ``dict`` with the keys ``snps`` and ``next``.  ``next`` is
+        the cursor of the next page or ``None`` if this is the last page.
+        Each element in ``snps`` is a ``list`` of change, chromosome,
+        position, SNP identifier, reference allele, alternate allele, old
+        chromosome, old position, old SNP identifier, old reference allele
+        and old alternate allele.
+
+    Raises:
+        ValueError: When `region` or `changes` are invalid.
+    """
+    LOG = utils.get_logger()
+
+    LOG.debug('from_version={}'.format(from_version))
+    LOG.debug('to_version={}'.format(to_version))
+    LOG.debug('species_id={}'.format(species))
+    LOG.debug('region={}'.format(region))
+    LOG.debug('changes={}'.format(changes))
+    LOG.debug('cursor={}'.format(cursor))
+
+    cursor = int(cursor or 0)
+    limit = int(limit)
+    change_names = {v: k for k, v in DIFF_CHANGES.items()}
+
+    where = ['d.diff_id > :cursor']
+    params = {'cursor': cursor, 'limit': limit + 1}
+
+    if changes:
+        unknown = set(changes) - set(DIFF_CHANGES)
+        if unknown:
+            raise ValueError('Unknown changes: {}'.format(
+                ', '.join(sorted(unknown))))
+        where.append('d.change IN ({})'.format(
+            ', '.join(str(DIFF_CHANGES[c]) for c in sorted(set(changes)))))
+
+    start_time = time.time()
+
+    conn = fetch_utils.connect_to_diff_database(from_version, to_version,
+                                                species)
+    db_cursor = conn.cursor()
+
+    try:
+        if region:
+            new_region = fetch_utils.str_to_regions(
+                [region], fetch_utils.get_contigs(to_version, species))[0]
+            params['chrom'] = new_region.chromosome
+            params['start'] = new_region.start_position
+            params['end'] = new_region.end_position
+
+            # diff_id follows position, so later pages can skip straight to
+            # the position of the last difference returned
+            if cursor:
+                row = db_cursor.execute(
+                    'SELECT chrom, pos FROM snp_diff WHERE diff_id = ?',
+                    (cursor,)).fetchone()
+                if row and row[0] == new_region.chromosome:
+                    params['start'] = max(params['start'], row[1])
+
+            where.append('d.chrom = :chrom')
+            where.append('d.pos BETWEEN :start AND :end')
+            sql_order = 'd.pos, d.diff_id'
+        else:
+            sql_order = 'd.diff_id'
+
+        SQL_QUERY = ('SELECT d.* '
+                     '  FROM snp_diff d '
+                     ' WHERE {} '
+                     ' ORDER BY {} '
+                     ' LIMIT :limit').format(' AND '.join(where), sql_order)
+
+        LOG.debug('Query: {}'.format(SQL_QUERY))
+
+        rows = db_cursor.execute(SQL_QUERY, params).fetchall()
+    finally:
+        db_cursor.close()
+        conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][0]
+
+    snps = [[change_names[row[1]]] + list(row[2:]) for row in rows]
+
+    LOG.info('Done: {}'.format(utils.format_time(start_time, time.time())))
+
+    return {'snps': snps, 'next': next_cursor}
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Look up SNP identifiers in the per chromosome shards of a release, see
+:mod:`ensimpl_snps.create.shard_db`.
+
+The router database tells which shards hold each identifier, then every
+shard is queried on its own connection in a thread of a shared pool.
+SQLite releases the GIL while a query runs, so the shards are searched on
+as many cores as there are threads.  Small lookups, or lookups touching a
+single shard, run in the calling thread.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import os
+import sqlite3
+import threading
+
+import ensimpl_snps.utils as utils
+
+ROUTER_DB_NAME = 'router.db3'
+
+# number of threads searching shards, shared by every lookup
+WORKERS = min(8, os.cpu_count() or 1)
+
+# lookups of fewer ids run in the calling thread
+PARALLEL_MIN_IDS = 1000
+
+EXECUTOR = {'executor': None, 'lock': threading.Lock()}
+
+SQL_SELECT_SHARDS = 'SELECT shard_id, chrom, file_name FROM shards'
+
+SQL_SELECT_ROUTES = (
+    'SELECT r.shard_id, r.snp_id '
+    '  FROM snp_shards r '
+    ' WHERE r.snp_id IN (SELECT query_id FROM {})')
+
+SQL_SELECT_SNPS = (
+    'SELECT s.chrom, s.pos, s.snp_id, s.ref, s.alt '
+    '  FROM snps s '
+    ' WHERE s.snp_id IN (SELECT query_id FROM {}) '
+    ' ORDER BY s.pos')
+
+
+def _executor():
+    """Get the thread pool searching the shards, creating it once."""
+    with EXECUTOR['lock']:
+        if EXECUTOR['executor'] is None:
+            EXECUTOR['executor'] = ThreadPoolExecutor(
+                max_workers=WORKERS, thread_name_prefix='shards')
+        return EXECUTOR['executor']
+
+
+def _query(cursor, sql, ids):
+    """Run `sql` with the table of `ids` in place of "{}".
+
+    Args:
+        cursor (sqlite3.Cursor): The database cursor.
+        sql (str): The query.
+        ids (list): The SNP identifiers.
+
+    Returns:
+        list: The rows.
+    """
+    temp_table = 'lookup_ids_{}'.format(utils.create_random_string())
+
+    cursor.execute('CREATE TEMPORARY TABLE {} ( '
+                   'query_id TEXT, '
+                   'PRIMARY KEY (query_id) '
+                   ');'.format(temp_table))
+    cursor.executemany('INSERT OR IGNORE INTO {} VALUES (?);'.format(
+        temp_table), [(_,) for _ in ids])
+
+    rows = cursor.execute(sql.format(temp_table)).fetchall()
+
+    cursor.execute('DROP TABLE {}'.format(temp_table))
+
+    return rows
+
+
+def _query_shard(file_name, ids):
+    """Get the SNPs with the identifiers in `ids` from one shard.
+
+    Args:
+        file_name (str): The shard database.
+        ids (list): The SNP identifiers.
+
+    Returns:
+        list: The SNPs ordered by position, each element being a ``list`` of
+        chromosome, position, SNP identifier, reference allele and
+        alternate allele.
+    """
+    conn = sqlite3.connect(file_name)
+
+    try:
+        return [list(row) for row in _query(conn.cursor(), SQL_SELECT_SNPS,
+                                            ids)]
+    finally:
+        conn.close()
+
+
+class ShardedStore:
+    """Look up SNP identifiers in the shards of a release.
+
+    Attributes:
+        directory (str): The shards directory.
+        shards (dict): Shard identifier to a (chromosome, file name)
+            ``tuple``.
+    """
+    def __init__(self, directory):
+        """Initialization.
+
+        Args:
+            directory (str): The shards directory.
+        """
+        self.directory = directory
+        self._conn = sqlite3.connect(os.path.join(directory, ROUTER_DB_NAME))
+        self.shards = {
+            shard_id: (chrom, os.path.join(directory, file_name))
+            for shard_id, chrom, file_name in
+            self._conn.execute(SQL_SELECT_SHARDS)
+        }
+
+    def close(self):
+        """Close the router database."""
+        self._conn.close()
+
+    def route(self, ids):
+        """Get the identifiers held by each shard.
+
+        Args:
+            ids (list): The SNP identifiers.
+
+        Returns:
+            dict: Shard identifier to the ``list`` of identifiers it holds.
+        """
+        routes = {}
+        for shard_id, snp_id in _query(self._conn.cursor(),
+                                       SQL_SELECT_ROUTES, ids):
+            routes.setdefault(shard_id, []).append(snp_id)
+
+        return routes
+
+    def by_ids(self, ids):
+        """Get the SNPs with the identifiers in `ids`, searching the shards
+        holding them at the same time.
+
+        Args:
+            ids (list): The SNP identifiers.
+
+        Returns:
+            list: The SNPs ordered by chromosome and position, each element
+            being a ``list`` of chromosome, position, SNP identifier,
+            reference allele and alternate allele.
+        """
+        routes = self.route(ids)
+
+        # the same order as the database, by chromosome name
+        shard_ids = sorted(routes, key=lambda shard_id: self.shards[shard_id])
+
+        if len(shard_ids) < 2 or len(ids) < PARALLEL_MIN_IDS:
+            results = [_query_shard(self.shards[shard_id][1],
+                                    routes[shard_id])
+                       for shard_id in shard_ids]
+        else:
+            executor = _executor()
+            futures = [executor.submit(_query_shard, self.shards[shard_id][1],
+                                       routes[shard_id])
+                       for shard_id in shard_ids]
+            results = [future.result() for future in futures]
+
+        return [snp for snps in results for snp in snps]
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""Read tabix (.tbi) indexes without opening the indexed file.
+
+The index maps a region to the BGZF virtual file offsets of the records in
+it, the upper 48 bits of a virtual offset being the offset of a compressed
+block in the file and the lower 16 bits the offset within the uncompressed
+block.  This is enough to tell how much of the file a region covers before
+reading any of it, and to read the records of a region straight from the
+BGZF blocks, as raw lines.
+"""
+import gzip
+import re
+import struct
+import threading
+import zlib
+
+import ensimpl_snps.utils as utils
+
+LOG = utils.get_logger()
+
+MAGIC = b'TBI\x01'
+
+# size of a linear index window
+LINEAR_SHIFT = 14
+
+# the bin holding the number of mapped and unmapped records
+PSEUDO_BIN = 37450
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+
+# size of the gzip header up to the extra field and of the gzip footer
+BGZF_HEADER_SIZE = 12
+BGZF_FOOTER_SIZE = 8
+
+# parsed indexes keyed by file name
+INDEXES = {}
+
+# regular expressions cutting lines to a number of columns, see
+# _columns_regex
+COLUMN_REGEXES = {}
+
+INDEXES_LOCK = threading.Lock()
+
+
+def reg2bins(start, end):
+    """Get the bins that may hold records overlapping a region.
+
+    Args:
+        start (int): The 0-based start of the region.
+        end (int): The 0-based, exclusive end of the region.
+
+    Returns:
+        list: The bin numbers.
+    """
+    end -= 1
+    bins = [0]
+
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(offset + (start >> shift),
+                          offset + (end >> shift) + 1))
+
+    return bins
+
+
+class TabixIndex:
+    """A parsed tabix index.
+
+    Attributes:
+        names (list): The contig names.
+        bins (dict): Contig name to a ``dict`` of bin number to a ``list`` of
+            (start, end) virtual offset chunks.
+        linear (dict): Contig name to a ``list`` of the smallest virtual
+            offset of a record in each 16kb window.
+        counts (dict): Contig name to the number of records, for the
+            contigs the index has a count for.
+    """
+    def __init__(self, file_name):
+        """Initialization.
+
+        Args:
+            file_name (str): The .tbi file name.
+
+        Raises:
+            ValueError: If `file_name` is not a tabix index.
+        """
+        with gzip.open(file_name, 'rb') as fd:
+            data = fd.read()
+
+        if data[:4] != MAGIC:
+            raise ValueError('{} is not a tabix index'.format(file_name))
+
+        n_ref = struct.unpack_from('<i', data, 4)[0]
+        l_nm = struct.unpack_from('<i', data, 32)[0]
+        offset = 36 + l_nm
+
+        self.names = data[36:offset].decode('utf-8').split('\x00')[:n_ref]
+        self.bins = {}
+        self.linear = {}
+        self.counts = {}
+
+        for name in self.names:
+            bins = {}
+            n_bin = struct.unpack_from('<i', data, offset)[0]
+            offset += 4
+
+            for _ in range(n_bin):
+                bin_number, n_chunk = struct.unpack_from('<Ii', data, offset)
+                offset += 8
+                chunks = struct.unpack_from('<{}Q'.format(2 * n_chunk), data,
+                                            offset)
+                offset += 16 * n_chunk
+
+                if bin_number != PSEUDO_BIN:
+                    bins[bin_number] = list(zip(chunks[0::2], chunks[1::2]))
+                elif n_chunk == 2:
+                    # the file span, then the mapped and unmapped counts
+                    self.counts[name] = chunks[2]
+
+            n_intv = struct.unpack_from('<i', data, offset)[0]
+            offset += 4
+            linear = list(struct.unpack_from('<{}Q'.format(n_intv), data,
+                                             offset))
+            offset += 8 * n_intv
+
+            self.bins[name] = bins
+            self.linear[name] = linear
+
+    def chunks(self, contig, start, end):
+        """Get the parts of the file that hold the records overlapping a
+        region, the same parts tabix reads.
+
+        Args:
+            contig (str): The contig name.
+            start (int): The 0-based start of the region.
+            end (int): The 0-based, exclusive end of the region.
+
+        Returns:
+            list: Sorted, merged (start, end) virtual offset pairs.
+        """
+        if contig not in self.bins or end <= start:
+            return []
+
+        bins = self.bins[contig]
+        linear = self.linear[contig]
+
+        # chunks ending before the first record of the window holding start
+        # can not hold a record in the region
+        window = start >> LINEAR_SHIFT
+        min_offset = linear[min(window, len(linear) - 1)] if linear else 0
+
+        chunks = sorted(chunk
+                        for bin_number in reg2bins(start, end)
+                        for chunk in bins.get(bin_number, [])
+                        if chunk[1] > min_offset)
+
+        merged = []
+        for chunk_start, chunk_end in chunks:
+            if merged and chunk_start >> 16 <= merged[-1][1] >> 16:
+                if chunk_end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], chunk_end)
+            else:
+                merged.append((chunk_start, chunk_end))
+
+        return merged
+
+    def blocks(self, contig, start, end):
+        """Estimate the number of BGZF blocks to read for a region, from the
+        distinct compressed blocks of the linear index windows it spans.
+
+        Args:
+            contig (str): The contig name.
+            start (int): The 0-based start of the region.
+            end (int): The 0-based, exclusive end of the region.
+
+        Returns:
+            int: The estimated number of blocks, ``0`` if `contig` has no
+            records.
+        """
+        linear = self.linear.get(contig)
+
+        if not linear or end <= start:
+            return 0
+
+        first = min(start >> LINEAR_SHIFT, len(linear) - 1)
+        last = min((end - 1) >> LINEAR_SHIFT, len(linear) - 1)
+
+        return len(set(voffset >> 16 for voffset in linear[first:last + 1]
+                       if voffset))
+
+    def estimate_records(self, contig, start, end):
+        """Estimate the number of records in a region from the number of
+        records of the contig, assuming they are spread evenly over its
+        16kb windows.
+
+        Args:
+            contig (str): The contig name.
+            start (int): The 0-based start of the region.
+            end (int): The 0-based, exclusive end of the region.
+
+        Returns:
+            float: The estimated number of records, ``None`` if the index has
+            no count for `contig`.
+        """
+        if contig not in self.counts:
+            return None
+
+        linear = self.linear[contig]
+        first = start >> LINEAR_SHIFT
+        last = min((end - 1) >> LINEAR_SHIFT, len(linear) - 1)
+
+        if not linear or last < first:
+            return 0.0
+
+        return self.counts[contig] * (last - first + 1) / len(linear)
+
+
+def load_index(file_name):
+    """Get the parsed index of a tabix file, parsing it only once.
+
+    Args:
+        file_name (str): The indexed file name, the index being
+            `file_name` + ".tbi".
+
+    Returns:
+        TabixIndex: The index.
+    """
+    index = INDEXES.get(file_name)
+
+    if index is None:
+        with INDEXES_LOCK:
+            index = INDEXES.get(file_name)
+            if index is None:
+                LOG.debug('Reading index of {}'.format(file_name))
+                index = TabixIndex('{}.tbi'.format(file_name))
+                INDEXES[file_name] = index
+
+    return index
+
+
+def _read_blocks(fd, coffset):
+    """Read and decompress BGZF blocks one after the other.
+
+    Args:
+        fd (file): The file, opened in binary mode.
+        coffset (int): The file offset of the first block.
+
+    Yields:
+        tuple: The file offset and the decompressed data of each block.
+
+    Raises:
+        ValueError: If a block is not a BGZF block.
+    """
+    fd.seek(coffset)
+
+    while True:
+        header = fd.read(BGZF_HEADER_SIZE)
+
+        if len(header) < BGZF_HEADER_SIZE:
+            return
+
+        if header[:4] != BGZF_MAGIC:
+            raise ValueError('Invalid BGZF block at {}'.format(coffset))
+
+        xlen = struct.unpack_from('<H', header, 10)[0]
+        extra = fd.read(xlen)
+
+        # the BC subfield holds the block size minus one
+        bsize = None
+        offset = 0
+        while offset + 4 <= xlen:
+            si1, si2, slen = struct.unpack_from('<BBH', extra, offset)
+            if si1 == 66 and si2 == 67:
+                bsize = struct.unpack_from('<H', extra, offset + 4)[0]
+            offset += 4 + slen
+
+        if bsize is None:
+            raise ValueError('Invalid BGZF block at {}'.format(coffset))
+
+        data = fd.read(bsize + 1 - BGZF_HEADER_SIZE - xlen)
+        yield coffset, zlib.decompress(data[:-BGZF_FOOTER_SIZE], -15)
+        coffset += bsize + 1
+
+
+def read_chunk(fd, chunk_start, chunk_end):
+    """Read the decompressed data between two virtual offsets.
+
+    Args:
+        fd (file): The file, opened in binary mode.
+        chunk_start (int): The virtual offset to start at.
+        chunk_end (int): The virtual offset to end at, excluded.
+
+    Yields:
+        bytes: The data, a block at a time.
+    """
+    first = chunk_start >> 16
+    last = chunk_end >> 16
+
+    for coffset, data in _read_blocks(fd, first):
+        if coffset > last:
+            return
+
+        lo = chunk_start & 0xFFFF if coffset == first else 0
+        hi = chunk_end & 0xFFFF if coffset == last else len(data)
+
+        if lo or hi < len(data):
+            data = data[lo:hi]
+
+        if data:
+            yield data
+
+        if coffset == last:
+            return
+
+
+def _columns_regex(columns):
+    """Get the regular expression cutting every line of a buffer to its
+    first `columns` columns, lines with fewer columns are left as they are.
+    """
+    regex = COLUMN_REGEXES.get(columns)
+
+    if regex is None:
+        regex = re.compile(
+            rb'^((?:[^\t\n]*\t){%d}[^\t\n]*)[^\n]*' % (columns - 1),
+            re.MULTILINE)
+        COLUMN_REGEXES[columns] = regex
+
+    return regex
+
+
+def _record_begin(data, line_start):
+    """Get the 0-based position of the record of the line at `line_start`
+    and the offset of the tab after it."""
+    tab_pos = data.find(b'\t', line_start)
+    tab_id = data.find(b'\t', tab_pos + 1)
+    return int(data[tab_pos + 1:tab_id]) - 1, tab_id
+
+
+def _line_class(data, tab_ref, tab_alt, line_end):
+    """Get the variant class of the record of a line from the offsets of the
+    tabs before its alleles."""
+    tab_qual = data.find(b'\t', tab_alt + 1, line_end)
+
+    return utils.classify_variant(
+        data[tab_ref + 1:tab_alt].decode('utf-8'),
+        data[tab_alt + 1:tab_qual if tab_qual > 0 else line_end].decode(
+            'utf-8'))
+
+
+def _select_lines(data, prefix, start, end, columns, classes=None):
+    """Pick the lines of the records overlapping a region, and of one of
+    `classes` if given, one line at a time.
+
+    Returns:
+        tuple: The selected lines and whether a record past the region was
+        found.
+    """
+    lines = []
+    done = False
+    line_start = 0
+    line_end = data.find(b'\n')
+
+    while line_end >= 0:
+        if data.startswith(prefix, line_start):
+            begin, tab_id = _record_begin(data, line_start)
+
+            if begin >= end:
+                done = True
+                break
+
+            tab_ref = data.find(b'\t', tab_id + 1)
+            tab_alt = data.find(b'\t', tab_ref + 1)
+
+            # a record spans the bases of its reference allele
+            if begin + max(1, tab_alt - tab_ref - 1) > start and \
+                    (not classes or _line_class(data, tab_ref, tab_alt,
+                                                line_end) in classes):
+                lines.append(data[line_start:line_end + 1])
+
+        line_start = line_end + 1
+        line_end = data.find(b'\n', line_start)
+
+    if columns and lines:
+        lines = [_columns_regex(columns).sub(rb'\1', b''.join(lines))]
+
+    return lines, done
+
+
+def fetch_lines(file_name, contig, start, end, columns=None, classes=None):
+    """Read the raw lines of the VCF records overlapping a region, the
+    records tabix returns, without parsing them.
+
+    The lines are read a decompressed block at a time.  Only the position of
+    the first and last line of a block is parsed, when both are in the
+    region the whole block is cut to `columns` at once, otherwise, or when
+    filtering on `classes`, its lines are checked one at a time.
+
+    Args:
+        file_name (str): The bgzip compressed, tabix indexed VCF file.
+        contig (str): The contig name.
+        start (int): The 0-based start of the region.
+        end (int): The 0-based, exclusive end of the region.
+        columns (int, optional): The number of leading columns to keep,
+            ``None`` for the whole line.
+        classes (set, optional): Only read the records of these variant
+            classes, see :func:`ensimpl_snps.utils.classify_variant`.
+
+    Yields:
+        bytes: One or more lines, each ending with a newline.
+    """
+    chunks = load_index(file_name).chunks(contig, start, end)
+
+    if not chunks:
+        return
+
+    prefix = contig.encode('utf-8') + b'\t'
+
+    with open(file_name, 'rb') as fd:
+        for chunk_start, chunk_end in chunks:
+            rest = b''
+            for data in read_chunk(fd, chunk_start, chunk_end):
+                if rest:
+                    data = rest + data
+
+                last_end = data.rfind(b'\n')
+
+                if last_end < 0:
+                    rest = data
+                    continue
+
+                rest = data[last_end + 1:]
+                data = data[:last_end + 1]
+
+                last_start = data.rfind(b'\n', 0, last_end) + 1
+
+                if not classes and data.startswith(prefix) and \
+                        data.startswith(prefix, last_start) and \
+                        _record_begin(data, 0)[0] >= start and \
+                        _record_begin(data, last_start)[0] < end:
+                    if columns:
+                        data = _columns_regex(columns).sub(rb'\1', data)
+                    yield data
+                    continue
+
+                lines, done = _select_lines(data, prefix, start, end,
+                                            columns, classes)
+
+                if lines:
+                    yield b''.join(lines)
+
+                if done:
+                    return
@@ -1,16 +1,103 @@
 # -*- coding: utf_8 -*-
+import hashlib
 import os
 import re
 import sqlite3
+import threading
 
 from collections import OrderedDict
+from concurrent.futures import Future
 
 import ensimpl_snps.utils as utils
 import ensimpl_snps.db_config as db_config
 
 LOG = utils.get_logger()
 
-REGEX_REGION = re.compile("(CHR|)*\s*([0-9]{1,2}|X|Y|MT)\s*(-|:)?\s*(\d+)\s*(MB|M|K|)?\s*(-|:|)?\s*(\d+|)\s*(MB|M|K|)?", re.IGNORECASE)
+# names the mitochondrial chromosome goes by
+MITOCHONDRIAL_NAMES = ['MT', 'M']
+
+# contig aliases and lengths keyed by database, see get_contigs
+CONTIGS = {}
+
+# optional fields keyed by database, see get_fields
+FIELDS = {}
+
+# whether the snps of a database are classified, keyed by database
+CLASSIFIED = {}
+
+REGEX_REGION = re.compile("(CHR|)*\s*([0-9]{1,2}|X|Y|MT|M)\s*(-|:)?\s*(\d+)\s*(MB|M|K|)?\s*(-|:|)?\s*(\d+|)\s*(MB|M|K|)?", re.IGNORECASE)
+REGEX_POSITION = re.compile(r"(CHR|)*\s*([0-9]{1,2}|X|Y|MT|M)\s*(-|:)?\s*(\d+)\s*(MB|M|K|)?\s*$", re.IGNORECASE)
+
+
+class SingleFlight:
+    """Coalesce identical calls made at the same time.  The first caller
+    with a key runs the function, callers with the same key arriving before
+    it is done wait for it and get the same result, or exception.  Nothing
+    is kept once the call is done, so this is not a cache.
+
+    The result is shared between the callers and must not be changed.
+    """
+    def __init__(self):
+        """Initialization."""
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """Call `func`, or wait for the call already running for `key`.
+
+        Args:
+            key: A hashable key, equal for calls with the same result.
+            func: The function to call.
+            *args: The positional arguments of `func`.
+            **kwargs: The keyword arguments of `func`.
+
+        Returns:
+            The value returned by `func`.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if not leader:
+            LOG.debug('Waiting for the running call of {}'.format(key))
+            return call.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+        return result
+
+
+# the calls running in this process, shared by all threads
+SINGLE_FLIGHT = SingleFlight()
+
+
+def ids_key(ids):
+    """Get a key for a set of ids that does not depend on their order or
+    duplicates.
+
+    Args:
+        ids (list): The ids.
+
+    Returns:
+        str: The SHA-1 hex digest of the sorted, distinct ids.
+    """
+    digest = hashlib.sha1()
+    for snp_id in sorted(set(ids)):
+        digest.update(snp_id.encode('utf-8'))
+        digest.update(b'\n')
+
+    return digest.hexdigest()
 
 
 class Region:
@@ -67,6 +154,196 @@ def connect_to_database(version, species):
         raise e
 
 
+def connect_to_diff_database(from_version, to_version, species):
+    """Connect to the database of SNP differences between two releases.
+
+    Args:
+        from_version (int): The older Ensembl version number.
+        to_version (int): The newer Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        a connection to the database
+    """
+    try:
+        database = db_config.get_ensimpl_snps_diff_db(from_version,
+                                                      to_version, species)
+        return sqlite3.connect(database)
+    except Exception as e:
+        LOG.error('Error connecting to database: {}'.format(str(e)))
+        raise e
+
+
+def connect_to_presence_database():
+    """Connect to the cross release presence index.
+
+    Returns:
+        a connection to the database
+    """
+    try:
+        database = db_config.get_ensimpl_snps_presence_db()
+        return sqlite3.connect(database)
+    except Exception as e:
+        LOG.error('Error connecting to database: {}'.format(str(e)))
+        raise e
+
+
+def contig_aliases(name):
+    """Get the names a contig can be referred to by, in upper case.
+
+    Args:
+        name (str): The contig name.
+
+    Returns:
+        list: The aliases of `name`, with and without a "chr" prefix and
+        every name of the mitochondrial chromosome.
+    """
+    bare = name.upper()
+    if bare.startswith('CHR'):
+        bare = bare[3:]
+
+    names = MITOCHONDRIAL_NAMES if bare in MITOCHONDRIAL_NAMES else [bare]
+
+    aliases = []
+    for alias in names:
+        aliases.extend([alias, 'CHR' + alias])
+
+    return aliases
+
+
+def load_contigs(database):
+    """Get the contigs of a database, loaded once per database.
+
+    Args:
+        database (str): The ensimpl snps database file.
+
+    Returns:
+        dict: The upper case aliases of every contig, see
+        :func:`contig_aliases`, with values of (contig name, length).  The
+        length is ``None`` when it is not known.
+    """
+    contigs = CONTIGS.get(database)
+
+    if contigs is not None:
+        return contigs
+
+    conn = sqlite3.connect(database)
+    cursor = conn.cursor()
+
+    try:
+        rows = cursor.execute('SELECT chrom, length FROM contigs').fetchall()
+    except sqlite3.OperationalError:
+        try:
+            rows = cursor.execute('SELECT chrom, max_pos '
+                                  '  FROM contig_stats').fetchall()
+        except sqlite3.OperationalError:
+            # databases built before contigs were stored
+            rows = cursor.execute('SELECT distinct chrom, null '
+                                  '  FROM snps').fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+    contigs = {}
+
+    # exact names win over aliases of other contigs
+    for name, length in rows:
+        for alias in contig_aliases(name):
+            contigs.setdefault(alias, (name, length))
+    for name, length in rows:
+        contigs[name.upper()] = (name, length)
+
+    CONTIGS[database] = contigs
+
+    return contigs
+
+
+def get_contigs(version, species):
+    """Get the contigs of a database, see :func:`load_contigs`.
+
+    Args:
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        dict: The upper case aliases of every contig with values of (contig
+        name, length).
+    """
+    return load_contigs(db_config.get_ensimpl_snp_db(version, species)['db'])
+
+
+def load_fields(database):
+    """Get the optional fields stored in a database, loaded once per
+    database.
+
+    Args:
+        database (str): The ensimpl snps database file.
+
+    Returns:
+        dict: Field name to the name of the table holding its values.
+    """
+    fields = FIELDS.get(database)
+
+    if fields is not None:
+        return fields
+
+    conn = sqlite3.connect(database)
+
+    try:
+        fields = dict(conn.execute('SELECT name, table_name '
+                                   '  FROM snp_fields').fetchall())
+    except sqlite3.OperationalError:
+        # databases built before fields were stored
+        fields = {}
+    finally:
+        conn.close()
+
+    FIELDS[database] = fields
+
+    return fields
+
+
+def get_fields(version, species):
+    """Get the optional fields stored for a release, see
+    :func:`ensimpl_snps.create.ensimpl_db.insert_fields`.
+
+    Args:
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        dict: Field name to the name of the table holding its values.
+    """
+    return load_fields(db_config.get_ensimpl_snp_db(version, species)['db'])
+
+
+def is_classified(version, species):
+    """Tell whether the variant class of the snps of a release is stored,
+    see :data:`ensimpl_snps.utils.VARIANT_CLASSES`.
+
+    Args:
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        bool: ``True`` if it is stored.
+    """
+    database = db_config.get_ensimpl_snp_db(version, species)['db']
+    classified = CLASSIFIED.get(database)
+
+    if classified is None:
+        conn = sqlite3.connect(database)
+        try:
+            columns = [row[1] for row in
+                       conn.execute('PRAGMA table_info(snps)')]
+        finally:
+            conn.close()
+
+        classified = CLASSIFIED[database] = 'variant_class' in columns
+
+    return classified
+
+
 def get_tabix_file(version, species):
     """Get the tabix file.
 
@@ -84,6 +361,58 @@ def get_tabix_file(version, species):
         raise e
 
 
+def get_columnar_file(version, species):
+    """Get the columnar store, see :mod:`ensimpl_snps.fetch.columnar`.
+
+    Args:
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        str: A file location or ``None`` if there is no columnar store.
+    """
+    try:
+        return db_config.get_ensimpl_snp_db(version, species).get('columnar')
+    except Exception as e:
+        LOG.error('Error finding columnar store: {}'.format(str(e)))
+        raise e
+
+
+def get_shards_dir(version, species):
+    """Get the shards directory, see :mod:`ensimpl_snps.fetch.shards`.
+
+    Args:
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        str: A directory location or ``None`` if there are no shards.
+    """
+    try:
+        return db_config.get_ensimpl_snp_db(version, species).get('shards')
+    except Exception as e:
+        LOG.error('Error finding shards: {}'.format(str(e)))
+        raise e
+
+
+def get_genotypes_dir(version, species):
+    """Get the strain genotypes directory, see
+    :mod:`ensimpl_snps.fetch.genotypes`.
+
+    Args:
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+
+    Returns:
+        str: A directory location or ``None`` if there are no genotypes.
+    """
+    try:
+        return db_config.get_ensimpl_snp_db(version, species).get('genotypes')
+    except Exception as e:
+        LOG.error('Error finding genotypes: {}'.format(str(e)))
+        raise e
+
+
 def nvl(value, default):
     """Returns `value` if value has a value, else `default`.
 
@@ -132,7 +461,7 @@ def get_multiplier(factor):
         factor = factor.lower()
 
         if factor == 'mb':
-            return 10000000
+            return 1000000
         elif factor == 'm':
             return 1000000
         elif factor == 'k':
@@ -184,3 +513,103 @@ def str_to_region(location):
 
     return loc
 
+
+def str_to_regions(locations, contigs=None, clamp=True):
+    """Parse and validate many strings into genomic locations at once.
+
+    Every string is parsed before any is looked up, and when `contigs` is
+    given the chromosome of each region is resolved to the contig name used
+    by the database and the region is checked against the contig length.
+
+    Args:
+        locations (list): A ``list`` of genomic locations (ranges).
+        contigs (dict, optional): The contigs from :func:`get_contigs`,
+            ``None`` to only parse the strings.
+        clamp (bool, optional): ``True`` to clamp regions that extend past
+            the start or end of a contig, ``False`` to reject them.
+
+    Returns:
+        list: A ``list`` of :class:`Region` objects in the order of
+        `locations`.
+
+    Raises:
+        ValueError: If `locations` is empty or any location is invalid, the
+            message listing the invalid locations.
+    """
+    if not locations:
+        raise ValueError('No locations specified')
+
+    regions = []
+    invalid = []
+
+    for location in locations:
+        try:
+            loc = str_to_region(location)
+
+            if loc.end_position < loc.start_position:
+                raise ValueError('end before start')
+
+            if contigs is not None:
+                contig = contigs.get(loc.chromosome.upper())
+
+                if not contig:
+                    raise ValueError('unknown chromosome')
+
+                loc.chromosome, length = contig
+
+                if loc.start_position < 1 or \
+                        (length and loc.end_position > length):
+                    if not clamp or (length and loc.start_position > length):
+                        raise ValueError('outside of chromosome')
+                    loc.start_position = max(1, loc.start_position)
+                    if length:
+                        loc.end_position = min(length, loc.end_position)
+
+            regions.append(loc)
+        except ValueError as e:
+            invalid.append('{} ({})'.format(location, e))
+
+    if invalid:
+        raise ValueError('Invalid location{}: {}{}'.format(
+            's' if len(invalid) > 1 else '', ', '.join(invalid[:10]),
+            ', ...' if len(invalid) > 10 else ''))
+
+    return regions
+
+
+def str_to_position(location):
+    """Parse a string into a single genomic position.
+
+    Args:
+        location (str): The genomic position, like "1:10000000" or "X:15M".
+
+    Returns:
+        Region: A region object with `start_position` equal to
+        `end_position`.
+
+    Raises:
+        ValueError: If `location` is invalid.
+    """
+    if not location:
+        raise ValueError('No position specified')
+
+    valid_location = location.strip()
+
+    if len(valid_location) <= 0:
+        raise ValueError('Empty position')
+
+    match = REGEX_POSITION.match(valid_location)
+
+    if not match:
+        raise ValueError('Invalid position string')
+
+    loc = Region()
+    loc.chromosome = match.group(2)
+    loc.start_position = int(match.group(4))
+
+    if match.group(5):
+        loc.start_position *= get_multiplier(match.group(5))
+
+    loc.end_position = loc.start_position
+
+    return loc
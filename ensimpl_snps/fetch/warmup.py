@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""Warm the operating system page cache before serving requests.
+
+Right after a deploy or reboot nothing of the databases is in memory and
+the first requests wait on the disk.  The warm-up reads, for every release:
+
+    * the interior pages of the SNP id index, by looking up ids spread over
+      the whole table, so every later lookup only reads its leaf page,
+    * the contigs and the tabix index, which are also kept parsed,
+    * the chunk index of the columnar store, if there is one,
+
+and then the SNPs of the hot regions, read from a list of regions and from
+the regions recently requested.  Requested regions are appended to a history
+file, which is cut down to its most recent part at every warm-up.  Where
+``fcntl`` is available the history is locked against every process, so the
+workers appending to it while it is cut down keep their lines.
+
+:data:`READY` is set once the warm-up is done.
+"""
+from collections import Counter
+from contextlib import contextmanager
+
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import ensimpl_snps.db_config as db_config
+import ensimpl_snps.fetch.search as search
+import ensimpl_snps.fetch.tabix_index as tabix_index
+import ensimpl_snps.fetch.utils as fetch_utils
+import ensimpl_snps.utils as utils
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOG = utils.get_logger()
+
+# number of ids looked up in each database
+ID_PROBES = 10000
+
+# number of the most requested regions to read
+HOT_REGIONS = 100
+
+# bytes at the end of the history file kept and counted
+HISTORY_BYTES = 1024 * 1024
+
+READY = threading.Event()
+
+HISTORY = {'file_name': None, 'rate': 1.0, 'lock': threading.Lock()}
+
+
+def warm_id_index(database, probes=ID_PROBES):
+    """Read the interior pages of the SNP id index of a database.
+
+    Args:
+        database (str): The database file.
+        probes (int, optional): The number of ids to look up.
+
+    Returns:
+        int: The number of ids looked up.
+    """
+    conn = sqlite3.connect(database)
+
+    try:
+        max_rowid = conn.execute('SELECT max(rowid) FROM snps').fetchone()[0]
+
+        if not max_rowid or probes <= 0:
+            return 0
+
+        rowids = random.sample(range(1, max_rowid + 1),
+                               min(probes, max_rowid))
+        ids = [row[0] for row in conn.execute(
+            'SELECT snp_id FROM snps WHERE rowid IN ({})'.format(
+                ','.join(map(str, rowids))))]
+
+        for snp_id in ids:
+            conn.execute('SELECT 1 FROM snps INDEXED BY idx_snps_id '
+                         ' WHERE snp_id = ?', (snp_id,)).fetchone()
+
+        return len(ids)
+    finally:
+        conn.close()
+
+
+def warm_release(release, probes=ID_PROBES):
+    """Warm the files of a release.
+
+    Args:
+        release (dict): The files of the release, see
+            :func:`ensimpl_snps.db_config.find_ensimpl_snps_dbs`.
+        probes (int, optional): The number of ids to look up.
+    """
+    if release.get('db'):
+        fetch_utils.load_contigs(release['db'])
+        warm_id_index(release['db'], probes)
+
+    if release.get('vcf'):
+        tabix_index.load_index(release['vcf'])
+
+    if release.get('columnar'):
+        conn = sqlite3.connect(release['columnar'])
+        try:
+            conn.execute('SELECT count(*) FROM chunks '
+                         ' INDEXED BY idx_chunks_region').fetchone()
+        finally:
+            conn.close()
+
+
+@contextmanager
+def _history_lock(file_name):
+    """Lock the history file against the other threads and, where
+    ``fcntl`` is available, the other processes.  The lock is taken on a
+    separate file, as the history is replaced when it is cut down.
+
+    Args:
+        file_name (str): The history file.
+    """
+    with HISTORY['lock']:
+        if fcntl is None:
+            yield
+            return
+
+        with open(file_name + '.lock', 'a') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def read_regions(file_name):
+    """Read a list of regions, one "version species region" per line.
+
+    Args:
+        file_name (str): The file name.
+
+    Returns:
+        list: The (version, species, region) ``tuples``.
+    """
+    regions = []
+
+    with open(file_name) as fd:
+        for line in fd:
+            elems = line.split()
+            if len(elems) == 3 and not line.startswith('#'):
+                regions.append(tuple(elems))
+
+    return regions
+
+
+def hot_regions(file_name, num_regions=HOT_REGIONS,
+                history_bytes=HISTORY_BYTES):
+    """Get the most requested regions from the end of the history file and
+    cut the file down to it.  The end is written to a temporary file that
+    then replaces the history, so the history is never left half written.
+
+    Args:
+        file_name (str): The history file.
+        num_regions (int, optional): The number of regions.
+        history_bytes (int, optional): The bytes at the end of the file to
+            count and keep.
+
+    Returns:
+        list: The (version, species, region) ``tuples``, most requested
+        first.
+    """
+    with _history_lock(file_name):
+        try:
+            with open(file_name, 'rb') as fd:
+                fd.seek(0, 2)
+                offset = max(0, fd.tell() - history_bytes)
+                fd.seek(offset)
+                data = fd.read()
+        except FileNotFoundError:
+            return []
+
+        lines = data.decode('utf-8', 'replace').splitlines(True)
+
+        # the first line may have been cut
+        if offset:
+            lines = lines[1:]
+
+        fd, temp_name = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(file_name)))
+
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                temp.write(''.join(lines).encode('utf-8'))
+
+                # the lines appended since it was read, by processes that
+                # can not be locked out without fcntl
+                with open(file_name, 'rb') as history:
+                    history.seek(offset + len(data))
+                    temp.write(history.read())
+
+            shutil.copymode(file_name, temp_name)
+            os.replace(temp_name, file_name)
+        except Exception:
+            utils.delete_file(temp_name)
+            raise
+
+    counts = Counter(tuple(line.rstrip('\n').split('\t')) for line in lines
+                     if line.count('\t') == 2)
+
+    return [region for region, _ in counts.most_common(num_regions)]
+
+
+def record_region(version, species, region):
+    """Append a requested region to the history file, if there is one.
+
+    Args:
+        version (int): The Ensembl version number.
+        species (str): The Ensembl species identifier.
+        region (str): The region.
+    """
+    file_name = HISTORY['file_name']
+
+    if not file_name or not region:
+        return
+
+    if HISTORY['rate'] < 1 and random.random() >= HISTORY['rate']:
+        return
+
+    line = '{}\t{}\t{}\n'.format(version, species, ''.join(region.split()))
+
+    with _history_lock(file_name):
+        with open(file_name, 'a') as fd:
+            fd.write(line)
+
+
+def warm_up(regions_file=None, history_file=None, probes=ID_PROBES,
+            num_regions=HOT_REGIONS):
+    """Warm every release and the hot regions, then set :data:`READY`.
+
+    Args:
+        regions_file (str, optional): A list of regions to read, see
+            :func:`read_regions`.
+        history_file (str, optional): The history file of the requested
+            regions, see :func:`hot_regions`.
+        probes (int, optional): The number of ids to look up in each
+            database.
+        num_regions (int, optional): The number of the most requested
+            regions to read.
+    """
+    start_time = time.time()
+
+    try:
+        for release in db_config.ENSIMPL_SNPS_DBS or []:
+            try:
+                warm_release(release, probes)
+            except Exception as e:
+                LOG.error('Unable to warm {} {}: {}'.format(
+                    release['version'], release['species'], e))
+
+        regions = read_regions(regions_file) if regions_file else []
+        if history_file:
+            regions.extend(hot_regions(history_file, num_regions))
+
+        for version, species, region in regions:
+            try:
+                search.by_region(region, version, species)
+            except Exception as e:
+                LOG.error('Unable to warm {} {} {}: {}'.format(
+                    version, species, region, e))
+
+        LOG.warning('Warm up done: {} regions in {}'.format(
+            len(regions), utils.format_time(start_time, time.time())))
+    except Exception as e:
+        LOG.error('Warm up failed: {}'.format(e))
+    finally:
+        READY.set()
+
+
+def start(config):
+    """Start warming up in a background thread, or set :data:`READY` now if
+    ``WARMUP`` is ``False``.
+
+    Args:
+        config (dict): The application configuration.
+
+    Returns:
+        threading.Thread: The thread, ``None`` if there is no warm-up.
+    """
+    HISTORY['file_name'] = config.get('WARMUP_HISTORY_FILE')
+    HISTORY['rate'] = config.get('WARMUP_HISTORY_RATE', 1.0)
+
+    if not config.get('WARMUP', False):
+        READY.set()
+        return None
+
+    READY.clear()
+
+    thread = threading.Thread(
+        target=warm_up, name='warm-up',
+        args=(config.get('WARMUP_REGIONS_FILE'),
+              config.get('WARMUP_HISTORY_FILE'),
+              config.get('WARMUP_ID_PROBES', ID_PROBES),
+              config.get('WARMUP_HOT_REGIONS', HOT_REGIONS)))
+    thread.daemon = True
+    thread.start()
+
+    return thread
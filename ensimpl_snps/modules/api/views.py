@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 from functools import wraps
 
+import logging
+
 from flask import Blueprint
+from flask import Response
 from flask import current_app
 from flask import jsonify
 from flask import request
+from flask import stream_with_context
 
 import ensimpl_snps.db_config as db_config
+import ensimpl_snps.fetch.warmup as warmup
+import ensimpl_snps.utils as utils
 
 from ensimpl_snps.fetch import get
 from ensimpl_snps.fetch import search as search_ensimpl
@@ -14,6 +20,20 @@ from ensimpl_snps.fetch import search as search_ensimpl
 api = Blueprint('api', __name__, template_folder='templates', url_prefix='/api')
 
 
+def log_call():
+    """Log the request, only building the url when debugging."""
+    if current_app.logger.isEnabledFor(logging.DEBUG):
+        utils.log_event(current_app.logger, logging.DEBUG, 'call',
+                        method=request.method, url=request.url)
+
+
+def requested_list(name):
+    """Get the values of a list parameter, which can be repeated or comma
+    separated, like the ``fields`` parameter."""
+    return [item for value in request.values.getlist(name)
+            for item in value.split(',') if item.strip()]
+
+
 def support_jsonp(func):
     """Wraps JSONified output for JSONP requests."""
 
@@ -79,13 +99,16 @@ def snps():
 
     The following is a list of the valid parameters:
 
-    =======  =======  ===================================================
-    Param    Type     Description
-    =======  =======  ===================================================
-    version  integer  the Ensembl version number
-    species  string   the species identifier (example 'Hs', 'Mm')
-    ids      list     a list of ids to find
-    =======  =======  ===================================================
+    =============  =======  ============================================
+    Param          Type     Description
+    =============  =======  ============================================
+    version        integer  the Ensembl version number
+    species        string   the species identifier (example 'Hs', 'Mm')
+    ids            list     a list of ids to find
+    mode           string   "rows" (default), "count" or "estimate"
+    fields         list     optional fields to add to each snp
+    variant_class  list     only the snps of these classes
+    =============  =======  ============================================
 
     If successful, a JSON response will be returned with the following elements:
 
@@ -98,24 +121,43 @@ def snps():
     unknown         list     a list of the snp ids not found
     ==============  =======  ==================================================
 
+    With ``mode=count`` the snps are counted without being read and with
+    ``mode=estimate`` the counts are estimated from a sample of the ids.
+    Neither returns ``snps`` or ``unknown``, ``num_found`` holds the number
+    of distinct ids found and ``num_unknown`` is over the distinct ids.
+
     The elements in the snp data are:
         * chromosome
         * position
         * SNP identifier
         * reference allele
         * alternate allele
+        * the value of each of ``fields``, ``null`` when there is none
 
-    If an error occurs, a JSON response will be sent back with just one
-    element called ``message`` along with a status code of 500.
+    Fields, like "TSA" or "QUAL", are only available when they were stored
+    when the database was created.  With ``fields`` the response also has a
+    ``fields`` element naming the elements of the snp data.
+
+    The variant classes are "snv", "mnv", "insertion", "deletion",
+    "multi_allelic" and "other".  With ``variant_class`` the ids whose snps
+    are all of other classes are in ``unknown``.
+
+    If a parameter is invalid, like an unknown variant class, a JSON
+    response will be sent back with just one element called ``message``
+    along with a status code of 400.  If any other error occurs, the status
+    code will be 500.
 
     Returns:
         :class:`flask.Response`: The response which is a JSON response.
     """
-    current_app.logger.debug('Call for: GET {}'.format(request.url))
+    log_call()
 
     version = request.values.get('version', None)
     species = request.values.get('species', None)
     requested_ids = request.values.getlist('ids', None)
+    mode = request.values.get('mode', 'rows')
+    fields = requested_list('fields')
+    classes = requested_list('variant_class')
 
     ret = {
         'num_snps': 0,
@@ -131,15 +173,41 @@ def snps():
         if not species:
             raise ValueError('No species specified')
 
-        result = search_ensimpl.by_ids(requested_ids, version, species)
+        if mode not in search_ensimpl.SEARCH_MODES:
+            raise ValueError('Invalid mode: {}'.format(mode))
+
+        if classes and mode != 'rows':
+            raise ValueError('variant_class can only be used with mode=rows')
+
+        if mode == 'count':
+            return jsonify(dict(search_ensimpl.count_ids(
+                requested_ids, version, species), mode=mode))
+        elif mode == 'estimate':
+            return jsonify(dict(search_ensimpl.estimate_ids(
+                requested_ids, version, species), mode=mode))
+
+        if fields:
+            search_ensimpl.field_tables(fields, version, species)
+
+        search_ensimpl.check_variant_classes(classes, version, species)
+
+        result = search_ensimpl.by_ids(requested_ids, version, species,
+                                       fields, classes)
         snps = result['snps']
         snps_not_found = result['snps_not_found']
 
+        if fields:
+            ret['fields'] = search_ensimpl.DEFAULT_FIELDS + fields
+
         ret['num_snps'] = len(snps)
         ret['snps'] = snps
         ret['num_unknown'] = len(snps_not_found)
         ret['unknown'] = snps_not_found
 
+    except ValueError as e:
+        response = jsonify(message=str(e))
+        response.status_code = 400
+        return response
     except Exception as e:
         response = jsonify(message=str(e))
         response.status_code = 500
@@ -155,12 +223,612 @@ def region():
 
     The following is a list of the valid parameters:
 
+    =============  =======  ============================================
+    Param          Type     Description
+    =============  =======  ============================================
+    version        integer  the Ensembl version number
+    species        string   the species identifier (example 'Hs', 'Mm')
+    region         string   a region like "1:10000000-10500000"
+    limit          string   max number of items to return, defaults to
+                            100,000
+    mode           string   "rows" (default), "count" or "estimate"
+    format         string   "json" (default) or "tsv"
+    fields         list     optional fields to add to each snp, see
+                            ``/api/snps``
+    variant_class  list     only the snps of these classes, see
+                            ``/api/snps``
+    =============  =======  ============================================
+
+    If successful, a JSON response will be returned with the following elements:
+
+    ==============  =======  ==================================================
+    Element         Type     Description
+    ==============  =======  ==================================================
+    num_snps        integer  the number of snps found
+    snps            list     a list of snps, each element contains snp data
+    ==============  =======  ==================================================
+
+    With ``mode=count`` the snps in each region are counted exactly without
+    being read and with ``mode=estimate`` they are estimated from the
+    precomputed density.  Both take any number of ``region`` parameters and
+    return ``num_snps``, the total, and ``regions``, a list with the
+    ``region`` and its ``num_snps`` for each region, instead of ``snps``.
+
+    The elements in the snp data are:
+        * chromosome
+        * position
+        * SNP identifier
+        * reference allele
+        * alternate allele
+
+    With ``format=tsv`` the snps are streamed as ``text/tab-separated-values``
+    instead, one line of the VCF file cut to these five columns per snp.
+
+    If a parameter is invalid, like a region outside of its chromosome, a
+    JSON response will be sent back with just one element called ``message``
+    along with a status code of 400.  If any other error occurs, the status
+    code will be 500.
+
+    Returns:
+        :class:`flask.Response`: The response which is a JSON response.
+    """
+    log_call()
+
+    version = request.values.get('version', None)
+    species = request.values.get('species', None)
+    region = request.values.get('region', None)
+    limit = request.values.get('limit', '100000')
+    mode = request.values.get('mode', 'rows')
+    fmt = request.values.get('format', 'json')
+    fields = requested_list('fields')
+    classes = requested_list('variant_class')
+
+    try:
+        limit = int(limit)
+    except ValueError as ve:
+        limit = 100000
+        current_app.logger.info(ve)
+
+    ret = {
+        'num_snps': 0,
+        'snps': None,
+    }
+
+    try:
+        if not version:
+            raise ValueError('No version specified')
+
+        if not species:
+            raise ValueError('No species specified')
+
+        if mode not in search_ensimpl.SEARCH_MODES:
+            raise ValueError('Invalid mode: {}'.format(mode))
+
+        if fmt not in search_ensimpl.REGION_FORMATS:
+            raise ValueError('Invalid format: {}'.format(fmt))
+
+        if classes and mode != 'rows':
+            raise ValueError('variant_class can only be used with mode=rows')
+
+        search_ensimpl.check_variant_classes(classes)
+
+        if mode == 'rows' and fmt == 'tsv':
+            if fields:
+                raise ValueError('fields can not be used with format=tsv')
+
+            lines = search_ensimpl.region_lines(region, version, species,
+                                                limit, classes=classes)
+
+            warmup.record_region(version, species, region)
+
+            return Response(stream_with_context(lines),
+                            mimetype='text/tab-separated-values')
+
+        if mode != 'rows':
+            regions = request.values.getlist('region')
+
+            if mode == 'count':
+                counts = search_ensimpl.count_regions(regions, version,
+                                                      species)
+            else:
+                counts = search_ensimpl.estimate_regions(regions, version,
+                                                         species)
+
+            return jsonify({'mode': mode,
+                            'num_snps': sum(c['num_snps'] for c in counts),
+                            'regions': counts})
+
+        if fields:
+            search_ensimpl.field_tables(fields, version, species)
+
+        snps = search_ensimpl.by_region(region, version, species, limit,
+                                        fields, classes)
+
+        if fields:
+            ret['fields'] = search_ensimpl.DEFAULT_FIELDS + fields
+
+        ret['num_snps'] = len(snps)
+        ret['snps'] = snps
+
+        warmup.record_region(version, species, region)
+
+    except ValueError as e:
+        response = jsonify(message=str(e))
+        response.status_code = 400
+        return response
+    except Exception as e:
+        response = jsonify(message=str(e))
+        response.status_code = 500
+        return response
+
+    return jsonify(ret)
+
+
+
+@api.route("/nearest", methods=['GET', 'POST'])
+@support_jsonp
+def nearest():
+    """Get the closest SNPs to one or more positions for a particular Ensembl
+    version and species.
+
+    The following is a list of the valid parameters:
+
+    ========  =======  ===================================================
+    Param     Type     Description
+    ========  =======  ===================================================
+    version   integer  the Ensembl version number
+    species   string   the species identifier (example 'Hs', 'Mm')
+    position  list     a list of positions like "1:10000000"
+    k         integer  the number of SNPs per position, defaults to 1
+    ========  =======  ===================================================
+
+    If successful, a JSON response will be returned with the following elements:
+
+    ==============  =======  ==================================================
+    Element         Type     Description
+    ==============  =======  ==================================================
+    results         list     one element per position, in request order
+    ==============  =======  ==================================================
+
+    Each element of ``results`` contains ``position`` and ``snps``, the SNPs
+    ordered by distance from the position.  The elements in the snp data are:
+        * chromosome
+        * position
+        * SNP identifier
+        * reference allele
+        * alternate allele
+
+    If a parameter is invalid, like a position on an unknown chromosome, a
+    JSON response will be sent back with just one element called ``message``
+    along with a status code of 400.  If any other error occurs, the status
+    code will be 500.
+
+    Returns:
+        :class:`flask.Response`: The response which is a JSON response.
+    """
+    log_call()
+
+    version = request.values.get('version', None)
+    species = request.values.get('species', None)
+    positions = request.values.getlist('position', None)
+    k = request.values.get('k', '1')
+
+    try:
+        if not version:
+            raise ValueError('No version specified')
+
+        if not species:
+            raise ValueError('No species specified')
+
+        results = search_ensimpl.nearest(positions, version, species, k)
+
+    except ValueError as e:
+        response = jsonify(message=str(e))
+        response.status_code = 400
+        return response
+    except Exception as e:
+        response = jsonify(message=str(e))
+        response.status_code = 500
+        return response
+
+    return jsonify({'results': results})
+
+
+@api.route("/flanking", methods=['GET', 'POST'])
+@support_jsonp
+def flanking():
+    """Get the closest SNP on each side of one or more positions for a
+    particular Ensembl version and species.
+
+    The following is a list of the valid parameters:
+
+    ========  =======  ===================================================
+    Param     Type     Description
+    ========  =======  ===================================================
+    version   integer  the Ensembl version number
+    species   string   the species identifier (example 'Hs', 'Mm')
+    position  list     a list of positions like "1:10000000"
+    ========  =======  ===================================================
+
+    If successful, a JSON response will be returned with the following elements:
+
+    ==============  =======  ==================================================
+    Element         Type     Description
+    ==============  =======  ==================================================
+    results         list     one element per position, in request order
+    ==============  =======  ==================================================
+
+    Each element of ``results`` contains ``position``, ``left`` and ``right``,
+    the closest SNP before and after the position or ``null``.
+
+    If a parameter is invalid, like a position on an unknown chromosome, a
+    JSON response will be sent back with just one element called ``message``
+    along with a status code of 400.  If any other error occurs, the status
+    code will be 500.
+
+    Returns:
+        :class:`flask.Response`: The response which is a JSON response.
+    """
+    log_call()
+
+    version = request.values.get('version', None)
+    species = request.values.get('species', None)
+    positions = request.values.getlist('position', None)
+
+    try:
+        if not version:
+            raise ValueError('No version specified')
+
+        if not species:
+            raise ValueError('No species specified')
+
+        results = search_ensimpl.flanking(positions, version, species)
+
+    except ValueError as e:
+        response = jsonify(message=str(e))
+        response.status_code = 400
+        return response
+    except Exception as e:
+        response = jsonify(message=str(e))
+        response.status_code = 500
+        return response
+
+    return jsonify({'results': results})
+
+
+@api.route("/density", methods=['GET', 'POST'])
+@support_jsonp
+def density():
+    """Get the SNP density of a region for a particular Ensembl version and
+    species.  The counts come from precomputed bins, so the time taken does
+    not depend on the number of SNPs in the region.
+
+    The following is a list of the valid parameters:
+
+    ==========  =======  ==================================================
+    Param       Type     Description
+    ==========  =======  ==================================================
+    version     integer  the Ensembl version number
+    species     string   the species identifier (example 'Hs', 'Mm')
+    region      string   a region like "1:10000000-10500000"
+    resolution  integer  the bin size, picked from the region if not given
+    ==========  =======  ==================================================
+
+    If successful, a JSON response will be returned with the following elements:
+
+    ==============  =======  ==================================================
+    Element         Type     Description
+    ==============  =======  ==================================================
+    bin_size        integer  the size of each bin
+    num_bins        integer  the number of bins
+    bins            list     a list of bins overlapping the region
+    ==============  =======  ==================================================
+
+    The elements in the bin data are:
+        * chromosome
+        * bin start position
+        * bin end position
+        * number of SNPs in the bin
+
+    If a parameter is invalid, like a region outside of its chromosome, a
+    JSON response will be sent back with just one element called ``message``
+    along with a status code of 400.  If any other error occurs, the status
+    code will be 500.
+
+    Returns:
+        :class:`flask.Response`: The response which is a JSON response.
+    """
+    log_call()
+
+    version = request.values.get('version', None)
+    species = request.values.get('species', None)
+    region = request.values.get('region', None)
+    resolution = request.values.get('resolution', None)
+
+    ret = {
+        'bin_size': 0,
+        'num_bins': 0,
+        'bins': None,
+    }
+
+    try:
+        if not version:
+            raise ValueError('No version specified')
+
+        if not species:
+            raise ValueError('No species specified')
+
+        result = search_ensimpl.density(region, version, species, resolution)
+
+        ret['bin_size'] = result['bin_size']
+        ret['num_bins'] = len(result['bins'])
+        ret['bins'] = result['bins']
+
+    except ValueError as e:
+        response = jsonify(message=str(e))
+        response.status_code = 400
+        return response
+    except Exception as e:
+        response = jsonify(message=str(e))
+        response.status_code = 500
+        return response
+
+    return jsonify(ret)
+
+
+@api.route("/contigs")
+@support_jsonp
+def contigs():
+    """Get the precomputed chromosome statistics for a particular Ensembl
+    version and species.
+
+    The following is a list of the valid parameters:
+
+    =======  =======  ===================================================
+    Param    Type     Description
+    =======  =======  ===================================================
+    version  integer  the Ensembl version number
+    species  string   the species identifier (example 'Hs', 'Mm')
+    =======  =======  ===================================================
+
+    If successful, a JSON response will be returned with a single
+    ``contigs`` element containing a ``list`` of chromosomes consisting of
+    the following items:
+
+    =================  =======  ===========================================
+    Element            Type     Description
+    =================  =======  ===========================================
+    chrom              string   the chromosome
+    num_snps           integer  the number of snps
+    min_pos            integer  the position of the first snp
+    max_pos            integer  the position of the last snp
+    num_snv            integer  the number of single nucleotide variants
+    num_mnv            integer  the number of multi nucleotide variants
+    num_insertion      integer  the number of insertions
+    num_deletion       integer  the number of deletions
+    num_multi_allelic  integer  the number of multi-allelic variants
+    num_other          integer  the number of other variants
+    =================  =======  ===========================================
+
+    If an error occurs, a JSON response will be sent back with just one
+    element called ``message`` along with a status code of 500.
+
+    Returns:
+        :class:`flask.Response`: The response which is a JSON response.
+    """
+    log_call()
+
+    version = request.values.get('version', None)
+    species = request.values.get('species', None)
+
+    try:
+        if not version:
+            raise ValueError('No version specified')
+
+        if not species:
+            raise ValueError('No species specified')
+
+        contig_stats = get.contigs(version, species)
+
+    except Exception as e:
+        response = jsonify(message=str(e))
+        response.status_code = 500
+        return response
+
+    return jsonify({'contigs': contig_stats})
+
+
+@api.route("/history", methods=['GET', 'POST'])
+@support_jsonp
+def history():
+    """Get the Ensembl releases SNPs are in and where they were located for
+    a particular species, answered from the cross release presence index.
+
+    The following is a list of the valid parameters:
+
+    =======  =======  ===================================================
+    Param    Type     Description
+    =======  =======  ===================================================
+    species  string   the species identifier (example 'Hs', 'Mm')
+    ids      list     a list of ids to find
+    =======  =======  ===================================================
+
+    If successful, a JSON response will be returned with the following elements:
+
+    ==============  =======  ==================================================
+    Element         Type     Description
+    ==============  =======  ==================================================
+    num_snps        integer  the number of snps found
+    snps            list     a list of snps, each element contains snp history
+    num_unknown     integer  the number of snp ids not found
+    unknown         list     a list of the snp ids not found
+    ==============  =======  ==================================================
+
+    The elements in the snp history are:
+        * id - the SNP identifier
+        * versions - the Ensembl versions the SNP is in
+        * moved - the Ensembl versions where the SNP changed position
+        * positions - a list of [version, chromosome, position] for every
+          version where the SNP changed position
+
+    If an error occurs, a JSON response will be sent back with just one
+    element called ``message`` along with a status code of 500.
+
+    Returns:
+        :class:`flask.Response`: The response which is a JSON response.
+    """
+    log_call()
+
+    species = request.values.get('species', None)
+    requested_ids = request.values.getlist('ids', None)
+
+    ret = {
+        'num_snps': 0,
+        'snps': None,
+        'num_unknown': 0,
+        'unknown': None
+    }
+
+    try:
+        if not species:
+            raise ValueError('No species specified')
+
+        result = search_ensimpl.history(requested_ids, species)
+        snps = result['snps']
+        snps_not_found = result['snps_not_found']
+
+        ret['num_snps'] = len(snps)
+        ret['snps'] = snps
+        ret['num_unknown'] = len(snps_not_found)
+        ret['unknown'] = snps_not_found
+
+    except Exception as e:
+        response = jsonify(message=str(e))
+        response.status_code = 500
+        return response
+
+    return jsonify(ret)
+
+
+@api.route("/diff", methods=['GET', 'POST'])
+@support_jsonp
+def diff():
+    """Get the precomputed SNP differences between two Ensembl versions for
+    a particular species, one page at a time.
+
+    The following is a list of the valid parameters:
+
+    ============  =======  ==============================================
+    Param         Type     Description
+    ============  =======  ==============================================
+    from_version  integer  the older Ensembl version number
+    to_version    integer  the newer Ensembl version number
+    species       string   the species identifier (example 'Hs', 'Mm')
+    region        string   optional region like "1:10000000-10500000"
+    change        list     optional changes to get, any of 'added',
+                           'removed', 'moved', 'alleles' or 'renamed'
+    cursor        integer  the ``next`` value of the previous page
+    limit         integer  max number of items to return, defaults to 10,000
+    ============  =======  ==============================================
+
+    If successful, a JSON response will be returned with the following elements:
+
+    ==============  =======  ==================================================
+    Element         Type     Description
+    ==============  =======  ==================================================
+    num_snps        integer  the number of differences in this page
+    snps            list     a list of differences
+    next            integer  the cursor of the next page, null if no more
+    ==============  =======  ==================================================
+
+    The elements in the difference data are:
+        * change
+        * chromosome
+        * position
+        * SNP identifier
+        * reference allele
+        * alternate allele
+        * old chromosome
+        * old position
+        * old SNP identifier
+        * old reference allele
+        * old alternate allele
+
+    If a parameter is invalid, like an invalid region, a JSON response will
+    be sent back with just one element called ``message`` along with a
+    status code of 400.  If any other error occurs, the status code will be
+    500.
+
+    Returns:
+        :class:`flask.Response`: The response which is a JSON response.
+    """
+    log_call()
+
+    from_version = request.values.get('from_version', None)
+    to_version = request.values.get('to_version', None)
+    species = request.values.get('species', None)
+    region = request.values.get('region', None)
+    changes = request.values.getlist('change', None)
+    cursor = request.values.get('cursor', '0')
+    limit = request.values.get('limit', '10000')
+
+    try:
+        limit = min(int(limit), 100000)
+    except ValueError as ve:
+        limit = 10000
+        current_app.logger.info(ve)
+
+    ret = {
+        'num_snps': 0,
+        'snps': None,
+        'next': None
+    }
+
+    try:
+        if not from_version:
+            raise ValueError('No from_version specified')
+
+        if not to_version:
+            raise ValueError('No to_version specified')
+
+        if not species:
+            raise ValueError('No species specified')
+
+        result = search_ensimpl.diff(from_version, to_version, species,
+                                     region, changes, cursor, limit)
+
+        ret['num_snps'] = len(result['snps'])
+        ret['snps'] = result['snps']
+        ret['next'] = result['next']
+
+    except ValueError as e:
+        response = jsonify(message=str(e))
+        response.status_code = 400
+        return response
+    except Exception as e:
+        response = jsonify(message=str(e))
+        response.status_code = 500
+        return response
+
+    return jsonify(ret)
+
+
+@api.route("/genotypes", methods=['GET', 'POST'])
+@support_jsonp
+def genotypes():
+    """Get the genotypes of strains for the SNPs in a region for a
+    particular Ensembl version and species.  Only releases built with the
+    genotypes of a multi-sample VCF file have them.
+
+    The following is a list of the valid parameters:
+
     =======  =======  ===================================================
     Param    Type     Description
     =======  =======  ===================================================
     version  integer  the Ensembl version number
     species  string   the species identifier (example 'Hs', 'Mm')
     region   string   a region like "1:10000000-10500000"
+    strains  list     optional strains to get, defaults to all of them
     limit    string   max number of items to return, defaults to 100,000
     =======  =======  ===================================================
 
@@ -169,7 +837,8 @@ def region():
     ==============  =======  ==================================================
     Element         Type     Description
     ==============  =======  ==================================================
-    num_snps        integer  the number of snps found
+    strains         list     the strains, in the order of the genotypes
+    num_snps        integer  the number of snps
     snps            list     a list of snps, each element contains snp data
     ==============  =======  ==================================================
 
@@ -179,18 +848,23 @@ def region():
         * SNP identifier
         * reference allele
         * alternate allele
+        * the genotype of each strain, the number of alternate alleles called
+          (0, 1 or 2) or ``null`` when there is no call
 
-    If an error occurs, a JSON response will be sent back with just one
-    element called ``message`` along with a status code of 500.
+    If a parameter is invalid, like an unknown strain or a region outside of
+    its chromosome, a JSON response will be sent back with just one element
+    called ``message`` along with a status code of 400.  If any other error
+    occurs, the status code will be 500.
 
     Returns:
         :class:`flask.Response`: The response which is a JSON response.
     """
-    current_app.logger.debug('Call for: GET {}'.format(request.url))
+    log_call()
 
     version = request.values.get('version', None)
     species = request.values.get('species', None)
     region = request.values.get('region', None)
+    strains = requested_list('strains')
     limit = request.values.get('limit', '100000')
 
     try:
@@ -200,8 +874,9 @@ def region():
         current_app.logger.info(ve)
 
     ret = {
+        'strains': None,
         'num_snps': 0,
-        'snps': None,
+        'snps': None
     }
 
     try:
@@ -211,16 +886,23 @@ def region():
         if not species:
             raise ValueError('No species specified')
 
-        snps = search_ensimpl.by_region(region, version, species, limit)
+        if not region:
+            raise ValueError('No region specified')
 
-        ret['num_snps'] = len(snps)
-        ret['snps'] = snps
+        result = search_ensimpl.genotypes_by_region(region, version, species,
+                                                    strains, limit)
+
+        ret['strains'] = result['strains']
+        ret['num_snps'] = len(result['snps'])
+        ret['snps'] = result['snps']
 
+    except ValueError as e:
+        response = jsonify(message=str(e))
+        response.status_code = 400
+        return response
     except Exception as e:
         response = jsonify(message=str(e))
         response.status_code = 500
         return response
 
     return jsonify(ret)
-
-
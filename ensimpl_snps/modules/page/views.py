@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from flask import Blueprint, render_template
 
+import ensimpl_snps.fetch.warmup as warmup
+
 page = Blueprint('page', __name__, template_folder='templates')
 
 
@@ -24,3 +26,18 @@ def ping():
     """
     return 'OK!!!!'
 
+
+
+@page.route('/ready')
+def ready():
+    """A page for load balancers to test if requests can be sent here, which
+    is once the databases have been warmed up.
+
+    Returns:
+        :class:`flask.Response`: The response object with just 'READY' or
+        'WARMING UP' and a status code of 503.
+    """
+    if warmup.READY.is_set():
+        return 'READY'
+
+    return 'WARMING UP', 503
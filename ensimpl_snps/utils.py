@@ -8,12 +8,15 @@ from urllib.request import urlopen
 
 import bz2
 import gzip
+import itertools
 import logging
 import os
 import random
+import re
 import string
-
-import flask
+import sys
+import time
+import zlib
 
 logging.basicConfig(format='[ENsimpl] [%(asctime)s] %(message)s',
                     datefmt='%m/%d/%Y %I:%M:%S %p')
@@ -26,6 +29,34 @@ BIN_OFFSETS = [4096+512+64+8+1, 512+64+8+1, 64+8+1, 8+1, 1, 0]
 # for BED (0-based, half-open) or GFF (1-based, closed intervals)
 COORD_OFFSETS = {'bed': 0, 'gff': 1}
 
+# response encodings in order of preference when the client accepts several,
+# zstd and br are only used when zstandard or brotli is installed
+COMPRESS_ENCODINGS = ['zstd', 'br', 'gzip']
+
+# default compression level of each encoding
+COMPRESS_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+
+# responses smaller than this, in bytes, are not compressed
+COMPRESS_MIN_SIZE = 1024
+
+COMPRESS_MIMETYPES = ['application/json', 'application/javascript',
+                      'text/']
+
+# share of the log_event calls that are logged, set from the LOG_SAMPLE_RATE
+# setting by the web application
+LOG_SAMPLE_RATE = 1.0
+
+# the VCF columns that can be asked for as fields, any other field is an
+# INFO key
+VCF_FIELD_COLUMNS = {'QUAL': 5, 'FILTER': 6}
+VCF_INFO_COLUMN = 7
+
+REGEX_FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+
+# the classes of variants, the code stored for a class is its index
+VARIANT_CLASSES = ['snv', 'mnv', 'insertion', 'deletion', 'multi_allelic',
+                   'other']
+
 
 class ReverseProxied(object):
     """Wrap the application in this middleware and configure the front-end
@@ -91,6 +122,302 @@ class ReverseProxied(object):
         return self.app(environ, start_response)
 
 
+class _BrotliCompressor(object):
+    """Give a brotli compressor the methods of a zlib compressor."""
+    def __init__(self, compressor):
+        self.compressor = compressor
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+def get_compressors():
+    """Get the available response compressors.
+
+    Returns:
+        dict: A ``dict`` of encoding name to a function taking a compression
+        level and returning an object with the ``compress`` and ``flush``
+        methods of :func:`zlib.compressobj`.
+    """
+    compressors = {
+        'gzip': lambda level: zlib.compressobj(level, zlib.DEFLATED, 31)
+    }
+
+    try:
+        import zstandard
+        compressors['zstd'] = \
+            lambda level: zstandard.ZstdCompressor(level=level).compressobj()
+    except ImportError:
+        pass
+
+    try:
+        import brotli
+        compressors['br'] = \
+            lambda level: _BrotliCompressor(brotli.Compressor(quality=level))
+    except ImportError:
+        pass
+
+    return compressors
+
+
+def negotiate_encoding(accept_encoding, encodings):
+    """Pick the response encoding from an ``Accept-Encoding`` header.
+
+    Args:
+        accept_encoding (str): The ``Accept-Encoding`` header value.
+        encodings (list): The encodings available, in order of preference.
+
+    Returns:
+        str: The encoding with the highest quality value, ties going to the
+        first in `encodings`, or ``None`` if none is acceptable.
+    """
+    qualities = {}
+
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+
+        if not name:
+            continue
+
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        qualities['gzip' if name == 'x-gzip' else name] = quality
+
+    best, best_quality = None, 0.0
+
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+
+    return best
+
+
+class Compress(object):
+    """Middleware to compress responses with gzip, zstd or brotli, picked
+    from the ``Accept-Encoding`` request header.
+
+    Only JSON, JavaScript and text responses of at least `min_size` bytes are
+    compressed.  A response with a ``Content-Length`` is compressed whole and
+    sent with its compressed length, a streamed response is compressed chunk
+    by chunk as the application produces it, once `min_size` bytes have been
+    produced.  The bytes in and out, the ratio and the time spent compressing
+    are logged at the debug level for every compressed response.
+
+    Example:
+        Compress region responses faster than the rest::
+
+            app.wsgi_app = Compress(app.wsgi_app, endpoint_levels={
+                '/api/region': {'gzip': 4, 'br': 2, 'zstd': 1}
+            })
+    """
+    def __init__(self, app, min_size=COMPRESS_MIN_SIZE, levels=None,
+                 endpoint_levels=None, encodings=None, logger=None):
+        """Constructor.
+
+        Args:
+            app: The wsgi application.
+            min_size (int, optional): The size in bytes of the smallest
+                response to compress.
+            levels (dict, optional): The compression level of each encoding,
+                overriding :data:`COMPRESS_LEVELS`.
+            endpoint_levels (dict, optional): Path prefix to a ``dict`` of
+                compression levels overriding `levels` for the paths starting
+                with it, a level of ``None`` leaves the encoding unused.
+            encodings (list, optional): The encodings to use in order of
+                preference, defaults to :data:`COMPRESS_ENCODINGS`.
+            logger (logging.Logger, optional): The logger for the metrics.
+        """
+        self.app = app
+        self.min_size = min_size
+        self.levels = merge_two_dicts(COMPRESS_LEVELS, levels or {})
+        self.compressors = get_compressors()
+        self.encodings = [encoding for encoding in
+                          (encodings or COMPRESS_ENCODINGS)
+                          if encoding in self.compressors]
+        self.logger = logger or get_logger()
+
+        # longest prefix first so the most specific one matches
+        self.endpoint_levels = sorted((endpoint_levels or {}).items(),
+                                      key=lambda item: len(item[0]),
+                                      reverse=True)
+
+    def get_levels(self, path):
+        """Get the compression levels for the request `path`."""
+        for prefix, levels in self.endpoint_levels:
+            if path.startswith(prefix):
+                return merge_two_dicts(self.levels, levels)
+
+        return self.levels
+
+    def __call__(self, environ, start_response):
+        """
+        Middleware call.
+
+        Args:
+            environ (dict): The WSGI environment.
+                See :func:`flask.Flask.wsgi_app`
+            start_response: The response method.
+
+        Returns:
+            The response body.
+        """
+        levels = self.get_levels(environ.get('PATH_INFO', ''))
+        encoding = negotiate_encoding(
+            environ.get('HTTP_ACCEPT_ENCODING'),
+            [e for e in self.encodings if levels.get(e) is not None])
+
+        if not encoding or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+
+        return self._compress(environ, start_response, encoding,
+                              levels[encoding])
+
+    def _compressible(self, status, headers):
+        """Check the status and headers to see if a response is compressed.
+        """
+        if not status.startswith('2') or status.startswith('204'):
+            return False
+
+        values = {name.lower(): value for name, value in headers}
+
+        if 'content-encoding' in values:
+            return False
+
+        if 'no-transform' in values.get('cache-control', ''):
+            return False
+
+        content_type = values.get('content-type', '')
+        if not any(content_type.startswith(mimetype)
+                   for mimetype in COMPRESS_MIMETYPES):
+            return False
+
+        try:
+            return int(values['content-length']) >= self.min_size
+        except (KeyError, ValueError):
+            return True
+
+    def _compress(self, environ, start_response, encoding, level):
+        """Run the application and compress what it returns."""
+        response = {}
+        written = []
+
+        def _start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            response['exc_info'] = exc_info
+            return written.append
+
+        app_iter = self.app(environ, _start_response)
+
+        try:
+            chunks = itertools.chain(written, app_iter)
+
+            # the application may only start the response with its first
+            # chunk, and nothing is sent before it is known if the response
+            # will be compressed
+            pending = []
+            for chunk in chunks:
+                if chunk:
+                    pending.append(chunk)
+                    break
+
+            status = response['status']
+            headers = response['headers']
+
+            if not self._compressible(status, headers):
+                start_response(status, headers, response['exc_info'])
+                for chunk in itertools.chain(pending, chunks):
+                    yield chunk
+                return
+
+            has_length = any(name.lower() == 'content-length'
+                             for name, _ in headers)
+            size = sum(len(chunk) for chunk in pending)
+
+            # a streamed response is compressed when it reaches min_size, a
+            # response with a length is read whole to send the new length
+            for chunk in chunks:
+                if chunk:
+                    pending.append(chunk)
+                    size += len(chunk)
+                    if not has_length and size >= self.min_size:
+                        break
+
+            headers = [(name, value) for name, value in headers
+                       if name.lower() != 'vary']
+            vary = ', '.join(value for name, value in response['headers']
+                             if name.lower() == 'vary')
+            headers.append(('Vary', '{}, Accept-Encoding'.format(vary)
+                            if vary else 'Accept-Encoding'))
+
+            if size < self.min_size:
+                start_response(status, headers, response['exc_info'])
+                for chunk in pending:
+                    yield chunk
+                return
+
+            headers = [(name, value) for name, value in headers
+                       if name.lower() != 'content-length']
+            headers.append(('Content-Encoding', encoding))
+
+            compressor = self.compressors[encoding](level)
+            bytes_in = 0
+            bytes_out = 0
+            elapsed = 0.0
+
+            if has_length:
+                tstart = time.perf_counter()
+                data = b''.join(pending)
+                body = compressor.compress(data) + compressor.flush()
+                elapsed += time.perf_counter() - tstart
+
+                bytes_in, bytes_out = len(data), len(body)
+                headers.append(('Content-Length', str(bytes_out)))
+                start_response(status, headers, response['exc_info'])
+                yield body
+            else:
+                start_response(status, headers, response['exc_info'])
+
+                for chunk in itertools.chain(pending, chunks):
+                    tstart = time.perf_counter()
+                    data = compressor.compress(chunk)
+                    elapsed += time.perf_counter() - tstart
+                    bytes_in += len(chunk)
+
+                    if data:
+                        bytes_out += len(data)
+                        yield data
+
+                tstart = time.perf_counter()
+                data = compressor.flush()
+                elapsed += time.perf_counter() - tstart
+                bytes_out += len(data)
+                yield data
+
+            self.logger.debug(
+                '{} {} compressed {} level {}: {:,} -> {:,} bytes, '
+                'ratio {:.2f}, {:.1f}ms{}'.format(
+                    environ.get('REQUEST_METHOD'),
+                    environ.get('PATH_INFO'), encoding, level, bytes_in,
+                    bytes_out, bytes_in / max(bytes_out, 1), elapsed * 1000,
+                    '' if has_length else ' streamed'))
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
 def bins(start, stop, fmt='gff', one=True):
     """Uses the definition of a "genomic bin" described in Fig 7 of
     http://genome.cshlp.org/content/12/6/996.abstract.
@@ -145,12 +472,44 @@ def get_logger():
     Returns:
         logging.Logger: The logging object.
     """
-    if flask.current_app:
+    # flask is only loaded by the web application, there can be no app
+    # context when it has not been imported
+    flask = sys.modules.get('flask')
+
+    if flask and flask.has_app_context():
         return flask.current_app.logger
 
     return logging.getLogger(__name__)
 
 
+def log_event(logger, level, event, sample_rate=None, **fields):
+    """Log an event with its fields as sorted key=value pairs, like
+    "by_region done limit=100000 seconds=0.004".
+
+    Nothing is formatted unless `level` is enabled and the call is sampled,
+    so this can be used on hot paths.
+
+    Args:
+        logger (logging.Logger): The logger.
+        level (int): The logging level.
+        event (str): The event name.
+        sample_rate (float, optional): The share of calls to log, defaults to
+            :data:`LOG_SAMPLE_RATE`.
+        **fields: The values to log.
+    """
+    if not logger.isEnabledFor(level):
+        return
+
+    rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+
+    if rate < 1 and random.random() >= rate:
+        return
+
+    logger.log(level, '%s %s', event,
+               ' '.join('{}={}'.format(key, fields[key])
+                        for key in sorted(fields)))
+
+
 def configure_logging(level=0):
     """Configure the logger with the specified `level`. Valid `level` values
     are:
@@ -312,6 +671,57 @@ def merge_two_dicts(x, y):
     return z
 
 
+def merge_join(left, right, left_key, right_key=None):
+    """Walk two iterables that are both sorted by their keys in a single pass
+    and pair up the items with equal keys.  Items with the same key are
+    paired up in order, items without a partner are paired with ``None``.
+
+    Examples:
+        >>> list(merge_join([1, 2, 4], [2, 3, 4], lambda x: x))
+        [(1, None), (2, 2), (None, 3), (4, 4)]
+
+    Args:
+        left (iterable): The first sorted iterable.
+        right (iterable): The second sorted iterable.
+        left_key (function): Gets the key of an item in `left`.
+        right_key (function, optional): Gets the key of an item in `right`,
+            `left_key` is used if ``None``.
+
+    Yields:
+        tuple: A pair of (item in `left`, item in `right`).
+    """
+    right_key = right_key or left_key
+    left = iter(left)
+    right = iter(right)
+    done = object()
+
+    left_item = next(left, done)
+    right_item = next(right, done)
+
+    while left_item is not done and right_item is not done:
+        key_l = left_key(left_item)
+        key_r = right_key(right_item)
+
+        if key_l < key_r:
+            yield left_item, None
+            left_item = next(left, done)
+        elif key_l > key_r:
+            yield None, right_item
+            right_item = next(right, done)
+        else:
+            yield left_item, right_item
+            left_item = next(left, done)
+            right_item = next(right, done)
+
+    while left_item is not done:
+        yield left_item, None
+        left_item = next(left, done)
+
+    while right_item is not done:
+        yield None, right_item
+        right_item = next(right, done)
+
+
 def multikeysort(items, columns):
     """Sort a ``list`` of ``dicts`` by multiple keys in ascending or descending
     order. To sort in descending order, prepend a '-' (minus sign) on the
@@ -387,6 +797,57 @@ def open_resource(resource, mode='rb'):
         return open(resource, mode)
 
 
+def classify_variant(ref, alt):
+    """Get the class of a variant from its alleles, the same way the
+    databases classify their SNPs.
+
+    Args:
+        ref (str): The reference allele.
+        alt (str): The comma separated alternate alleles.
+
+    Returns:
+        str: One of :data:`VARIANT_CLASSES`.
+    """
+    if not alt or alt == '.':
+        return 'other'
+    elif ',' in alt:
+        return 'multi_allelic'
+    elif len(ref) == len(alt):
+        return 'snv' if len(ref) == 1 else 'mnv'
+    elif len(ref) < len(alt):
+        return 'insertion'
+
+    return 'deletion'
+
+
+def vcf_field(columns, field):
+    """Get the value of a field of a VCF line as written in the file.
+
+    Args:
+        columns (list): The columns of the line.
+        field (str): "QUAL", "FILTER" or an INFO key.
+
+    Returns:
+        str: The value, "1" for an INFO flag that is set and ``None`` when
+        the line has no value.
+    """
+    column = VCF_FIELD_COLUMNS.get(field)
+
+    if column is not None:
+        value = columns[column] if len(columns) > column else '.'
+        return None if value == '.' else value
+
+    if len(columns) <= VCF_INFO_COLUMN:
+        return None
+
+    for item in columns[VCF_INFO_COLUMN].split(';'):
+        key, separator, value = item.partition('=')
+        if key == field:
+            return value if separator else '1'
+
+    return None
+
+
 def str2bool(val):
     """Convert a string into a boolean.  Valid strings that return ``True``
     are: ``true``, ``1``, ``t``, ``y``, ``yes``
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+
+import threading
+import time
+
+import pytest
+
+from flask import Flask
+
+from ensimpl_snps.admission import AdmissionControl
+from ensimpl_snps.admission import create_lanes
+
+THREADS = 8
+
+LANES = {
+    'cheap': {'concurrency': 6, 'queue_size': 64, 'timeout': 5,
+              'retry_after': 1},
+    'expensive': {'concurrency': 2, 'queue_size': 8, 'timeout': 30,
+                  'retry_after': 30}
+}
+
+
+def create_app(release):
+    """Create an application with an expensive endpoint that runs until
+    `release` is set and a cheap endpoint."""
+    app = Flask(__name__)
+    app.config.update(ADMISSION_LANES=LANES, ADMISSION_THREADS=THREADS)
+
+    control = AdmissionControl()
+    control.estimators = {'expensive': lambda values, config: 100,
+                          'cheap': lambda values, config: 0}
+    control.init_app(app)
+
+    @app.route('/expensive')
+    def expensive():
+        release.wait(30)
+        return 'expensive'
+
+    @app.route('/cheap')
+    def cheap():
+        return 'cheap'
+
+    return app
+
+
+def get(app, path):
+    with app.test_client() as client:
+        return client.get(path).status_code
+
+
+def test_create_lanes_fits_threads():
+    lanes = create_lanes(LANES, THREADS)
+
+    assert lanes['expensive'].concurrency == 2
+    assert lanes['expensive'].queue_size == 0
+    assert lanes['cheap'].queue_size == 0
+
+    lanes = create_lanes(LANES, 16)
+
+    assert lanes['cheap'].queue_size == 8
+    assert lanes['expensive'].queue_size == 0
+
+    lanes = create_lanes(LANES, 100)
+
+    assert lanes['expensive'].queue_size == 8
+    assert lanes['cheap'].queue_size == 64
+
+
+def test_create_lanes_too_few_threads():
+    with pytest.raises(ValueError):
+        create_lanes(LANES, 4)
+
+
+def test_cheap_request_runs_with_expensive_lane_saturated():
+    release = threading.Event()
+    app = create_app(release)
+
+    # the worker threads of a gunicorn process
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        try:
+            expensive = [pool.submit(get, app, '/expensive')
+                         for _ in range(THREADS + 2)]
+
+            # the requests that do not fit in the expensive lane are
+            # rejected rather than left holding threads
+            deadline = time.time() + 5
+            while sum(future.done() for future in expensive) < THREADS and \
+                    time.time() < deadline:
+                time.sleep(0.01)
+
+            cheap = pool.submit(get, app, '/cheap')
+            assert cheap.result(timeout=5) == 200
+        finally:
+            release.set()
+
+        statuses = sorted(future.result() for future in expensive)
+
+    assert statuses.count(200) == 2
+    assert set(statuses) == {200, 429}
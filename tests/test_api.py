@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+
+import pysam
+import pytest
+
+import ensimpl_snps.create.create_ensimpl_snps as create_ensimpl_snps
+import ensimpl_snps.create.diff_db as diff_db
+
+from ensimpl_snps.app import create_app
+
+VCF = '''##fileformat=VCFv4.1
+##contig=<ID=1,length=100000>
+##contig=<ID=2,length=50000>
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tA_J\tCAST_EiJ
+1\t1000\trs1\tA\tG\t.\t.\t.\tGT\t1/1\t0/0
+1\t2000\trs2\tACGT\tA\t.\t.\t.\tGT\t0/0\t0/1
+1\t3000\trs3\tC\tT\t.\t.\t.\tGT\t./.\t1/1
+2\t500\trs4\tG\tGA\t.\t.\t.\tGT\t0/0\t1/1
+'''
+
+CONF = '''release\trelease_date\tassembly\tassembly_patch\tspecies_id\tspecies_name\tvcf_file
+91\t17-Dec\tGRCm38\tGRCm38.p5\tMm\tMus Musculus\tfile://{0}
+92\t18-Apr\tGRCm38\tGRCm38.p6\tMm\tMus Musculus\tfile://{0}
+'''
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    """A test client of an application serving two small releases and
+    their differences."""
+    directory = tmp_path_factory.mktemp('ensimpl_snps')
+
+    vcf_file = os.path.join(str(directory), 'Mus_musculus.vcf')
+    with open(vcf_file, 'w') as fd:
+        fd.write(VCF)
+    pysam.tabix_index(vcf_file, preset='vcf')
+
+    conf_file = os.path.join(str(directory), 'ensimpl_snps.conf')
+    with open(conf_file, 'w') as fd:
+        fd.write(CONF.format(vcf_file + '.gz'))
+
+    for version in ['91', '92']:
+        release_dir = os.path.join(str(directory), version)
+        os.makedirs(release_dir)
+
+        create_ensimpl_snps.create([version], ['Mm'], release_dir, conf_file,
+                                   genotypes=vcf_file + '.gz')
+
+        for extension in ['.gz', '.gz.tbi']:
+            shutil.copy(vcf_file + extension, release_dir)
+
+    diff_db.create(str(directory), 91, 92)
+
+    os.environ['ENSIMPL_SNPS_DIR'] = str(directory)
+    app = create_app({'DEBUG': False, 'DEBUG_TB_ENABLED': False})
+
+    return app.test_client()
+
+
+def get_region(client, region):
+    return client.get('/api/region?version=92&species=Mm&region={}'.format(
+        region))
+
+
+def test_region(client):
+    response = get_region(client, '1:1500-2500')
+
+    assert response.status_code == 200
+    assert response.get_json()['snps'] == [['1', 2000, 'rs2', 'ACGT', 'A']]
+
+
+def test_region_outside_of_chromosome(client):
+    response = get_region(client, '1:150000-200000')
+
+    assert response.status_code == 400
+    assert 'outside of chromosome' in response.get_json()['message']
+
+
+def test_region_unknown_chromosome(client):
+    response = get_region(client, '7:1-1000')
+
+    assert response.status_code == 400
+
+
+def get_genotypes(client, region, strains):
+    return client.get('/api/genotypes?version=92&species=Mm&region={}'
+                      '&strains={}'.format(region, strains))
+
+
+def test_genotypes(client):
+    response = get_genotypes(client, '1:1-2500', 'CAST_EiJ')
+
+    assert response.status_code == 200
+    assert response.get_json()['snps'] == [['1', 1000, 'rs1', 'A', 'G', 0],
+                                           ['1', 2000, 'rs2', 'ACGT', 'A', 1]]
+
+
+def test_genotypes_unknown_strain(client):
+    response = get_genotypes(client, '1:1-2500', 'S1')
+
+    assert response.status_code == 400
+    assert 'Unknown strain: S1' in response.get_json()['message']
+
+
+@pytest.mark.parametrize('url', [
+    '/api/snps?version=92&species=Mm&ids=rs1&variant_class=bogus',
+    '/api/snps?version=92&species=Mm',
+    '/api/nearest?version=92&species=Mm&position=Q:5',
+    '/api/flanking?version=92&species=Mm&position=Q:5',
+    '/api/density?version=92&species=Mm&region=1:150000-200000',
+    '/api/diff?from_version=91&to_version=92&species=Mm&region=bogus',
+    '/api/genotypes?version=92&species=Mm&region=1:150000-200000',
+])
+def test_invalid_parameters(client, url):
+    response = client.get(url)
+
+    assert response.status_code == 400
+    assert response.get_json()['message']
+
+
+def test_diff(client):
+    response = client.get('/api/diff?from_version=91&to_version=92'
+                          '&species=Mm&region=1:1-5000')
+
+    assert response.status_code == 200
+    assert response.get_json()['snps'] == []
+
+
+def test_density_matches_region(client):
+    response = client.get('/api/density?version=92&species=Mm'
+                          '&region=1:1000-3000&bin_size=1000')
+
+    assert response.status_code == 200
+    assert response.get_json()['bins'] == [['1', 1001, 2000, 1],
+                                           ['1', 2001, 3000, 1]]
+    assert get_region(client, '1:1000-3000').get_json()['num_snps'] == 2